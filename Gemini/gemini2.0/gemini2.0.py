@@ -164,6 +164,9 @@ def process_doctor(client, model, doctor_data):
                 ):
                     print(chunk.text, end="")
                     full_response += chunk.text
+                    # Encerra o stream assim que o bloco JSON estiver completo; o texto depois dele não é usado
+                    if '```' in chunk.text and re.search(r'```json\s*({[\s\S]*?})\s*```', full_response):
+                        break
 
                 # Extrair e atualizar dados
                 new_data = extract_json_from_text(full_response)
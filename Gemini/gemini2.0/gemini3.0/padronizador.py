@@ -1,13 +1,17 @@
 import pandas as pd
-import os
+import csv
 import json
 import re
 from datetime import datetime
 from google import genai
 from google.genai import types
 import concurrent.futures
+import threading
 import time
 
+# Quantidade de linhas lidas e processadas por vez
+BATCH_SIZE = 200
+
 def load_api_keys():
     """Carrega as chaves da API dos arquivos."""
     keys = []
@@ -50,9 +54,22 @@ Regras de padronização:
 
 Retorne um JSON com os dados padronizados, mantendo a mesma estrutura do input mas com os dados corrigidos."""
 
+# Um cliente por chave, reaproveitado por todas as linhas (mantém as conexões abertas)
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_key):
+    """Retorna o cliente da chave, criando-o apenas na primeira vez."""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = genai.Client(api_key=api_key)
+            _clients[api_key] = client
+        return client
+
 def process_row(row, api_key):
     """Processa uma linha usando a API do Gemini."""
-    client = genai.Client(api_key=api_key)
+    client = get_client(api_key)
     model = "gemini-1.5-flash"
     
     contents = [
@@ -105,14 +122,11 @@ def process_row(row, api_key):
         print(f"Erro ao processar CRM {row['CRM']}: {str(e)}")
         return row.to_dict()
 
-def process_chunk(chunk, api_key):
-    """Processa um chunk de linhas usando uma chave da API."""
-    results = []
-    for _, row in chunk.iterrows():
-        result = process_row(row, api_key)
-        results.append(result)
-        time.sleep(1)  # Pequeno delay para evitar rate limits
-    return results
+def process_row_with_delay(row, api_key):
+    """Processa uma linha e aguarda um pequeno delay para evitar rate limits."""
+    result = process_row(row, api_key)
+    time.sleep(1)
+    return result
 
 def main():
     # Carregar chaves da API
@@ -120,35 +134,37 @@ def main():
     if not api_keys:
         raise ValueError("Nenhuma chave de API encontrada!")
     
-    # Ler o CSV
-    df = pd.read_csv('output_20250605_004549.csv')
-    
-    # Dividir o DataFrame em chunks para processamento paralelo
-    chunk_size = max(1, len(df) // len(api_keys))
-    chunks = [df[i:i + chunk_size] for i in range(0, len(df), chunk_size)]
-    
-    # Ajustar o número de workers para o número de chaves disponíveis
-    num_workers = min(len(api_keys), len(chunks))
+    input_file = 'output_20250605_004549.csv'
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = f'output_standardized_{timestamp}.csv'
     
-    # Processar chunks em paralelo
-    all_results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-        future_to_chunk = {
-            executor.submit(process_chunk, chunk, api_keys[i % len(api_keys)]): i 
-            for i, chunk in enumerate(chunks)
-        }
-        
-        for future in concurrent.futures.as_completed(future_to_chunk):
-            chunk_results = future.result()
-            all_results.extend(chunk_results)
+    # O cabeçalho do arquivo de entrada define as colunas da saída
+    with open(input_file, 'r', encoding='utf-8', newline='') as f:
+        fieldnames = next(csv.reader(f))
     
-    # Criar novo DataFrame com resultados
-    result_df = pd.DataFrame(all_results)
+    # Lê o CSV em lotes e grava cada lote padronizado assim que fica pronto,
+    # mantendo a ordem original das linhas
+    total = 0
+    dropped = set()
+    with open(output_file, 'w', encoding='utf-8', newline='') as out, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=len(api_keys)) as executor:
+        writer = csv.DictWriter(out, fieldnames=fieldnames, restval='', extrasaction='ignore')
+        writer.writeheader()
+        # Células vazias ficam como '' (e não NaN), para saírem vazias também na saída
+        for batch in pd.read_csv(input_file, chunksize=BATCH_SIZE, keep_default_na=False):
+            rows = [row for _, row in batch.iterrows()]
+            keys = [api_keys[(total + i) % len(api_keys)] for i in range(len(rows))]
+            for result in executor.map(process_row_with_delay, rows, keys):
+                # As colunas da saída são as do input; chaves novas devolvidas pelo modelo são descartadas
+                new_keys = set(result) - set(fieldnames) - dropped
+                if new_keys:
+                    print(f"Chaves fora do cabeçalho do input descartadas: {', '.join(sorted(new_keys))}")
+                    dropped.update(new_keys)
+                writer.writerow(result)
+            out.flush()
+            total += len(rows)
+            print(f"{total} linhas padronizadas")
     
-    # Salvar resultados
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_file = f'output_standardized_{timestamp}.csv'
-    result_df.to_csv(output_file, index=False, encoding='utf-8')
     print(f"Arquivo padronizado salvo como: {output_file}")
 
 if __name__ == "__main__":
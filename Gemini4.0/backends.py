@@ -0,0 +1,128 @@
+from abc import ABC, abstractmethod
+
+from client_registry import ClientRegistry
+from context_cache import ContextCacheManager, is_missing_cache_error
+
+class LLMBackend(ABC):
+    """Interface dos backends de LLM usados pelo motor.
+
+    Um backend recebe o índice da chave escolhida pelo escalonador e executa a
+    chamada, devolvendo um objeto com `text` e `usage_metadata`. Só
+    `generate_content` é obrigatório; um backend sem ele falha ao ser criado.
+    """
+
+    @abstractmethod
+    async def generate_content(self, key_index, model, contents, config):
+        """Executa a chamada na chave `key_index` e devolve a resposta completa."""
+
+    async def generate_content_stream(self, key_index, model, contents, config):
+        """Iterador assíncrono com os pedaços da resposta; por padrão, a resposta inteira de uma vez."""
+        response = await self.generate_content(key_index, model, contents, config)
+
+        async def single():
+            yield response
+
+        return single()
+
+    async def close(self):
+        pass
+
+class GeminiBackend(LLMBackend):
+    """Backend que usa o cliente async do google-genai, um cliente por chave.
+
+    Os clientes vêm de um `ClientRegistry`, que mantém um pool de conexões
+    persistente por chave. Com `base_url`, as chamadas vão para outro servidor
+    compatível com a API do Gemini (por exemplo o `mock_server.py`, para testes
+    de carga sem cota). Com `context_cache_ttl`, o prefixo fixo das chamadas
+    (system instruction e ferramentas) é guardado em caches de contexto do
+    Gemini e referenciado em cada chamada; se o servidor não reconhecer mais o
+    cache, a chamada é refeita na hora com o prefixo inline e a próxima cria
+    um cache novo.
+    """
+
+    def __init__(self, api_keys, base_url=None, registry=None, logger=None, context_cache_ttl=None):
+        self.registry = registry or ClientRegistry(base_url=base_url)
+        self.logger = logger
+        self.clients = [self.registry.get(key) for key in api_keys]
+        self.context_cache = None
+        if context_cache_ttl:
+            self.context_cache = ContextCacheManager(self.clients, logger, ttl=context_cache_ttl)
+
+    async def _with_context_cache(self, key_index, model, config):
+        if self.context_cache is None:
+            return config
+        return await self.context_cache.apply(key_index, model, config)
+
+    def _expired_cache(self, key_index, model, config, sent_config, error):
+        """Indica se a chamada falhou porque o cache referenciado não existe mais (e o esquece).
+
+        A chamada é refeita com o prefixo inline, que não depende de nenhum cache.
+        """
+        name = getattr(sent_config, 'cached_content', None)
+        if self.context_cache is None or name is None or not is_missing_cache_error(error):
+            return False
+        self.context_cache.invalidate(key_index, model, config, name)
+        return True
+
+    async def generate_content(self, key_index, model, contents, config):
+        sent_config = await self._with_context_cache(key_index, model, config)
+        try:
+            return await self.clients[key_index].aio.models.generate_content(
+                model=model,
+                contents=contents,
+                config=sent_config,
+            )
+        except Exception as e:
+            if not self._expired_cache(key_index, model, config, sent_config, e):
+                raise
+        return await self.clients[key_index].aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=config,
+        )
+
+    async def generate_content_stream(self, key_index, model, contents, config):
+        client = self.clients[key_index]
+
+        async def chunks():
+            sent_config = await self._with_context_cache(key_index, model, config)
+            stream = None
+            started = False
+            try:
+                try:
+                    stream = await client.aio.models.generate_content_stream(
+                        model=model,
+                        contents=contents,
+                        config=sent_config,
+                    )
+                    async for chunk in stream:
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    # Depois do primeiro pedaço o erro não é do cache, e a resposta já começou
+                    if started or not self._expired_cache(key_index, model, config, sent_config, e):
+                        raise
+                stream = await client.aio.models.generate_content_stream(
+                    model=model,
+                    contents=contents,
+                    config=config,
+                )
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                # O encerramento antecipado pelo read_stream precisa chegar ao stream HTTP
+                aclose = getattr(stream, 'aclose', None)
+                if aclose is not None:
+                    await aclose()
+
+        return chunks()
+
+    async def close(self):
+        if self.context_cache is not None:
+            await self.context_cache.aclose()
+            if self.logger is not None:
+                self.logger.info(f"Cache de contexto: {self.context_cache.summary()}")
+        if self.logger is not None:
+            self.logger.info(f"Conexões HTTP: {self.registry.summary()}")
+        await self.registry.aclose()
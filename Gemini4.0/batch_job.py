@@ -0,0 +1,151 @@
+import json
+import time
+from google import genai
+from google.genai import types
+
+# Intervalo padrão entre consultas ao estado do job, em segundos
+DEFAULT_POLL_INTERVAL = 60
+
+# Estados em que o job não muda mais
+FINAL_STATES = {
+    'JOB_STATE_SUCCEEDED',
+    'JOB_STATE_PARTIALLY_SUCCEEDED',
+    'JOB_STATE_FAILED',
+    'JOB_STATE_CANCELLED',
+    'JOB_STATE_EXPIRED',
+}
+
+def _dump(value):
+    return value.model_dump(mode='json', by_alias=True, exclude_none=True)
+
+def build_batch_request(contents, config):
+    """Converte conteúdo e configuração da chamada no corpo de uma requisição da Batch API."""
+    request = {'contents': [_dump(content) for content in contents]}
+    generation_config = _dump(config)
+    tools = generation_config.pop('tools', None)
+    if tools:
+        request['tools'] = tools
+    system_instruction = generation_config.pop('systemInstruction', None)
+    if system_instruction:
+        if isinstance(system_instruction, str):
+            system_instruction = {'parts': [{'text': system_instruction}]}
+        request['systemInstruction'] = system_instruction
+    cached_content = generation_config.pop('cachedContent', None)
+    if cached_content:
+        request['cachedContent'] = cached_content
+    if generation_config:
+        request['generationConfig'] = generation_config
+    return request
+
+def write_batch_file(path, requests):
+    """Grava o arquivo JSONL do job a partir de pares (chave, requisição); retorna o total gravado."""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for key, request in requests:
+            f.write(json.dumps({'key': key, 'request': request}, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+def parse_batch_results(text):
+    """Lê o JSONL de resultados e devolve o texto da resposta de cada chave (None em caso de erro)."""
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get('response')
+        text_parts = []
+        if response and not entry.get('error'):
+            for candidate in response.get('candidates', [])[:1]:
+                for part in candidate.get('content', {}).get('parts', []):
+                    if part.get('text') and not part.get('thought'):
+                        text_parts.append(part['text'])
+        results[entry['key']] = ''.join(text_parts) or None
+    return results
+
+class GeminiBatchClient:
+    """Envia arquivos de requisições para a Batch API do Gemini.
+
+    Com `base_url`, os arquivos e jobs vão para outro servidor compatível com a API.
+    """
+
+    def __init__(self, api_key, base_url=None):
+        self.client = genai.Client(api_key=api_key, http_options=types.HttpOptions(base_url=base_url))
+
+    def submit(self, path, model, display_name):
+        """Faz o upload do arquivo e cria o job; retorna o nome do job."""
+        uploaded = self.client.files.upload(
+            file=path,
+            config=types.UploadFileConfig(display_name=display_name, mime_type='jsonl'),
+        )
+        job = self.client.batches.create(
+            model=model,
+            src=uploaded.name,
+            config=types.CreateBatchJobConfig(display_name=display_name),
+        )
+        return job.name
+
+    def get_state(self, job_name):
+        job = self.client.batches.get(name=job_name)
+        return getattr(job.state, 'name', str(job.state))
+
+    def download_results(self, job_name):
+        """Baixa o JSONL de resultados de um job concluído."""
+        job = self.client.batches.get(name=job_name)
+        content = self.client.files.download(file=job.dest.file_name)
+        return content.decode('utf-8')
+
+class LocalBatchClient:
+    """Substituto local da Batch API, com a mesma interface de `GeminiBatchClient`.
+
+    Cada requisição do arquivo é respondida por `responder(key, request)`, que
+    retorna o texto da resposta ou levanta uma exceção (gravada como erro). O
+    job fica em execução durante `polls_until_done` consultas, simulando a
+    espera da API real. Usado em testes e, com `--batch-api-local`, em
+    execuções sem cota (respondidas pelo `mock_server.batch_responder`).
+    """
+
+    def __init__(self, responder, polls_until_done=1):
+        self.responder = responder
+        self.polls_until_done = polls_until_done
+        self.jobs = {}
+
+    def submit(self, path, model, display_name):
+        job_name = f"batches/local-{len(self.jobs) + 1}"
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        self.jobs[job_name] = {'entries': entries, 'polls': 0}
+        return job_name
+
+    def get_state(self, job_name):
+        job = self.jobs[job_name]
+        job['polls'] += 1
+        if job['polls'] <= self.polls_until_done:
+            return 'JOB_STATE_RUNNING'
+        return 'JOB_STATE_SUCCEEDED'
+
+    def download_results(self, job_name):
+        lines = []
+        for entry in self.jobs[job_name]['entries']:
+            try:
+                text = self.responder(entry['key'], entry['request'])
+                result = {'key': entry['key'], 'response': {'candidates': [{'content': {'parts': [{'text': text}]}}]}}
+            except Exception as e:
+                result = {'key': entry['key'], 'error': {'message': str(e)}}
+            lines.append(json.dumps(result, ensure_ascii=False))
+        return '\n'.join(lines)
+
+def run_batch_job(batch_client, path, model, logger, display_name, poll_interval=DEFAULT_POLL_INTERVAL):
+    """Envia o arquivo, aguarda o job terminar e devolve os resultados por chave."""
+    job_name = batch_client.submit(path, model, display_name)
+    logger.info(f"Job em lote {job_name} criado a partir de {path}")
+    while True:
+        state = batch_client.get_state(job_name)
+        if state in FINAL_STATES:
+            break
+        logger.info(f"Job em lote {job_name} em andamento ({state}); nova consulta em {poll_interval}s")
+        time.sleep(poll_interval)
+    logger.info(f"Job em lote {job_name} finalizado com estado {state}")
+    if state not in ('JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED'):
+        return {}
+    return parse_batch_results(batch_client.download_results(job_name))
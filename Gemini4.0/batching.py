@@ -0,0 +1,108 @@
+import asyncio
+
+from journal import row_key
+from json_extract import extract_json_array
+
+# Configuração padrão do modo em lote (1 = desativado)
+DEFAULT_PROMPT_BATCH_SIZE = 1
+DEFAULT_BATCH_LINGER = 2.0
+
+BATCH_INSTRUCTIONS = """
+**MODO EM LOTE:** Os dados acima são uma LISTA com {count} médicos diferentes, cada um identificado pelo campo "id".
+Execute a tarefa para CADA médico separadamente, sem misturar informações entre eles.
+Em vez de um único objeto, retorne APENAS um array JSON com um objeto por médico, no formato pedido acima,
+incluindo em cada objeto o mesmo "id" recebido. Não omita nenhum médico.
+"""
+
+class PromptBatcher:
+    """Agrupa vários médicos da mesma iteração em uma única chamada ao Gemini.
+
+    Cada linha chama `submit(iteration, data)` e aguarda. Os pedidos de uma
+    mesma iteração são acumulados até `batch_size` médicos ou até `linger`
+    segundos, enviados como um array JSON com um "id" estável por médico e a
+    resposta é separada de volta por "id". Médicos ausentes ou inválidos na
+    resposta recebem None, e a linha refaz a iteração individualmente.
+    """
+
+    def __init__(self, engine, model, prompt_builder, request_builder, logger,
+                 batch_size=DEFAULT_PROMPT_BATCH_SIZE, linger=DEFAULT_BATCH_LINGER):
+        self.engine = engine
+        self.model = model
+        self.prompt_builder = prompt_builder
+        self.request_builder = request_builder
+        self.logger = logger
+        self.batch_size = batch_size
+        self.linger = linger
+        self.pending = {}
+        self.timers = {}
+        self.batches = 0
+        self.submitted = 0
+        self.answered = 0
+
+    async def submit(self, iteration, data):
+        """Inclui o médico no próximo lote da iteração e retorna o JSON dele (ou None)."""
+        pending = self.pending.setdefault(iteration, {})
+        doctor_id = row_key(data)
+        suffix = 1
+        while doctor_id in pending:
+            suffix += 1
+            doctor_id = f"{row_key(data)}#{suffix}"
+        future = asyncio.get_running_loop().create_future()
+        pending[doctor_id] = (data, future)
+
+        if len(pending) >= self.batch_size:
+            self._flush(iteration)
+        elif iteration not in self.timers:
+            self.timers[iteration] = asyncio.get_running_loop().call_later(self.linger, self._flush, iteration)
+        return await future
+
+    def _flush(self, iteration):
+        """Retira o lote pendente da iteração e dispara o envio."""
+        timer = self.timers.pop(iteration, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(iteration, None)
+        if batch:
+            asyncio.ensure_future(self._send(iteration, batch))
+
+    async def _send(self, iteration, batch):
+        self.batches += 1
+        self.submitted += len(batch)
+        records = [dict(data, id=doctor_id) for doctor_id, (data, _) in batch.items()]
+        prompt_text = self.prompt_builder(records, iteration) + BATCH_INSTRUCTIONS.format(count=len(records))
+        contents, config = self.request_builder(prompt_text, iteration)
+        cache_key = self.engine.cache_key(self.model, prompt_text, config)
+        results = {}
+        try:
+            response = await self.engine.generate_content(
+                model=self.model,
+                contents=contents,
+                config=config,
+                prompt_text=prompt_text,
+                cache_key=cache_key,
+                json_kind='array',
+            )
+            items = extract_json_array(response.text or '') if response is not None else None
+            if items is None:
+                self.logger.error(f"Resposta em lote da iteração {iteration + 1} sem array JSON válido; "
+                                  f"{len(batch)} médicos serão processados individualmente")
+            else:
+                for item in items:
+                    if isinstance(item, dict) and item.get('id') in batch:
+                        results[item.pop('id')] = item
+                self.answered += len(results)
+                if len(results) == len(batch):
+                    self.engine.remember(cache_key, response.text)
+                self.logger.info(f"Lote da iteração {iteration + 1}: {len(results)} de {len(batch)} médicos na resposta")
+        except Exception as e:
+            self.logger.error(f"Erro na chamada em lote da iteração {iteration + 1}: {str(e)}")
+
+        for doctor_id, (_, future) in batch.items():
+            if not future.done():
+                future.set_result(results.get(doctor_id))
+
+    def summary(self):
+        """Aproveitamento dos lotes: médicos respondidos na resposta do lote sobre os enviados."""
+        ratio = self.answered / self.submitted if self.submitted else 0.0
+        return (f"{self.batches} lotes, {self.answered} de {self.submitted} médicos respondidos no lote ({ratio:.0%}); "
+                f"os demais refizeram a iteração individualmente")
@@ -0,0 +1,78 @@
+import argparse
+import json
+import re
+import time
+
+from json_extract import JsonExtractor, extract_json_object
+from mock_server import CANNED_RESPONSES
+
+def legacy_regex_extract(response_text):
+    """Caminho antigo do process_row: bloco ```json, regex não-gulosa e, se falhar, regex gulosa."""
+    json_match = re.search(r'```json\n({.*?})\n```', response_text, re.DOTALL)
+    if not json_match:
+        json_match = re.search(r'({.*?})', response_text, re.DOTALL)
+    if not json_match:
+        return None
+    try:
+        return json.loads(json_match.group(1))
+    except json.JSONDecodeError:
+        try:
+            return json.loads(re.search(r'({.*})', response_text, re.DOTALL).group(1))
+        except Exception:
+            return None
+
+def streaming_extract(response_text, chunk_size=64):
+    """Extrator incremental alimentado em pedaços, como chegam de `generate_content_stream`."""
+    extractor = JsonExtractor()
+    for i in range(0, len(response_text), chunk_size):
+        result = extractor.feed(response_text[i:i + chunk_size])
+        if result is not None:
+            return result
+    return None
+
+def synthetic_corpus():
+    """Variações das respostas padrão do mock com os formatos que o modelo costuma devolver."""
+    corpus = []
+    for text in CANNED_RESPONSES.values():
+        body = text.replace('```json\n', '').replace('\n```', '')
+        nested = body.replace('{\n', '{\n  "fontes": {"site": "https://clinica.com.br", "crm": {"uf": "SP"}},\n', 1)
+        corpus.extend([
+            text,
+            body,
+            f"Aqui estão os dados encontrados:\n{text}\nObservação: os dados foram verificados em {{fontes públicas}}.",
+            text.replace('\n', '\r\n'),
+            f"```json\n{nested}\n```",
+            f"Segue o resultado {{resumo}} da busca:\n{nested}\nFonte: {{CRM}}",
+        ])
+    return corpus
+
+def load_corpus(path):
+    """Lê um corpus gravado (JSONL com o campo "text", mesmo formato do mock_server)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)['text'] for line in f if line.strip()]
+
+def bench(name, function, corpus, repeat):
+    parsed = sum(1 for text in corpus if isinstance(function(text), dict))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            function(text)
+    elapsed = time.perf_counter() - start
+    per_call = elapsed / (repeat * len(corpus)) * 1e6
+    print(f"{name:<28} {parsed:>4}/{len(corpus):<4} {per_call:>10.1f} µs/resposta")
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark da extração de JSON das respostas do Gemini.")
+    parser.add_argument('--corpus', help="Arquivo JSONL com respostas gravadas (campo \"text\")")
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    print(f"Corpus: {len(corpus)} respostas, {args.repeat} repetições")
+    print(f"{'método':<28} {'JSON ok':>9} {'tempo':>13}")
+    bench('regex (caminho antigo)', legacy_regex_extract, corpus, args.repeat)
+    bench('extrator de uma passada', extract_json_object, corpus, args.repeat)
+    bench('extrator em stream (64 B)', streaming_extract, corpus, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import httpx
+from google import genai
+from google.genai import types
+
+# HTTP/2 depende do pacote opcional `h2` (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Configuração padrão do pool de conexões de cada chave
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_MAX_KEEPALIVE = 32
+DEFAULT_KEEPALIVE_EXPIRY = 120.0
+
+class ConnectionStats:
+    """Conta requisições HTTP e conexões novas para medir o reaproveitamento do pool."""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+
+    @property
+    def reused(self):
+        return max(0, self.requests - self.new_connections)
+
+    async def on_request(self, request):
+        self.requests += 1
+        request.extensions['trace'] = self.trace
+
+    async def trace(self, event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            self.new_connections += 1
+
+class ClientRegistry:
+    """Registro de clientes do google-genai: um cliente de longa duração por chave.
+
+    Cada cliente usa um `httpx.AsyncClient` próprio com keep-alive e pool de
+    conexões ajustados (HTTP/2 quando o pacote `h2` está instalado), e é
+    compartilhado por todas as chamadas feitas com aquela chave.
+    """
+
+    def __init__(self, base_url=None, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive=DEFAULT_MAX_KEEPALIVE, keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY, http2=None):
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = HTTP2_AVAILABLE if http2 is None else http2
+        self.stats = ConnectionStats()
+        self.clients = {}
+        self.http_clients = []
+
+    def get(self, api_key):
+        """Retorna o cliente da chave, criando-o na primeira chamada."""
+        client = self.clients.get(api_key)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.limits,
+                timeout=None,
+                event_hooks={'request': [self.stats.on_request]},
+            )
+            self.http_clients.append(http_client)
+            client = genai.Client(
+                api_key=api_key,
+                http_options=types.HttpOptions(base_url=self.base_url, httpx_async_client=http_client),
+            )
+            self.clients[api_key] = client
+        return client
+
+    def summary(self):
+        """Resumo do reaproveitamento de conexões."""
+        stats = self.stats
+        ratio = stats.reused / stats.requests if stats.requests else 0.0
+        protocol = "HTTP/2" if self.http2 else "HTTP/1.1"
+        return (f"{stats.requests} requisições {protocol}, {stats.new_connections} conexões novas, "
+                f"{stats.reused} reaproveitadas ({ratio:.0%})")
+
+    async def aclose(self):
+        # Clientes httpx informados ao genai precisam ser fechados por quem os criou
+        for http_client in self.http_clients:
+            await http_client.aclose()
+        self.http_clients = []
+        self.clients = {}
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import time
+from google.genai import types
+
+from rate_limiter import CHARS_PER_TOKEN
+
+# Validade padrão dos caches de contexto, em segundos
+DEFAULT_CONTEXT_CACHE_TTL = 3600
+
+# O TTL é renovado quando falta menos que esta fração da validade para expirar
+REFRESH_FRACTION = 0.25
+
+# Tamanho mínimo aceito pela API para um cache explícito nos modelos Flash
+MIN_CACHE_TOKENS = 1024
+
+def is_missing_cache_error(exc):
+    """Indica se a exceção é de um cache de contexto que expirou ou foi apagado no servidor."""
+    return getattr(exc, 'code', None) in (400, 403, 404) and 'cachedcontent' in str(exc).lower().replace(' ', '')
+
+class CachedPrefix:
+    """Cache de contexto criado para um prefixo em uma chave."""
+
+    def __init__(self, name=None, expires_at=0.0, tokens=0):
+        self.name = name
+        self.expires_at = expires_at
+        self.tokens = tokens
+        self.lock = asyncio.Lock()
+
+class ContextCacheManager:
+    """Mantém no Gemini um cache de contexto por prefixo fixo (system instruction + ferramentas).
+
+    Cada chave da API tem seus próprios caches, pois eles pertencem ao projeto
+    da chave. `apply` troca a system instruction e as ferramentas da chamada
+    pela referência `cached_content`, criando o cache na primeira vez e
+    renovando o TTL quando ele está perto de expirar. Prefixos menores que o
+    mínimo da API, ou cuja criação falhar, continuam indo inline. Se o cache
+    expirar ou for apagado no servidor (renovação que falhou, execução parada
+    por muito tempo), `invalidate` esquece a referência e a próxima chamada
+    cria outro.
+    """
+
+    def __init__(self, clients, logger, ttl=DEFAULT_CONTEXT_CACHE_TTL, min_tokens=MIN_CACHE_TOKENS):
+        self.clients = clients
+        self.logger = logger
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.prefixes = {}
+        self.skipped = set()
+        self.hits = 0
+        self.created = 0
+        self.refreshed = 0
+        self.expired = 0
+
+    @staticmethod
+    def prefix_signature(model, config):
+        """Hash do modelo, da system instruction e das ferramentas da chamada (None se não houver prefixo)."""
+        if config is None or config.system_instruction is None:
+            return None
+        payload = json.dumps({
+            'model': model,
+            'system_instruction': _dump(config.system_instruction),
+            'tools': [_dump(tool) for tool in config.tools or []],
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def apply(self, key_index, model, config):
+        """Retorna a configuração da chamada apontando para o cache do prefixo, quando possível."""
+        signature = self.prefix_signature(model, config)
+        if signature is None or signature in self.skipped:
+            return config
+
+        prefix = self.prefixes.setdefault((key_index, signature), CachedPrefix())
+        async with prefix.lock:
+            if prefix.name is not None and prefix.expires_at - time.monotonic() < self.ttl * REFRESH_FRACTION:
+                await self._refresh(key_index, prefix)
+            if prefix.name is None:
+                if not await self._create(key_index, model, config, signature, prefix):
+                    return config
+
+        self.hits += 1
+        return config.model_copy(update={
+            'system_instruction': None,
+            'tools': None,
+            'tool_config': None,
+            'cached_content': prefix.name,
+        })
+
+    def invalidate(self, key_index, model, config, name):
+        """Esquece o cache `name` do prefixo de `config`, que o servidor não reconhece mais.
+
+        Só vale se `name` ainda for o cache atual: várias chamadas podem falhar
+        com o mesmo cache, e a primeira a chegar aqui já pode ter criado outro.
+        """
+        prefix = self.prefixes.get((key_index, self.prefix_signature(model, config)))
+        if prefix is None or prefix.name != name:
+            return
+        prefix.name = None
+        self.expired += 1
+        self.logger.warning(f"Cache de contexto {name} expirou ou foi apagado na chave {key_index + 1}; "
+                            f"ele será recriado")
+
+    async def _create(self, key_index, model, config, signature, prefix):
+        tokens = len(json.dumps(_dump(config.system_instruction), ensure_ascii=False)) // CHARS_PER_TOKEN
+        if tokens < self.min_tokens:
+            self.skipped.add(signature)
+            self.logger.warning(f"Prefixo de ~{tokens} tokens abaixo do mínimo de {self.min_tokens} para cache "
+                                f"de contexto; ele continuará sendo enviado em cada chamada")
+            return False
+        try:
+            cached = await self.clients[key_index].aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=config.system_instruction,
+                    tools=config.tools,
+                    tool_config=config.tool_config,
+                    ttl=f"{int(self.ttl)}s",
+                    display_name=f"gemini4.0-{signature[:12]}",
+                ),
+            )
+        except Exception as e:
+            self.skipped.add(signature)
+            self.logger.warning(f"Não foi possível criar o cache de contexto na chave {key_index + 1}: {str(e)}; "
+                                f"o prefixo continuará sendo enviado em cada chamada")
+            return False
+        prefix.name = cached.name
+        prefix.tokens = getattr(cached.usage_metadata, 'total_token_count', None) or tokens
+        prefix.expires_at = time.monotonic() + self.ttl
+        self.created += 1
+        self.logger.info(f"Cache de contexto {cached.name} criado na chave {key_index + 1} ({prefix.tokens} tokens)")
+        return True
+
+    async def _refresh(self, key_index, prefix):
+        try:
+            await self.clients[key_index].aio.caches.update(
+                name=prefix.name,
+                config=types.UpdateCachedContentConfig(ttl=f"{int(self.ttl)}s"),
+            )
+        except Exception as e:
+            if is_missing_cache_error(e):
+                # Já expirou no servidor: `apply` cria outro em seguida
+                self.logger.warning(f"Cache de contexto {prefix.name} não existe mais; ele será recriado")
+                prefix.name = None
+                self.expired += 1
+                return
+            # Se a renovação falhar, o cache ainda vale até expirar; tenta de novo na próxima chamada
+            self.logger.warning(f"Falha ao renovar o cache de contexto {prefix.name}: {str(e)}")
+            return
+        prefix.expires_at = time.monotonic() + self.ttl
+        self.refreshed += 1
+        self.logger.debug(f"TTL do cache de contexto {prefix.name} renovado por {self.ttl}s")
+
+    async def aclose(self):
+        """Apaga os caches criados, para não pagar o armazenamento além da execução."""
+        for (key_index, _), prefix in self.prefixes.items():
+            if prefix.name is None:
+                continue
+            try:
+                await self.clients[key_index].aio.caches.delete(name=prefix.name)
+            except Exception as e:
+                self.logger.warning(f"Falha ao apagar o cache de contexto {prefix.name}: {str(e)}")
+
+    def summary(self):
+        return (f"{self.created} caches criados, {self.refreshed} renovações, {self.expired} recriados após expirar, "
+                f"{self.hits} chamadas com prefixo em cache, {len(self.skipped)} prefixos enviados inline")
+
+def _dump(value):
+    if hasattr(value, 'model_dump'):
+        return value.model_dump(mode='json', exclude_none=True)
+    return value
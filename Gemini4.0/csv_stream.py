@@ -0,0 +1,45 @@
+import csv
+from itertools import islice
+
+# Quantidade de linhas lidas do CSV de entrada por vez
+DEFAULT_BATCH_SIZE = 1000
+
+def read_csv_header(path):
+    """Lê apenas o cabeçalho do CSV."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return next(csv.reader(f), [])
+
+def iter_csv_batches(path, batch_size=DEFAULT_BATCH_SIZE):
+    """Lê o CSV em lotes de até `batch_size` linhas (dicts), sem carregar o arquivo inteiro."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        while True:
+            batch = list(islice(reader, batch_size))
+            if not batch:
+                return
+            yield batch
+
+def iter_csv_rows(path, batch_size=DEFAULT_BATCH_SIZE):
+    """Itera sobre as linhas do CSV, lidas em lotes."""
+    for batch in iter_csv_batches(path, batch_size):
+        yield from batch
+
+class StreamingCsvWriter:
+    """Escreve linhas no CSV de saída à medida que ficam prontas."""
+
+    def __init__(self, path, fieldnames):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, restval='', extrasaction='ignore')
+        self.writer.writeheader()
+        self.file.flush()
+        self.rows_written = 0
+
+    def write(self, row):
+        self.writer.writerow(row)
+        # Flush a cada linha para o arquivo acompanhar o processamento em tempo real
+        self.file.flush()
+        self.rows_written += 1
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,117 @@
+import asyncio
+import csv
+import re
+
+from journal import is_blank, row_key
+
+# Colunas que pertencem a cada linha (identificação como veio no input e controle) e não são copiadas entre duplicatas
+ROW_OWN_FIELDS = ['Hash', 'CRM', 'UF', 'OPT-IN', 'STATUS', 'LOTE']
+
+def doctor_key(row):
+    """CRM+UF normalizados (CRM só com dígitos, sem zeros à esquerda), ou None se faltar algum."""
+    crm = re.sub(r'\D', '', '' if is_blank(row.get('CRM')) else str(row['CRM'])).lstrip('0')
+    uf = '' if is_blank(row.get('UF')) else str(row['UF']).strip().upper()
+    if not crm or not uf:
+        return None
+    return f"{crm}/{uf}"
+
+class DuplicateIndex:
+    """Resultado da varredura do input: os médicos repetidos, quantas vezes e em quais linhas aparecem.
+
+    Só os médicos que aparecem mais de uma vez ficam guardados; os demais
+    (contagem 1) não ocupam memória depois da varredura.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.positions = {}
+        self.total_rows = 0
+
+    @property
+    def duplicates(self):
+        """Médicos que aparecem mais de uma vez, com as posições das linhas."""
+        return self.positions
+
+    @property
+    def collapsed_rows(self):
+        """Quantidade de linhas que não precisam ser enviadas à API."""
+        return sum(count - 1 for count in self.counts.values())
+
+def scan_duplicates(rows):
+    """Percorre as linhas (em stream) e registra os CRM+UF que aparecem mais de uma vez."""
+    index = DuplicateIndex()
+    # Primeira posição de cada médico, só durante a varredura
+    first_seen = {}
+    for position, row in enumerate(rows):
+        index.total_rows += 1
+        key = doctor_key(row)
+        if key is None:
+            continue
+        first = first_seen.setdefault(key, position)
+        if first == position:
+            continue
+        if key not in index.positions:
+            index.positions[key] = [first]
+            index.counts[key] = 1
+        index.positions[key].append(position)
+        index.counts[key] += 1
+    return index
+
+def write_duplicates_report(path, index):
+    """Grava o relatório das duplicatas agrupadas (uma linha por médico repetido)."""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['CRM/UF', 'ocorrencias', 'linhas'])
+        for key, positions in sorted(index.duplicates.items()):
+            # Posições 1-based, contando só as linhas de dados do CSV
+            writer.writerow([key, len(positions), ';'.join(str(position + 1) for position in positions)])
+
+class RowDeduplicator:
+    """Enriquece cada médico uma única vez e replica o resultado para as linhas repetidas.
+
+    A primeira linha de cada CRM+UF é processada normalmente; as outras
+    aguardam o resultado dela e recebem uma cópia, mantendo as próprias
+    colunas de identificação e controle (`ROW_OWN_FIELDS`). O resultado fica
+    guardado apenas até a última ocorrência do médico, conforme a contagem do
+    `DuplicateIndex`.
+    """
+
+    def __init__(self, index, logger, journal=None):
+        self.counts = index.counts
+        self.logger = logger
+        self.journal = journal
+        self.shared = {}
+        self.fanned_out = 0
+
+    async def process(self, row, process):
+        """Executa `process()` para a primeira ocorrência do médico e reaproveita o resultado nas demais."""
+        key = doctor_key(row)
+        if key is None or self.counts.get(key, 0) <= 1:
+            return await process()
+
+        entry = self.shared.get(key)
+        if entry is None:
+            future = asyncio.get_running_loop().create_future()
+            entry = self.shared[key] = {'future': future, 'remaining': self.counts[key]}
+            try:
+                result = await process()
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+        else:
+            shared_result = await asyncio.shield(entry['future'])
+            result = dict(shared_result)
+            for field in ROW_OWN_FIELDS:
+                if field in row:
+                    result[field] = row[field]
+            self.fanned_out += 1
+            self.logger.info(f"CRM {row['CRM']}/{row.get('UF', '')} repetido no input; resultado replicado sem novas chamadas")
+            if self.journal is not None:
+                self.journal.record(row_key(row), 8, result, done=True)
+
+        entry['remaining'] -= 1
+        if entry['remaining'] <= 0:
+            del self.shared[key]
+        return result
@@ -0,0 +1,197 @@
+import asyncio
+import time
+from backends import GeminiBackend
+from rate_limiter import RateLimiter, DEFAULT_RPM, DEFAULT_TPM, estimate_tokens, retry_after_seconds
+from scheduler import KeyScheduler
+from response_cache import CachedResponse, ResponseCache
+from retry_policy import KEY_ERROR_CLASSES, classify_exception
+from streaming import StreamStats, read_stream
+from metrics import Metrics
+
+# Limites padrão do motor assíncrono
+DEFAULT_CONCURRENCY_PER_KEY = 8
+DEFAULT_MAX_IN_FLIGHT = 256
+
+async def aenumerate(items):
+    """`enumerate` para iteráveis síncronos ou assíncronos."""
+    position = 0
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield position, item
+            position += 1
+    else:
+        for item in items:
+            yield position, item
+            position += 1
+
+class EnrichmentEngine:
+    """Motor assíncrono que mantém várias linhas em processamento ao mesmo tempo.
+
+    As linhas saem de uma fila única e cada chamada `generate_content` é
+    enviada ao backend (por padrão o Gemini) com a chave escolhida pelo escalonador (`KeyScheduler`), que limita as
+    chamadas simultâneas por chave e coloca em cooldown as chaves com erros.
+    Um limitador de cota (RPM/TPM) por chave libera cada chamada e, se houver
+    um `ResponseCache`, respostas já obtidas em execuções anteriores são
+    servidas sem ir à rede. Com `streaming`, as respostas são lidas em stream e
+    a conexão é encerrada assim que um JSON completo chega. As latências, erros
+    e tokens de cada chamada são registrados em `metrics`.
+    """
+
+    def __init__(self, api_keys, logger, concurrency_per_key=DEFAULT_CONCURRENCY_PER_KEY,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM,
+                 cache=None, backend=None, streaming=False, metrics=None):
+        if not api_keys:
+            raise ValueError("Nenhuma chave de API informada para o motor!")
+        self.api_keys = api_keys
+        self.logger = logger
+        self.concurrency_per_key = concurrency_per_key
+        self.max_in_flight = max_in_flight
+        self.backend = backend or GeminiBackend(api_keys)
+        self.rate_limiter = RateLimiter(len(api_keys), rpm=rpm, tpm=tpm)
+        self.scheduler = KeyScheduler(len(api_keys), concurrency_per_key, self.rate_limiter, logger)
+        self.cache = cache
+        self.streaming = streaming
+        self.stream_stats = StreamStats()
+        self.metrics = metrics or Metrics()
+        self.rows_queued = 0
+        self.rows_in_flight = 0
+
+    def cache_key(self, model, prompt_text, config):
+        """Chave do cache para a chamada, ou None se o cache estiver desativado."""
+        if self.cache is None:
+            return None
+        return ResponseCache.make_key(model, prompt_text, config)
+
+    def remember(self, cache_key, response_text):
+        """Guarda no cache uma resposta que foi processada com sucesso."""
+        if self.cache is not None and cache_key is not None:
+            self.cache.put(cache_key, response_text)
+
+    async def generate_content(self, model, contents, config, prompt_text='', cache_key=None, json_kind='object'):
+        """Chama a API com a chave que tiver capacidade, respeitando a cota dela.
+
+        `json_kind` ('object' ou 'array') indica o JSON esperado, usado no modo
+        streaming para saber quando a resposta já pode ser encerrada.
+        """
+        if self.cache is not None and cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.metrics.inc('gemini_cache_hits_total')
+                return CachedResponse(cached)
+
+        estimated = estimate_tokens(prompt_text)
+        key_index = await self.scheduler.acquire(estimated)
+        limiter = self.rate_limiter.for_key(key_index)
+        error = None
+        key_label = key_index + 1
+        try:
+            await limiter.acquire(estimated)
+            call_started = time.monotonic()
+            if self.streaming:
+                started = time.monotonic()
+                chunks = await self.backend.generate_content_stream(key_index, model, contents, config)
+                response = await read_stream(chunks, json_kind, started)
+                self.stream_stats.record(response)
+            else:
+                response = await self.backend.generate_content(key_index, model, contents, config)
+        except Exception as e:
+            error_class = classify_exception(e)
+            self.metrics.inc('gemini_request_errors_total', key=key_label, error_class=error_class)
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                self.metrics.inc('gemini_rate_limited_total', key=key_label)
+                self.logger.warning(f"Cota excedida na chave {key_index + 1}; aguardando {retry_after:.1f}s antes de usá-la novamente")
+                limiter.block_for(retry_after)
+                # O limitador segura a chave pelo Retry-After; a falha também conta para o
+                # circuit breaker, para que uma chave que só devolve 429 saia de rotação
+                error = e
+            elif error_class in KEY_ERROR_CLASSES:
+                # Erros da própria requisição (400, 404) não dizem nada sobre a chave; os demais afetam a saúde dela
+                error = e
+            raise
+        finally:
+            await self.scheduler.release(key_index, error)
+        self.metrics.observe('gemini_request_seconds', time.monotonic() - call_started, key=key_label)
+        self.metrics.inc('gemini_requests_total', key=key_label)
+        usage = getattr(response, 'usage_metadata', None)
+        limiter.record_usage(estimated, getattr(usage, 'total_token_count', None))
+        self.metrics.inc('gemini_tokens_total', getattr(usage, 'prompt_token_count', None) or 0, direction='entrada')
+        self.metrics.inc('gemini_tokens_total', getattr(usage, 'candidates_token_count', None) or 0, direction='saida')
+        return response
+
+    async def run(self, items, handler, on_result, max_pending=None):
+        """Executa `handler(item)` para cada item e entrega os resultados em ordem a `on_result`.
+
+        `items` pode ser qualquer iterável, síncrono ou assíncrono (inclusive um
+        gerador que lê o CSV em lotes ou as linhas reservadas na fila
+        distribuída). Um item só é lido de `items` quando há um worker livre para
+        ele. Os resultados que terminam fora de ordem ficam em um buffer de
+        reordenação; `max_pending` limita quantos itens podem estar despachados
+        e ainda não entregues, mantendo a memória constante. Retorna o total de
+        itens processados.
+        """
+        max_pending = max_pending or 4 * self.max_in_flight
+        queue = asyncio.Queue(maxsize=self.max_in_flight)
+        window = asyncio.Semaphore(max_pending)
+        idle = asyncio.Semaphore(self.max_in_flight)
+        pending = {}
+        next_position = 0
+        total = 0
+
+        def emit(position, result):
+            nonlocal next_position
+            pending[position] = result
+            while next_position in pending:
+                on_result(pending.pop(next_position))
+                self.metrics.inc('gemini_rows_total')
+                next_position += 1
+                window.release()
+
+        async def producer():
+            nonlocal total
+            positions = aenumerate(items)
+            while True:
+                # O próximo item só é lido quando há um worker livre: fontes como a fila
+                # distribuída reservam as linhas apenas quando elas podem ser processadas
+                await window.acquire()
+                await idle.acquire()
+                try:
+                    position, item = await positions.__anext__()
+                except StopAsyncIteration:
+                    break
+                await queue.put((position, item))
+                self.rows_queued += 1
+                total += 1
+            for _ in range(self.max_in_flight):
+                await queue.put(None)
+
+        async def worker():
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                position, item = entry
+                self.rows_queued -= 1
+                self.rows_in_flight += 1
+                try:
+                    result = await handler(item)
+                finally:
+                    self.rows_in_flight -= 1
+                    idle.release()
+                emit(position, result)
+
+        self.metrics.gauge('gemini_queue_depth', lambda: self.rows_queued)
+        self.metrics.gauge('gemini_rows_in_flight', lambda: self.rows_in_flight)
+        self.logger.info(f"Motor assíncrono iniciado: até {self.max_in_flight} registros em paralelo, "
+                         f"{len(self.api_keys)} chaves com {self.concurrency_per_key} chamadas simultâneas cada")
+        await asyncio.gather(producer(), *(worker() for _ in range(self.max_in_flight)))
+        return total
+
+    async def close(self):
+        """Fecha o backend e o cache."""
+        await self.backend.close()
+        if self.streaming:
+            self.logger.info(f"Streaming: {self.stream_stats.summary()}")
+        if self.cache is not None:
+            self.logger.info(f"Cache de respostas: {self.cache.hits} acertos, {self.cache.misses} faltas")
+            self.cache.close()
@@ -0,0 +1,141 @@
+import asyncio
+import re
+import unicodedata
+
+from journal import is_blank
+
+# Campos do local de atendimento compartilhados entre médicos do mesmo endereço
+ENTITY_FIELDS = [
+    'Endereco Completo A1', 'Address A1', 'Numero A1', 'Complement A1', 'Bairro A1',
+    'postal code A1', 'City A1', 'State A1', 'Phone A1', 'Phone A2',
+]
+
+# Tempo máximo que uma linha espera pela busca de outra linha com o mesmo endereço
+DEFAULT_WAIT_TIMEOUT = 120.0
+
+def normalize(value):
+    """Texto sem acentos, pontuação e espaços repetidos, em minúsculas."""
+    if is_blank(value):
+        return ''
+    text = unicodedata.normalize('NFKD', str(value))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    text = re.sub(r'[^a-z0-9]+', ' ', text)
+    return text.strip()
+
+def entity_keys(data):
+    """Chaves do local de atendimento: CEP + número e logradouro + número + cidade, quando houver."""
+    keys = []
+    number = normalize(data.get('Numero A1'))
+    cep = re.sub(r'\D', '', str(data.get('postal code A1') or ''))
+    if len(cep) == 8 and number:
+        keys.append(f"cep:{cep}:{number}")
+    street = normalize(data.get('Address A1'))
+    city = normalize(data.get('City A1'))
+    if street and number and city:
+        keys.append(f"end:{street}:{number}:{city}")
+    full_address = normalize(data.get('Endereco Completo A1'))
+    if full_address and any(char.isdigit() for char in full_address):
+        keys.append(f"completo:{full_address}")
+    return keys
+
+class EntityCache:
+    """Cache, válido durante a execução, dos locais de atendimento já encontrados.
+
+    A primeira linha com um endereço (CEP + número, logradouro + número +
+    cidade ou endereço completo) faz a busca normal e publica o local. As
+    linhas seguintes com o mesmo endereço recebem os campos do local e fazem
+    apenas uma chamada curta de confirmação. Enquanto a primeira linha ainda
+    está buscando, as demais com o mesmo endereço aguardam o resultado dela
+    (até `wait_timeout` segundos) em vez de repetir a mesma pesquisa.
+
+    A confirmação só é possível para linhas que já trazem o endereço no
+    input. Linhas sem endereço (como no formato mínimo do README) consultam o
+    cache depois da iteração 1, pelo endereço encontrado, e completam com os
+    campos do local o que a busca não trouxe (`lookup`).
+    """
+
+    def __init__(self, logger, wait_timeout=DEFAULT_WAIT_TIMEOUT):
+        self.logger = logger
+        self.wait_timeout = wait_timeout
+        self.entities = {}
+        self.pending = {}
+        self.hits = 0
+        self.late_hits = 0
+        self.waits = 0
+        self.published = 0
+
+    def _find(self, keys):
+        for key in keys:
+            if key in self.entities:
+                return self.entities[key]
+        return None
+
+    async def acquire(self, data):
+        """Retorna (local, chaves reservadas).
+
+        O local é o já publicado para o endereço da linha (ou None). Se nenhuma
+        outra linha está buscando esse endereço, a linha passa a ser a
+        responsável por ele e recebe as chaves reservadas, que devem ser
+        liberadas com `publish` assim que o endereço da linha estiver
+        confirmado: depois da iteração 1 ou, se ela for pulada (linha já
+        preenchida), logo após esta chamada, com os dados do próprio input.
+        """
+        keys = entity_keys(data)
+        entity = self._find(keys)
+        if entity is None:
+            waiting = [self.pending[key] for key in keys if key in self.pending]
+            if waiting:
+                self.waits += 1
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiting[0]), self.wait_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                entity = self._find(keys)
+        if entity is not None:
+            self.hits += 1
+            return entity, []
+
+        loop = asyncio.get_running_loop()
+        claimed = [key for key in keys if key not in self.pending]
+        for key in claimed:
+            self.pending[key] = loop.create_future()
+        return None, claimed
+
+    def lookup(self, data):
+        """Local já publicado para o endereço atual da linha (ex.: encontrado na iteração 1), ou None."""
+        entity = self._find(entity_keys(data))
+        if entity is not None:
+            self.late_hits += 1
+        return entity
+
+    def publish(self, data, claimed=()):
+        """Registra o local encontrado na linha e libera as linhas que esperavam pelas chaves reservadas."""
+        entity = None
+        if data is not None:
+            entity = {field: data[field] for field in ENTITY_FIELDS if not is_blank(data.get(field))}
+            keys = entity_keys(data)
+            if entity and keys:
+                new_keys = [key for key in list(claimed) + keys if key not in self.entities]
+                for key in new_keys:
+                    self.entities[key] = entity
+                if new_keys:
+                    self.published += 1
+        for key in claimed:
+            future = self.pending.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    @staticmethod
+    def seed(data, entity):
+        """Preenche os campos vazios da linha com os do local; retorna os campos preenchidos."""
+        seeded = []
+        for field, value in entity.items():
+            if is_blank(data.get(field)):
+                data[field] = value
+                seeded.append(field)
+        return seeded
+
+    def summary(self):
+        return (f"{self.published} locais publicados, {self.hits} linhas aproveitaram um local já encontrado "
+                f"({self.waits} aguardaram a busca de outra linha), {self.late_hits} completadas com um local "
+                f"conhecido após a iteração 1")
@@ -1,21 +1,51 @@
-import pandas as pd
 import os
 import json
 from datetime import datetime
-from google import genai
 from google.genai import types
-import concurrent.futures
+import argparse
+import asyncio
 import time
 import logging
+import socket
 import sys
-from io import StringIO
-import re # Importar regex para extração de JSON
+from backends import GeminiBackend
+from engine import EnrichmentEngine, aenumerate, DEFAULT_CONCURRENCY_PER_KEY, DEFAULT_MAX_IN_FLIGHT
+from metrics import DEFAULT_METRICS_HOST
+from rate_limiter import DEFAULT_RPM, DEFAULT_TPM
+from response_cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_TTL_DAYS, DEFAULT_MAX_MB
+from journal import RowJournal, is_blank, row_key
+from planner import IterationPlanner, DEFAULT_FILL_THRESHOLD
+from batching import PromptBatcher, DEFAULT_PROMPT_BATCH_SIZE, DEFAULT_BATCH_LINGER
+from batch_job import (GeminiBatchClient, LocalBatchClient, build_batch_request, run_batch_job, write_batch_file,
+                       DEFAULT_POLL_INTERVAL)
+from mock_server import batch_responder
+from json_extract import extract_json_object
+from retry_policy import INTERNAL, PARSE, SAFETY, RetryState, classify_exception, classify_response
+from structured_output import StructuredOutput
+from prompt_compiler import PromptCompiler
+from context_cache import DEFAULT_CONTEXT_CACHE_TTL
+from entity_cache import EntityCache
+from pipeline import DEFAULT_STAGE_WORKERS, StagePipeline, parse_stage_workers, stage_of
+from dedup import RowDeduplicator, doctor_key, scan_duplicates, write_duplicates_report
+from knowledge_store import KnowledgeStore, DEFAULT_KNOWLEDGE_PATH, DEFAULT_MAX_AGE_DAYS
+from work_queue import FAILED, QueueSource, WorkQueue, DEFAULT_VISIBILITY_TIMEOUT
+from work_queue import DEFAULT_POLL_INTERVAL as DEFAULT_QUEUE_POLL_INTERVAL
+from log_pipeline import (DEFAULT_LOG_BACKUPS, DEFAULT_LOG_MAX_MB, DEFAULT_PAYLOAD_MODE, DEFAULT_PAYLOAD_SAMPLE_RATE,
+                          PAYLOAD_MODES, TEXT_FORMAT, payload_extra, rotating_file_handler, start_async_logging)
+from csv_stream import DEFAULT_BATCH_SIZE, StreamingCsvWriter, iter_csv_rows, read_csv_header
 
 # Configuração do logging
-def setup_logging():
-    """Configura o sistema de logging."""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_filename = f'gemini4.0_{timestamp}.log'
+def setup_logging(log_filename=None, log_format='json', max_mb=DEFAULT_LOG_MAX_MB, backups=DEFAULT_LOG_BACKUPS,
+                  payload_mode=DEFAULT_PAYLOAD_MODE, payload_sample_rate=DEFAULT_PAYLOAD_SAMPLE_RATE):
+    """Configura o sistema de logging.
+
+    Os registros passam por uma fila e são gravados na thread de um
+    QueueListener (`log_pipeline.py`), sem bloquear o processamento. O arquivo
+    é gravado em JSON lines (ou no formato texto antigo) e rotacionado por tamanho.
+    """
+    if log_filename is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        log_filename = f'gemini4.0_{timestamp}.log'
     
     # Configuração do logger
     logger = logging.getLogger("gemini4.0")
@@ -26,22 +56,17 @@ def setup_logging():
         for handler in logger.handlers[:]:
             logger.removeHandler(handler)
 
-    # Handler para arquivo
-    file_handler = logging.FileHandler(log_filename, encoding='utf-8')
+    # Handler para arquivo, com rotação por tamanho
+    file_handler = rotating_file_handler(log_filename, log_format, max_mb, backups)
     file_handler.setLevel(logging.DEBUG)
     
-    # Handler para console
+    # Handler para console (sem os payloads)
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
     
-    # Formato do log
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    # Adiciona os handlers
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # Os handlers ficam atrás da fila; o logger só enfileira os registros
+    start_async_logging(logger, [file_handler, console_handler], payload_mode, payload_sample_rate)
     
     return logger
 
@@ -226,332 +251,868 @@ Retorne APENAS um objeto JSON válido, sem nenhum texto ou explicação adiciona
     
     return prompt
 
-def process_row(row, api_key, email_examples, logger):
-    """Processa uma linha usando a API do Gemini."""
-    client = genai.Client(api_key=api_key)
-    model = "gemini-2.5-flash-preview-04-17"
+def build_confirm_prompt(row_data, logger):
+    """Prompt curto da iteração 1 quando o local de atendimento veio de outro médico do lote."""
+    dados_atuais_json = json.dumps(row_data, ensure_ascii=False, separators=(',', ':'))
+    return f"""
+Você é um assistente especialista em encontrar e organizar informações de profissionais de saúde no Brasil.
+
+**Tarefa:** O endereço e os telefones fixos abaixo foram encontrados para outro médico do mesmo local de atendimento.
+Confirme com uma busca rápida se este médico também atende nesse local e complete apenas os dados que faltarem.
+
+**Dados do Médico:**
+{dados_atuais_json}
+
+Se o médico não atender nesse local, pesquise o endereço e os telefones corretos dele.
+Retorne APENAS um objeto JSON válido, sem nenhum texto adicional, com as chaves first_name, last_name,
+especialidade_medica, endereco_completo_a1, logradouro_a1, numero_a1, complemento_a1, bairro_a1, cep_a1,
+cidade_a1, estado_a1, phone_a1, phone_a2, cell_phone_a1, cell_phone_a2, email_a1 e email_a2.
+Se uma informação não for encontrada, retorne "" para a chave correspondente.
+"""
+
+# Modelo usado em todas as chamadas
+MODEL = "gemini-2.5-flash-preview-04-17"
+
+# Colunas do CSV de saída, na ordem em que são gravadas
+OUTPUT_COLUMNS = [
+    'Hash', 'CRM', 'UF', 'Firstname', 'LastName', 'Medical specialty',
+    'Endereco Completo A1', 'Address A1', 'Numero A1', 'Complement A1', 'Bairro A1',
+    'postal code A1', 'City A1', 'State A1', 'Phone A1', 'Phone A2',
+    'Cell phone A1', 'Cell phone A2', 'E-mail A1', 'E-mail A2', 'OPT-IN', 'STATUS', 'LOTE',
+    'chance_email_a1', 'chance_email_a2'
+]
+
+# Mapeamento das chaves do JSON retornado para as colunas do DataFrame (iterações 1 a 6)
+KEY_MAPPING = {
+    'first_name': 'Firstname',
+    'primeiro_nome': 'Firstname',
+    'last_name': 'LastName',
+    'sobrenome': 'LastName',
+    'medical_specialty': 'Medical specialty',
+    'especialidade': 'Medical specialty',
+    'especialidade_medica': 'Medical specialty',
+    'endereco_completo_a1': 'Endereco Completo A1',
+    'logradouro_a1': 'Address A1',
+    'numero_a1': 'Numero A1',
+    'complemento_a1': 'Complement A1',
+    'bairro_a1': 'Bairro A1',
+    'cep_a1': 'postal code A1',
+    'cidade_a1': 'City A1',
+    'estado_a1': 'State A1',
+    'phone_a1': 'Phone A1',
+    'telefone_a1': 'Phone A1',
+    'phone_a2': 'Phone A2',
+    'telefone_a2': 'Phone A2',
+    'cell_phone_a1': 'Cell phone A1',
+    'celular_a1': 'Cell phone A1',
+    'cell_phone_a2': 'Cell phone A2',
+    'celular_a2': 'Cell phone A2',
+    'email_a1': 'E-mail A1',
+    'email_a2': 'E-mail A2'
+}
+
+# Mapeamento usado na busca de telefones (iteração 7) e e-mails (iteração 8)
+PHONE_MAPPING = {
+    'phone_a1': 'Phone A1',
+    'phone_a2': 'Phone A2',
+    'cell_phone_a1': 'Cell phone A1',
+    'cell_phone_a2': 'Cell phone A2'
+}
+
+EMAIL_MAPPING = {
+    'email_a1': 'E-mail A1',
+    'email_a2': 'E-mail A2'
+}
+
+def merge_new_data(current_data, new_data, iteration):
+    """Atualiza os dados atuais com o JSON retornado na iteração."""
+    if iteration < 6:
+        mapping = KEY_MAPPING
+    elif iteration == 6:
+        mapping = PHONE_MAPPING
+    elif iteration == 7:
+        mapping = EMAIL_MAPPING
+    else:
+        current_data['chance_email_a1'] = new_data.get('chance_email_a1', 'NADA PROVAVEL')
+        current_data['chance_email_a2'] = new_data.get('chance_email_a2', 'NADA PROVAVEL')
+        return current_data
+
+    for json_key, df_key in mapping.items():
+        value = new_data.get(json_key)
+        if value is not None and str(value).strip() != '':
+            current_data[df_key] = value
+    return current_data
+
+def initial_data(row):
+    """Dados iniciais da linha - mantém apenas as colunas originais."""
+    return {
+        'Hash': row.get('Hash', ''),
+        'CRM': row.get('CRM', ''),
+        'UF': row.get('UF', ''),
+        'Firstname': row.get('Firstname', ''),
+        'LastName': row.get('LastName', ''),
+        'Medical specialty': row.get('Medical specialty', ''),
+        'Endereco Completo A1': row.get('Endereco Completo A1', ''),
+        'Address A1': row.get('Address A1', ''),
+        'Numero A1': row.get('Numero A1', ''),
+        'Complement A1': row.get('Complement A1', ''),
+        'Bairro A1': row.get('Bairro A1', ''),
+        'postal code A1': row.get('postal code A1', ''),
+        'City A1': row.get('City A1', ''),
+        'State A1': row.get('State A1', ''),
+        'Phone A1': row.get('Phone A1', ''),
+        'Phone A2': row.get('Phone A2', ''),
+        'Cell phone A1': row.get('Cell phone A1', ''),
+        'Cell phone A2': row.get('Cell phone A2', ''),
+        'E-mail A1': row.get('E-mail A1', ''),
+        'E-mail A2': row.get('E-mail A2', ''),
+        'OPT-IN': row.get('OPT-IN', ''),
+        'STATUS': row.get('STATUS', ''),
+        'LOTE': row.get('LOTE', '')
+    }
+
+def build_request(prompt_text, response_schema=None, system_instruction=None):
+    """Monta o conteúdo e a configuração da chamada ao Gemini.
+
+    Com `response_schema` a chamada é feita sem a ferramenta de busca (que não
+    pode ser combinada com o schema) e a resposta vem como JSON. As instruções
+    fixas do prompt compilado vão em `system_instruction`.
+    """
+    contents = [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part.from_text(text=prompt_text),
+            ],
+        ),
+    ]
+    
+    if response_schema is not None:
+        generate_content_config = types.GenerateContentConfig(
+            temperature=0,
+            response_mime_type="application/json",
+            response_schema=response_schema,
+            system_instruction=system_instruction,
+        )
+        return contents, generate_content_config
+    
+    tools = [
+        types.Tool(google_search=types.GoogleSearch()),
+    ]
+    
+    generate_content_config = types.GenerateContentConfig(
+        temperature=0,
+        tools=tools,
+        response_mime_type="text/plain",
+        system_instruction=system_instruction,
+    )
+    return contents, generate_content_config
+
+def compose_prompt(data, iteration, email_examples, logger, compiler=None, confirm=False):
+    """Retorna (system instruction, prompt) da iteração; sem `compiler`, usa o prompt completo de `build_prompt`.
+
+    Com `confirm`, usa o prompt curto de confirmação do local de atendimento.
+    """
+    if confirm:
+        prompt_text = build_confirm_prompt(data, logger)
+    else:
+        prompt_text = build_prompt(data, iteration, email_examples, logger)
+    if compiler is None:
+        return None, prompt_text
+    return compiler.compile(data, iteration, legacy_prompt=prompt_text, kind='confirm' if confirm else None)
+
+def make_compiler(args, email_examples):
+    """Compilador de prompts das opções da execução, ou None para os prompts completos.
+
+    O cache de contexto depende do prefixo fixo que só existe nos prompts
+    compactos; com ele, todas as iterações compartilham uma única system
+    instruction, grande o bastante para o mínimo de um cache.
+    """
+    if args.compact_prompts or args.context_cache:
+        return PromptCompiler(shared=args.context_cache, examples=email_examples)
+    return None
+
+def prefill_known(knowledge, data):
+    """Pré-preenche `data` com a base de médicos conhecidos.
+
+    Retorna (campos preenchidos, valores vencidos, e-mails conhecidos): os
+    vencidos voltam no fim da linha se a busca não encontrar nada, e os
+    e-mails conhecidos (None se nada foi preenchido) indicam se a avaliação
+    dos e-mails trazida da base ainda vale.
+    """
+    filled, stale = knowledge.prefill(data)
+    known_emails = (data.get('E-mail A1'), data.get('E-mail A2')) if filled else None
+    return filled, stale, known_emails
+
+async def process_row(row, engine, email_examples, logger, journal=None, resume_entry=None, planner=None,
+                      batcher=None, structured=None, compiler=None, entities=None, knowledge=None, pipeline=None):
+    """Processa uma linha usando a API do Gemini.
+
+    Se houver `journal`, o estado da linha é registrado após cada iteração; com
+    `resume_entry` o processamento continua a partir da última iteração concluída.
+    O `planner` pula as iterações que não têm mais nada a encontrar e, com
+    `batcher`, cada iteração é tentada primeiro em lote com outros médicos.
+    Com `structured`, respostas sem JSON válido são reformatadas pelo schema
+    da iteração em vez de refazer a busca, e com `compiler` os prompts são
+    enviados na forma compacta. Com `entities`, o local de atendimento já
+    encontrado para outro médico do mesmo endereço é aproveitado e a primeira
+    iteração vira uma chamada curta de confirmação. Com `knowledge`, os campos
+    já conhecidos de execuções anteriores e ainda válidos são pré-preenchidos,
+    e só o que falta (ou venceu) é buscado. Com `pipeline`, cada grupo de
+    iterações (passadas gerais, telefones, e-mails, avaliação) só roda com
+    uma vaga no estágio correspondente.
+    """
+    claimed = []
+    slot = pipeline.slot() if pipeline is not None else None
+    try:
+        return await _process_row(row, engine, email_examples, logger, journal, resume_entry, planner, batcher,
+                                  structured, compiler, entities, knowledge, claimed, slot)
+    finally:
+        if slot is not None:
+            slot.release()
+        if claimed:
+            # Libera as linhas que aguardavam este endereço, mesmo que a linha tenha falhado
+            entities.publish(None, claimed)
+
+async def _process_row(row, engine, email_examples, logger, journal, resume_entry, planner, batcher, structured,
+                       compiler, entities, knowledge, claimed, slot):
+    planner = planner or IterationPlanner()
+    metrics = engine.metrics
+    model = MODEL
+    key = row_key(row)
     
     # Dados iniciais - mantém apenas as colunas originais
-    current_data = {
-        'Hash': row['Hash'],
-        'CRM': row['CRM'],
-        'UF': row['UF'],
-        'Firstname': row['Firstname'],
-        'LastName': row['LastName'],
-        'Medical specialty': row['Medical specialty'],
-        'Endereco Completo A1': row['Endereco Completo A1'],
-        'Address A1': row['Address A1'],
-        'Numero A1': row['Numero A1'],
-        'Complement A1': row['Complement A1'],
-        'Bairro A1': row['Bairro A1'],
-        'postal code A1': row['postal code A1'],
-        'City A1': row['City A1'],
-        'State A1': row['State A1'],
-        'Phone A1': row['Phone A1'],
-        'Phone A2': row['Phone A2'],
-        'Cell phone A1': row['Cell phone A1'],
-        'Cell phone A2': row['Cell phone A2'],
-        'E-mail A1': row['E-mail A1'],
-        'E-mail A2': row['E-mail A2'],
-        'OPT-IN': row['OPT-IN'],
-        'STATUS': row['STATUS'],
-        'LOTE': row['LOTE']
-    }
+    current_data = initial_data(row)
+    start_iteration = 0
+    # Campos encontrados em execuções anteriores; os vencidos só servem de reserva no final
+    stale = {}
+    known_emails = None
+    if resume_entry is not None:
+        current_data = resume_entry['data']
+        start_iteration = resume_entry['iteration'] + 1
+        stale = resume_entry.get('stale') or {}
+        if resume_entry.get('known_emails') is not None:
+            known_emails = tuple(resume_entry['known_emails'])
+        logger.info(f"Retomando CRM {row['CRM']} a partir da iteração {start_iteration + 1}")
     
     logger.info(f"Iniciando processamento do CRM {row['CRM']}")
     
+    if knowledge is not None and start_iteration == 0:
+        filled, stale, known_emails = prefill_known(knowledge, current_data)
+        if filled:
+            logger.info(f"CRM {row['CRM']} - {len(filled)} campos pré-preenchidos da base de médicos conhecidos; "
+                        f"{len(stale)} campos vencidos serão buscados novamente")
+    
+    # Local de atendimento já encontrado por outra linha com o mesmo endereço
+    confirm = False
+    if entities is not None and start_iteration == 0:
+        entity, keys = await entities.acquire(current_data)
+        claimed.extend(keys)
+        if entity is not None:
+            seeded = EntityCache.seed(current_data, entity)
+            confirm = bool(seeded)
+            logger.info(f"CRM {row['CRM']} - Local de atendimento compartilhado: {len(seeded)} campos preenchidos; "
+                        f"a iteração 1 apenas confirmará os dados")
+    
     # Processa as 9 iterações
-    for iteration in range(9):
-        logger.info(f"Processando CRM {row['CRM']} - Iteração {iteration + 1}")
+    last_general_changed = True
+    for iteration in range(start_iteration, 9):
+        run, reason = planner.plan(iteration, current_data, last_general_changed)
+        if confirm and iteration == 0:
+            # Os dados compartilhados são confirmados mesmo que já completem a linha
+            run = True
+        if iteration == 8 and known_emails is not None and known_emails != (
+                current_data.get('E-mail A1'), current_data.get('E-mail A2')):
+            # A avaliação conhecida era de outros e-mails; é refeita
+            current_data.pop('chance_email_a1', None)
+            current_data.pop('chance_email_a2', None)
+            run, reason = planner.plan(iteration, current_data, last_general_changed)
+        if not run:
+            logger.info(f"CRM {row['CRM']} - Iteração {iteration + 1} ignorada: {reason}")
+            if iteration == 0 and entities is not None:
+                # O endereço do input já é o definitivo; as linhas que aguardam por ele são liberadas agora
+                entities.publish(current_data, claimed)
+                claimed.clear()
+            if iteration == 8 and is_blank(current_data.get('chance_email_a1')):
+                # Sem e-mails não há o que avaliar
+                merge_new_data(current_data, {}, iteration)
+            if journal is not None:
+                journal.record(key, iteration, current_data, done=iteration == 8, stale=stale,
+                               known_emails=known_emails)
+            continue
         
-        # Delay incremental
-        if iteration > 0:
-            delay = 45 if iteration >= 6 else 7 * iteration
-            time.sleep(delay)
+        if slot is not None:
+            await slot.enter(stage_of(iteration))
+        logger.info(f"Processando CRM {row['CRM']} - Iteração {iteration + 1}")
+        data_before = dict(current_data)
+        iteration_started = time.monotonic()
         
         # Constrói o prompt para a iteração atual
-        prompt_text = build_prompt(current_data, iteration, email_examples, logger)
+        confirming = confirm and iteration == 0
+        system_instruction, prompt_text = compose_prompt(current_data, iteration, email_examples, logger, compiler,
+                                                         confirm=confirming)
         
-        contents = [
-            types.Content(
-                role="user",
-                parts=[
-                    types.Part.from_text(text=prompt_text),
-                ],
-            ),
-        ]
+        response_schema = structured.direct_schema(iteration) if structured is not None else None
+        contents, generate_content_config = build_request(prompt_text, response_schema, system_instruction)
         
-        tools = [
-            types.Tool(google_search=types.GoogleSearch()),
-        ]
+        # Respostas já processadas com sucesso em execuções anteriores vêm do cache
+        cache_key = engine.cache_key(model, prompt_text, generate_content_config)
         
-        generate_content_config = types.GenerateContentConfig(
-            temperature=0,
-            tools=tools,
-            response_mime_type="text/plain",
-        )
+        # No modo em lote, a iteração só é refeita individualmente se o médico faltar na resposta do lote
+        batched = False
+        if batcher is not None and not confirming:
+            new_data = await batcher.submit(iteration, current_data)
+            if new_data is not None:
+                merge_new_data(current_data, new_data, iteration)
+                logger.info(f"CRM {row['CRM']} - Iteração {iteration + 1} - Dados atualizados via lote",
+                            extra=payload_extra(current_data, key))
+                batched = True
+            else:
+                logger.warning(f"CRM {row['CRM']} - Iteração {iteration + 1} sem resposta válida no lote; tentando individualmente")
         
-        max_retries = 5 # Aumentado o número de retries
-        retry_count = 0
+        # Cada classe de erro tem seu próprio backoff e limite de tentativas (retry_policy)
+        retry = RetryState()
         
-        while retry_count < max_retries:
+        while not batched:
             try:
-                response = client.models.generate_content(
-                    model=model,
-                    contents=contents,
-                    config=generate_content_config,
-                )
+                # O motor escolhe a chave e controla a cota dela; não há delays fixos
+                with metrics.timer('gemini_step_seconds', step='chamada'):
+                    response = await engine.generate_content(
+                        model=model,
+                        contents=contents,
+                        config=generate_content_config,
+                        prompt_text=(system_instruction or '') + prompt_text,
+                        cache_key=cache_key,
+                    )
                 
-                if response is None or response.text is None:
-                    logger.warning(f"Resposta da API ou texto da resposta é None para CRM {row['CRM']} (tentativa {retry_count + 1}).")
-                    retry_count += 1
-                    time.sleep(30) # Aumenta o delay para retries em caso de resposta vazia
-                    continue
-                
-                response_text = response.text
-                
-                # Tenta encontrar o JSON na resposta usando regex
-                json_match = re.search(r'```json\n({.*?})\n```', response_text, re.DOTALL)
-                if not json_match:
-                    json_match = re.search(r'({.*?})', response_text, re.DOTALL)
-
-                if json_match:
-                    json_str = json_match.group(1)
+                error_class = classify_response(response)
+                if error_class == SAFETY:
+                    logger.warning(f"Resposta bloqueada pelos filtros de segurança para CRM {row['CRM']} (tentativa {retry.attempt}).")
+                elif error_class is not None:
+                    logger.warning(f"Resposta da API ou texto da resposta é None para CRM {row['CRM']} (tentativa {retry.attempt}).")
+                else:
+                    response_text = response.text
+                    if compiler is not None:
+                        compiler.record_usage(iteration, response)
                     
-                    try:
-                        new_data = json.loads(json_str)
-                        logger.info(f"CRM {row['CRM']} - Iteração {iteration + 1} - JSON recebido:\n{json.dumps(new_data, indent=2, ensure_ascii=False)}")
-                        
-                        # Atualiza os dados atuais de forma mais robusta
-                        if iteration < 6:
-                            # Mapeamento de chaves para garantir consistência
-                            key_mapping = {
-                                'first_name': 'Firstname',
-                                'primeiro_nome': 'Firstname',
-                                'last_name': 'LastName',
-                                'sobrenome': 'LastName',
-                                'medical_specialty': 'Medical specialty',
-                                'especialidade': 'Medical specialty',
-                                'especialidade_medica': 'Medical specialty',
-                                'endereco_completo_a1': 'Endereco Completo A1',
-                                'logradouro_a1': 'Address A1',
-                                'numero_a1': 'Numero A1',
-                                'complemento_a1': 'Complement A1',
-                                'bairro_a1': 'Bairro A1',
-                                'cep_a1': 'postal code A1',
-                                'cidade_a1': 'City A1',
-                                'estado_a1': 'State A1',
-                                'phone_a1': 'Phone A1',
-                                'telefone_a1': 'Phone A1',
-                                'phone_a2': 'Phone A2',
-                                'telefone_a2': 'Phone A2',
-                                'cell_phone_a1': 'Cell phone A1',
-                                'celular_a1': 'Cell phone A1',
-                                'cell_phone_a2': 'Cell phone A2',
-                                'celular_a2': 'Cell phone A2',
-                                'email_a1': 'E-mail A1',
-                                'email_a2': 'E-mail A2'
-                            }
-
-                            for json_key, df_key in key_mapping.items():
-                                value = new_data.get(json_key)
-                                if value is not None and str(value).strip() != '':
-                                    current_data[df_key] = value
-                        elif iteration == 6:
-                            if new_data.get('phone_a1') and str(new_data['phone_a1']).strip() != '':
-                                current_data['Phone A1'] = new_data['phone_a1']
-                            if new_data.get('phone_a2') and str(new_data['phone_a2']).strip() != '':
-                                current_data['Phone A2'] = new_data['phone_a2']
-                            if new_data.get('cell_phone_a1') and str(new_data['cell_phone_a1']).strip() != '':
-                                current_data['Cell phone A1'] = new_data['cell_phone_a1']
-                            if new_data.get('cell_phone_a2') and str(new_data['cell_phone_a2']).strip() != '':
-                                current_data['Cell phone A2'] = new_data['cell_phone_a2']
-                        elif iteration == 7:
-                            if new_data.get('email_a1') and str(new_data['email_a1']).strip() != '':
-                                current_data['E-mail A1'] = new_data['email_a1']
-                            if new_data.get('email_a2') and str(new_data['email_a2']).strip() != '':
-                                current_data['E-mail A2'] = new_data['email_a2']
-                        else:
-                            current_data['chance_email_a1'] = new_data.get('chance_email_a1', 'NADA PROVAVEL')
-                            current_data['chance_email_a2'] = new_data.get('chance_email_a2', 'NADA PROVAVEL')
-                        
-                        logger.info(f"CRM {row['CRM']} - Iteração {iteration + 1} - Dados atualizados:\n{json.dumps(current_data, indent=2, ensure_ascii=False)}")
+                    # Extrai o primeiro objeto JSON completo da resposta em uma única passada
+                    with metrics.timer('gemini_step_seconds', step='extracao'):
+                        new_data = extract_json_object(response_text)
+                    if new_data is None and structured is not None:
+                        logger.warning(f"CRM {row['CRM']} - Iteração {iteration + 1} sem JSON válido; reformatando a resposta pelo schema")
+                        new_data = await structured.reformat(iteration, response_text)
+                    if new_data is not None:
+                        logger.info(f"CRM {row['CRM']} - Iteração {iteration + 1} - JSON recebido",
+                                    extra=payload_extra(new_data, key))
+                        with metrics.timer('gemini_step_seconds', step='merge'):
+                            merge_new_data(current_data, new_data, iteration)
+                        engine.remember(cache_key, response_text)
+                        logger.info(f"CRM {row['CRM']} - Iteração {iteration + 1} - Dados atualizados",
+                                    extra=payload_extra(current_data, key))
                         break
-                    except json.JSONDecodeError as je:
-                        logger.error(f"Erro ao decodificar JSON para CRM {row['CRM']}: {str(je)}. Resposta original: {response_text}")
-                        # Tenta uma limpeza mais agressiva se a primeira falhar
-                        try:
-                            # Remove qualquer texto antes do primeiro '{' e depois do último '}'
-                            clean_json_str = re.search(r'({.*})', response_text, re.DOTALL).group(1)
-                            new_data = json.loads(clean_json_str)
-                            logger.info(f"CRM {row['CRM']} - JSON limpo com sucesso após erro de decodificação")
-                            
-                            # Atualiza os dados como antes
-                            if iteration < 6:
-                                key_mapping = {
-                                    'first_name': 'Firstname',
-                                    'primeiro_nome': 'Firstname',
-                                    'last_name': 'LastName',
-                                    'sobrenome': 'LastName',
-                                    'medical_specialty': 'Medical specialty',
-                                    'especialidade': 'Medical specialty',
-                                    'especialidade_medica': 'Medical specialty',
-                                    'endereco_completo_a1': 'Endereco Completo A1',
-                                    'logradouro_a1': 'Address A1',
-                                    'numero_a1': 'Numero A1',
-                                    'complemento_a1': 'Complement A1',
-                                    'bairro_a1': 'Bairro A1',
-                                    'cep_a1': 'postal code A1',
-                                    'cidade_a1': 'City A1',
-                                    'estado_a1': 'State A1',
-                                    'phone_a1': 'Phone A1',
-                                    'telefone_a1': 'Phone A1',
-                                    'phone_a2': 'Phone A2',
-                                    'telefone_a2': 'Phone A2',
-                                    'cell_phone_a1': 'Cell phone A1',
-                                    'celular_a1': 'Cell phone A1',
-                                    'cell_phone_a2': 'Cell phone A2',
-                                    'celular_a2': 'Cell phone A2',
-                                    'email_a1': 'E-mail A1',
-                                    'email_a2': 'E-mail A2'
-                                }
-
-                                for json_key, df_key in key_mapping.items():
-                                    value = new_data.get(json_key)
-                                    if value is not None and str(value).strip() != '':
-                                        current_data[df_key] = value
-                            elif iteration == 6:
-                                if new_data.get('phone_a1') and str(new_data['phone_a1']).strip() != '':
-                                    current_data['Phone A1'] = new_data['phone_a1']
-                                if new_data.get('phone_a2') and str(new_data['phone_a2']).strip() != '':
-                                    current_data['Phone A2'] = new_data['phone_a2']
-                                if new_data.get('cell_phone_a1') and str(new_data['cell_phone_a1']).strip() != '':
-                                    current_data['Cell phone A1'] = new_data['cell_phone_a1']
-                                if new_data.get('cell_phone_a2') and str(new_data['cell_phone_a2']).strip() != '':
-                                    current_data['Cell phone A2'] = new_data['cell_phone_a2']
-                            elif iteration == 7:
-                                if new_data.get('email_a1') and str(new_data['email_a1']).strip() != '':
-                                    current_data['E-mail A1'] = new_data['email_a1']
-                                if new_data.get('email_a2') and str(new_data['email_a2']).strip() != '':
-                                    current_data['E-mail A2'] = new_data['email_a2']
-                            else:
-                                current_data['chance_email_a1'] = new_data.get('chance_email_a1', 'NADA PROVAVEL')
-                                current_data['chance_email_a2'] = new_data.get('chance_email_a2', 'NADA PROVAVEL')
-                            
-                            logger.info(f"CRM {row['CRM']} - Iteração {iteration + 1} - Dados atualizados após limpeza:\n{json.dumps(current_data, indent=2, ensure_ascii=False)}")
-                            break
-                        except Exception as e:
-                            logger.error(f"Erro crítico ao tentar limpar JSON para CRM {row['CRM']}: {str(e)}. Resposta original: {response_text}")
-                            # Se a limpeza agressiva falhar, não há mais o que fazer com esta resposta
-                            retry_count += 1
-                else:
-                    logger.error(f"Não foi possível encontrar JSON na resposta para CRM {row['CRM']}. Resposta original: {response_text}")
-                    retry_count += 1
+                    logger.error(f"Não foi possível encontrar JSON na resposta para CRM {row['CRM']}",
+                                 extra=payload_extra(response_text, key, error=True))
+                    error_class = PARSE
+                    metrics.inc('gemini_parse_failures_total')
                     
             except Exception as e:
-                logger.error(f"Erro ao processar CRM {row['CRM']} (tentativa {retry_count + 1}): {str(e)}", exc_info=True) # Adicionado exc_info=True para stack trace
-                retry_count += 1
-                if retry_count < max_retries:
-                    time.sleep(30)
+                error_class = classify_exception(e)
+                if error_class == INTERNAL:
+                    logger.error(f"Erro interno ({type(e).__name__}) ao processar CRM {row['CRM']} na iteração "
+                                 f"{iteration + 1}: {str(e)}; a iteração não será repetida", exc_info=True)
                 else:
-                    logger.critical(f"Número máximo de tentativas atingido para CRM {row['CRM']}. Dados atuais: {json.dumps(current_data, indent=2, ensure_ascii=False)}")
-                    # Se todas as tentativas falharem, retorna os dados atuais (mesmo que incompletos)
-                    return current_data
+                    # Em caso de 429 o motor já bloqueou a chave pelo tempo indicado pela API
+                    logger.error(f"Erro ({error_class}) ao processar CRM {row['CRM']} (tentativa {retry.attempt}): {str(e)}", exc_info=True)
+            
+            delay = retry.next_delay(error_class)
+            if delay is None:
+                # A iteração é abandonada, mas as próximas continuam com os dados atuais
+                logger.critical(f"Tentativas esgotadas para CRM {row['CRM']} na iteração {iteration + 1} "
+                                f"(último erro: {error_class}); seguindo para a próxima iteração")
+                break
+            metrics.inc('gemini_retries_total', error_class=error_class)
+            await asyncio.sleep(delay)
+        
+        metrics.observe('gemini_iteration_seconds', time.monotonic() - iteration_started, iteration=iteration + 1)
+        if iteration == 0 and entities is not None:
+            entity = None if confirming else entities.lookup(current_data)
+            if entity is not None:
+                seeded = EntityCache.seed(current_data, entity)
+                if seeded:
+                    logger.info(f"CRM {row['CRM']} - Endereço encontrado já conhecido de outra linha: "
+                                f"{len(seeded)} campos do local de atendimento completados")
+            entities.publish(current_data, claimed)
+            claimed.clear()
+        if knowledge is not None:
+            knowledge.record(current_data, iteration, data_before)
+        if iteration < 6:
+            last_general_changed = current_data != data_before
+        if journal is not None:
+            journal.record(key, iteration, current_data, done=iteration == 8, stale=stale,
+                           known_emails=known_emails)
+    
+    restored = [field for field, value in stale.items() if is_blank(current_data.get(field))]
+    for field in restored:
+        current_data[field] = stale[field]
+    if restored and journal is not None:
+        # A linha concluída é retomada do journal como está; ela precisa sair já com os valores de reserva
+        journal.record(key, 8, current_data, done=True)
     
     logger.info(f"Processamento concluído para CRM {row['CRM']}")
     return current_data
 
-def process_chunk(chunk, api_key, email_examples, logger):
-    """Processa um chunk de linhas usando uma chave da API."""
-    results = []
-    logger.info(f"Iniciando processamento de chunk com {len(chunk)} registros")
-    
-    for index, row in chunk.iterrows(): # Adicionado index para melhor log
+async def process_record(index, row, engine, email_examples, logger, journal=None, resume_state=None, planner=None,
+                         batcher=None, structured=None, compiler=None, entities=None, knowledge=None, pipeline=None):
+    """Processa um registro, preservando os dados originais em caso de erro."""
+    resume_entry = resume_state.get(row_key(row)) if resume_state else None
+    if resume_entry is not None and resume_entry['done']:
+        logger.info(f"Registro {index} (CRM {row['CRM']}) já concluído em execução anterior; ignorando")
+        return resume_entry['data']
+    try:
+        logger.info(f"Iniciando processamento do registro {index} (CRM {row['CRM']})")
+        result = await process_row(row, engine, email_examples, logger, journal, resume_entry, planner, batcher,
+                                   structured, compiler, entities, knowledge, pipeline)
+        logger.debug(f"Registro {index} (CRM {row['CRM']}) processado com sucesso.")
+        return result
+    except Exception as e:
+        logger.error(f"Erro ao processar registro {index} (CRM {row['CRM']}): {str(e)}")
+        logger.debug(f"Stack trace completo do erro para registro {index} (CRM {row['CRM']}):", exc_info=True)
+        # Retorna os dados originais em caso de erro
+        logger.warning(f"Dados originais preservados para registro {index} (CRM {row['CRM']}) devido a erro",
+                       extra=payload_extra(row, row_key(row), error=True))
+        return dict(row)
+
+async def enrich(rows, api_keys, email_examples, logger, args, on_result, journal=None, resume_state=None,
+                 duplicates=None):
+    """Processa as linhas no motor assíncrono, entregando os resultados em ordem a `on_result`.
+
+    Com `duplicates` (um `DuplicateIndex`), cada médico repetido no input é
+    enriquecido uma única vez e o resultado é replicado para as outras linhas.
+    """
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(
+            args.cache_path,
+            ttl_seconds=args.cache_ttl_days * 86400,
+            max_bytes=args.cache_max_mb * 1024 * 1024,
+        )
+    pipeline = StagePipeline(args.stage_workers) if args.pipeline else None
+    max_in_flight = args.max_in_flight
+    if pipeline is not None:
+        # Entram linhas suficientes para ocupar as vagas de todos os estágios ao mesmo tempo
+        max_in_flight = max(max_in_flight, pipeline.total_workers)
+    engine = EnrichmentEngine(
+        api_keys,
+        logger,
+        concurrency_per_key=args.concurrency_per_key,
+        max_in_flight=max_in_flight,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        cache=cache,
+        backend=GeminiBackend(api_keys, base_url=args.base_url, logger=logger,
+                              context_cache_ttl=args.context_cache_ttl if args.context_cache else None),
+        streaming=args.stream,
+    )
+    planner = IterationPlanner(args.fill_threshold)
+    compiler = make_compiler(args, email_examples)
+    batcher = None
+    if args.prompt_batch_size > 1:
+        if compiler is not None:
+            prompt_builder = compiler.user_prompt
+            request_builder = lambda text, iteration: build_request(
+                text, system_instruction=compiler.system_instruction(iteration))
+        else:
+            prompt_builder = lambda data, iteration: build_prompt(data, iteration, email_examples, logger)
+            request_builder = lambda text, iteration: build_request(text)
+        batcher = PromptBatcher(
+            engine,
+            MODEL,
+            prompt_builder,
+            request_builder,
+            logger,
+            batch_size=args.prompt_batch_size,
+            linger=args.batch_linger,
+        )
+    structured = StructuredOutput(engine, MODEL, logger) if args.structured_output else None
+    entities = EntityCache(logger) if args.entity_cache else None
+    dedup = RowDeduplicator(duplicates, logger, journal) if duplicates is not None else None
+    knowledge = None
+    if not args.no_knowledge:
+        knowledge = KnowledgeStore(args.knowledge_path, max_age_seconds=args.knowledge_max_age_days * 86400)
+    if pipeline is not None:
+        for name, stage in pipeline.stages.items():
+            engine.metrics.gauge('gemini_stage_queue_depth', lambda stage=stage: stage.waiting, stage=name)
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = engine.metrics.serve(args.metrics_port, args.metrics_host)
+        logger.info(f"Métricas disponíveis em http://{args.metrics_host}:{args.metrics_port}/metrics")
+    try:
+        async def handler(item):
+            index, row = item
+
+            async def process():
+                return await process_record(index, row, engine, email_examples, logger, journal, resume_state,
+                                            planner, batcher, structured, compiler, entities, knowledge, pipeline)
+
+            if dedup is None:
+                return await process()
+            return await dedup.process(row, process)
+
+        return await engine.run(aenumerate(rows), handler, on_result)
+    finally:
+        if pipeline is not None:
+            for line in pipeline.report():
+                logger.info(f"Estágio {line}")
+        if batcher is not None:
+            logger.info(f"Modo em lote: {batcher.summary()}")
+        if structured is not None:
+            logger.info(f"Saída estruturada: {structured.summary()}")
+        if knowledge is not None:
+            logger.info(f"Base de médicos conhecidos: {knowledge.summary()}")
+            knowledge.close()
+        if dedup is not None:
+            logger.info(f"Duplicatas: {dedup.fanned_out} linhas preenchidas com o resultado de outra linha")
+        if entities is not None:
+            logger.info(f"Locais de atendimento: {entities.summary()}")
+        if compiler is not None:
+            for line in compiler.report():
+                logger.info(f"Tokens de entrada - {line}")
+        await engine.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        log_metrics(engine.metrics, logger)
+        if args.metrics_summary:
+            engine.metrics.write_summary(args.metrics_summary)
+            logger.info(f"Resumo das métricas gravado em {args.metrics_summary}")
+
+def log_metrics(metrics, logger):
+    """Registra no log o resumo das métricas da execução."""
+    summary = metrics.summary()
+    logger.info(f"Métricas: {summary['linhas_por_minuto']} linhas/min em {summary['duracao_segundos']}s; "
+                f"{metrics.counter('gemini_retries_total')} novas tentativas, "
+                f"{metrics.counter('gemini_rate_limited_total')} respostas 429, "
+                f"{metrics.counter('gemini_parse_failures_total')} respostas sem JSON")
+    for label, snapshot in summary['histogramas'].get('gemini_iteration_seconds', {}).items():
+        iteration = label.split('=', 1)[-1]
+        logger.info(f"Latência da iteração {iteration}: {snapshot['count']} execuções, p50 {snapshot['p50']}s, "
+                    f"p95 {snapshot['p95']}s, máx. {snapshot['max']}s")
+
+def run_offline_first_iteration(api_keys, email_examples, logger, args, journal, timestamp, resume_state,
+                                batch_client=None):
+    """Executa a iteração 1 de todas as linhas pela Batch API do Gemini.
+
+    Os prompts são gravados em um arquivo JSONL, enviados como um job em lote e,
+    quando o job termina, o resultado de cada linha é registrado no journal como
+    iteração 1 concluída. Assim como no processamento normal, cada médico
+    repetido (mesmo CRM+UF) entra no job uma única vez, e os campos da base de
+    médicos conhecidos são pré-preenchidos antes do planner decidir se a linha
+    ainda precisa da iteração 1. Os prompts saem do mesmo compilador do
+    processamento normal. Retorna as entradas do journal (com os valores
+    vencidos da base), que o processamento normal usa para continuar da
+    iteração 2.
+    """
+    planner = IterationPlanner(args.fill_threshold)
+    compiler = make_compiler(args, email_examples)
+    if batch_client is None:
+        if args.batch_api_local:
+            batch_client = LocalBatchClient(batch_responder(), polls_until_done=0)
+        else:
+            batch_client = GeminiBatchClient(api_keys[0], base_url=args.base_url)
+    batch_path = os.path.join(output_dir(args), f'batch_job_gemini_{timestamp}.jsonl')
+    knowledge = None
+    if not args.no_knowledge:
+        knowledge = KnowledgeStore(args.knowledge_path, max_age_seconds=args.knowledge_max_age_days * 86400)
+    # Dados (já pré-preenchidos) de cada linha enviada no job, com os vencidos e os e-mails conhecidos da base
+    requested = {}
+
+    def requests():
+        doctors = set()
+        for row in iter_csv_rows(args.input, args.batch_size):
+            key = row_key(row)
+            if key in resume_state or key in requested:
+                continue
+            doctor = doctor_key(row)
+            if not args.no_dedup and doctor is not None:
+                # As demais linhas do médico recebem o resultado da primeira (RowDeduplicator)
+                if doctor in doctors:
+                    continue
+                doctors.add(doctor)
+            data = initial_data(row)
+            stale, known_emails = {}, None
+            if knowledge is not None:
+                _, stale, known_emails = prefill_known(knowledge, data)
+            run, _ = planner.plan(0, data)
+            if not run:
+                continue
+            system_instruction, prompt_text = compose_prompt(data, 0, email_examples, logger, compiler)
+            contents, config = build_request(prompt_text, system_instruction=system_instruction)
+            requested[key] = (data, stale, known_emails)
+            yield key, build_batch_request(contents, config)
+
+    try:
+        total = write_batch_file(batch_path, requests())
+        logger.info(f"{total} prompts da iteração 1 gravados em {batch_path}")
+        if total == 0:
+            return {}
+        results = run_batch_job(batch_client, batch_path, MODEL, logger, f'gemini4.0-{timestamp}',
+                                poll_interval=args.batch_poll_interval)
+
+        entries = {}
+        for key, (data, stale, known_emails) in requested.items():
+            response_text = results.get(key)
+            if response_text is None:
+                continue
+            new_data = extract_json_object(response_text)
+            if new_data is None:
+                logger.warning(f"Resposta em lote sem JSON válido para CRM {data['CRM']}; a iteração 1 será refeita")
+                continue
+            data_before = dict(data)
+            merge_new_data(data, new_data, 0)
+            if knowledge is not None:
+                knowledge.record(data, 0, data_before)
+            entries[key] = journal.record(key, 0, data, stale=stale, known_emails=known_emails)
+        logger.info(f"Iteração 1 concluída via Batch API para {len(entries)} de {total} registros")
+        return entries
+    finally:
+        if knowledge is not None:
+            knowledge.close()
+
+def run_queue_coordinator(args, logger, timestamp):
+    """Enfileira o input na fila distribuída, aguarda os workers e grava a saída na ordem original."""
+    queue = WorkQueue(args.queue_coordinator, visibility_timeout=args.visibility_timeout)
+    try:
+        created = queue.enqueue(iter_csv_rows(args.input, args.batch_size), dedup=not args.no_dedup)
+        logger.info(f"{created} linhas novas enfileiradas em {args.queue_coordinator}; aguardando os workers")
+        last_counts = None
+        while queue.unfinished():
+            # Sem workers ativos, ninguém mais recolheria as reservas que esgotaram as entregas
+            queue.reap()
+            counts = queue.counts()
+            if counts != last_counts:
+                logger.info("Fila: " + ', '.join(f"{total} {status}" for status, total in sorted(counts.items())))
+                last_counts = counts
+            time.sleep(args.queue_poll_interval)
+        failed = queue.counts().get(FAILED, 0)
+        if failed:
+            logger.warning(f"{failed} linhas esgotaram as entregas sem conclusão e sairão com os dados originais")
+        
+        output_filename = args.output or f'output_gemini_{timestamp}.csv'
+        input_columns = read_csv_header(args.input)
+        writer = StreamingCsvWriter(output_filename, OUTPUT_COLUMNS + [c for c in input_columns if c not in OUTPUT_COLUMNS])
         try:
-            logger.info(f"Iniciando processamento do registro {index} (CRM {row['CRM']}) no chunk")
-            result = process_row(row, api_key, email_examples, logger)
-            results.append(result)
-            logger.debug(f"Registro {index} (CRM {row['CRM']}) processado com sucesso.")
-        except Exception as e:
-            logger.error(f"Erro ao processar registro {index} (CRM {row['CRM']}): {str(e)}")
-            logger.debug(f"Stack trace completo do erro para registro {index} (CRM {row['CRM']}):", exc_info=True)
-            # Adiciona os dados originais em caso de erro
-            results.append(row.to_dict())
-            logger.warning(f"Dados originais preservados para registro {index} (CRM {row['CRM']}) devido a erro.\nDados: {json.dumps(row.to_dict(), indent=2, ensure_ascii=False)}")
-    
-    logger.info(f"Chunk processado: {len(results)} resultados")
-    return results
+            for result in queue.results():
+                writer.write(result)
+        finally:
+            writer.close()
+        logger.info(f"Processamento concluído. {writer.rows_written} registros salvos em {output_filename}")
+    finally:
+        queue.close()
+
+def run_queue_worker(api_keys, email_examples, logger, args):
+    """Processa as linhas reservadas na fila distribuída até ela esvaziar."""
+    queue = WorkQueue(args.queue_worker, visibility_timeout=args.visibility_timeout)
+    owner = f"{socket.gethostname()}-{os.getpid()}"
+    source = QueueSource(queue, owner, logger, poll_interval=args.queue_poll_interval)
+    logger.info(f"Worker {owner} consumindo a fila {args.queue_worker}")
+    try:
+        # A deduplicação já foi feita pelo coordenador ao enfileirar
+        asyncio.run(enrich(source.rows(), api_keys, email_examples, logger, args, source.complete))
+    finally:
+        queue.close()
+    logger.info(f"Worker {owner} concluiu {source.completed} registros")
+
+def output_dir(args):
+    """Diretório do arquivo de saída, onde ficam também os arquivos auxiliares da execução."""
+    return os.path.dirname(args.output) if args.output else ''
+
+def parse_key_indices(value):
+    """Converte '1,3,5' na lista de números das chaves."""
+    indices = [int(part) for part in value.split(',') if part.strip()]
+    if not indices or min(indices) < 1 or max(indices) > 8:
+        raise ValueError("As chaves são numeradas de 1 a 8")
+    return indices
+
+def parse_args(argv=None):
+    """Lê as opções de linha de comando."""
+    parser = argparse.ArgumentParser(description="Enriquecimento de dados de médicos com o Gemini.")
+    parser.add_argument('--input', default='input.csv',
+                        help="Arquivo CSV de entrada")
+    parser.add_argument('--output',
+                        help="Arquivo CSV de saída (padrão: output_gemini_<timestamp>.csv)")
+    parser.add_argument('--log-file',
+                        help="Arquivo de log (padrão: gemini4.0_<timestamp>.log)")
+    parser.add_argument('--key-indices', type=parse_key_indices,
+                        help="Chaves da API a usar, numeradas de 1 a 8 e separadas por vírgula (padrão: todas)")
+    parser.add_argument('--concurrency-per-key', type=int, default=DEFAULT_CONCURRENCY_PER_KEY,
+                        help="Máximo de chamadas simultâneas à API por chave")
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="Máximo de registros em processamento ao mesmo tempo")
+    parser.add_argument('--rpm', type=int, default=DEFAULT_RPM,
+                        help="Cota de requisições por minuto de cada chave")
+    parser.add_argument('--tpm', type=int, default=DEFAULT_TPM,
+                        help="Cota de tokens por minuto de cada chave")
+    parser.add_argument('--base-url',
+                        help="URL de um servidor compatível com a API do Gemini (ex.: o mock_server.py)")
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH,
+                        help="Arquivo SQLite do cache de respostas")
+    parser.add_argument('--cache-ttl-days', type=float, default=DEFAULT_TTL_DAYS,
+                        help="Validade das respostas em cache, em dias")
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_MB,
+                        help="Tamanho máximo do cache; as entradas menos usadas são removidas")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Desativa o cache de respostas")
+    parser.add_argument('--knowledge-path', default=DEFAULT_KNOWLEDGE_PATH,
+                        help="Arquivo SQLite com os dados dos médicos enriquecidos em execuções anteriores")
+    parser.add_argument('--knowledge-max-age-days', type=float, default=DEFAULT_MAX_AGE_DAYS,
+                        help="Idade máxima, em dias, para um campo conhecido ser reaproveitado sem nova busca")
+    parser.add_argument('--no-knowledge', action='store_true',
+                        help="Não usa nem atualiza a base de médicos conhecidos")
+    parser.add_argument('--fill-threshold', type=float, default=DEFAULT_FILL_THRESHOLD,
+                        help="Proporção de campos preenchidos (0 a 1) a partir da qual as passadas gerais são encerradas")
+    parser.add_argument('--prompt-batch-size', type=int, default=DEFAULT_PROMPT_BATCH_SIZE,
+                        help="Quantidade de médicos enviados em uma mesma chamada (1 desativa o modo em lote)")
+    parser.add_argument('--batch-linger', type=float, default=DEFAULT_BATCH_LINGER,
+                        help="Segundos de espera para completar um lote antes de enviá-lo incompleto")
+    parser.add_argument('--compact-prompts', action='store_true',
+                        help="Envia as instruções fixas como system instruction e só os campos preenchidos em JSON compacto")
+    parser.add_argument('--context-cache', action='store_true',
+                        help="Guarda as instruções fixas em caches de contexto do Gemini (implica --compact-prompts)")
+    parser.add_argument('--context-cache-ttl', type=int, default=DEFAULT_CONTEXT_CACHE_TTL,
+                        help="Validade dos caches de contexto, em segundos; é renovada durante a execução")
+    parser.add_argument('--stream', action='store_true',
+                        help="Lê as respostas em stream e encerra cada uma assim que o JSON estiver completo")
+    parser.add_argument('--entity-cache', action='store_true',
+                        help="Aproveita o local de atendimento já encontrado para outro médico do mesmo endereço")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Divide as iterações em estágios (gerais, telefones, e-mails, avaliação) com vagas próprias")
+    parser.add_argument('--stage-workers', type=parse_stage_workers, default=str(DEFAULT_STAGE_WORKERS),
+                        help="Vagas de cada estágio do --pipeline: um número para todos ou quatro separados por vírgula")
+    parser.add_argument('--structured-output', action='store_true',
+                        help="Reformata pelo schema da iteração as respostas sem JSON válido, em vez de refazer a busca")
+    parser.add_argument('--batch-api', action='store_true',
+                        help="Executa a iteração 1 pela Batch API do Gemini (mais lento, porém mais barato)")
+    parser.add_argument('--batch-api-local', action='store_true',
+                        help="Responde o job da --batch-api localmente com as respostas do mock_server.py (testes sem cota)")
+    parser.add_argument('--batch-poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Segundos entre as consultas ao estado do job em lote")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="Envia à API todas as linhas, mesmo as de médicos repetidos (mesmo CRM+UF)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Quantidade de linhas lidas do CSV de entrada por vez")
+    queue_mode = parser.add_mutually_exclusive_group()
+    queue_mode.add_argument('--queue-coordinator', metavar='FILA',
+                            help="Enfileira o input no arquivo SQLite informado, aguarda os workers e grava a saída")
+    queue_mode.add_argument('--queue-worker', metavar='FILA',
+                            help="Processa as linhas da fila informada até ela esvaziar")
+    parser.add_argument('--visibility-timeout', type=float, default=DEFAULT_VISIBILITY_TIMEOUT,
+                        help="Segundos sem renovação após os quais uma linha reservada volta para a fila")
+    parser.add_argument('--queue-poll-interval', type=float, default=DEFAULT_QUEUE_POLL_INTERVAL,
+                        help="Segundos entre as consultas à fila quando não há linhas disponíveis")
+    parser.add_argument('--log-format', choices=['json', 'texto'], default='json',
+                        help="Formato do arquivo de log: JSON lines compacto ou o texto antigo")
+    parser.add_argument('--log-max-mb', type=float, default=DEFAULT_LOG_MAX_MB,
+                        help="Tamanho do arquivo de log a partir do qual ele é rotacionado")
+    parser.add_argument('--log-backups', type=int, default=DEFAULT_LOG_BACKUPS,
+                        help="Quantidade de arquivos de log rotacionados mantidos")
+    parser.add_argument('--log-payloads', choices=PAYLOAD_MODES, default=DEFAULT_PAYLOAD_MODE,
+                        help="Quais registros de log levam os dados da linha e as respostas do modelo")
+    parser.add_argument('--payload-sample-rate', type=float, default=DEFAULT_PAYLOAD_SAMPLE_RATE,
+                        help="Fração das linhas com payloads no log em --log-payloads amostra")
+    parser.add_argument('--metrics-port', type=int,
+                        help="Porta do endpoint /metrics (formato Prometheus) durante a execução")
+    parser.add_argument('--metrics-host', default=DEFAULT_METRICS_HOST,
+                        help="Interface do endpoint /metrics (ex.: 0.0.0.0 para aceitar outras máquinas)")
+    parser.add_argument('--metrics-summary',
+                        help="Arquivo JSON com o resumo das métricas (padrão: metricas_gemini_<timestamp>.json)")
+    parser.add_argument('--resume', metavar='JOURNAL',
+                        help="Retoma uma execução a partir do journal informado")
+    args = parser.parse_args(argv)
+    args.batch_api = args.batch_api or args.batch_api_local
+    return args
 
 def main():
+    args = parse_args()
+
     # Configura o logging
-    logger = setup_logging()
+    logger = setup_logging(args.log_file, args.log_format, args.log_max_mb, args.log_backups,
+                           args.log_payloads, args.payload_sample_rate)
     
     # Gera timestamp para o nome do arquivo
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if args.metrics_summary is None:
+        args.metrics_summary = os.path.join(output_dir(args), f'metricas_gemini_{timestamp}.json')
     
     try:
+        # Modo distribuído: o coordenador só enfileira as linhas e grava a saída
+        if args.queue_coordinator:
+            run_queue_coordinator(args, logger, timestamp)
+            return
+        
         # Carregar chaves da API e exemplos de e-mail
         api_keys = load_api_keys(logger)
+        if args.key_indices:
+            api_keys = [api_keys[i - 1] for i in args.key_indices]
+            logger.info(f"Usando {len(api_keys)} chaves: {', '.join(str(i) for i in args.key_indices)}")
         email_examples = load_email_examples(logger)
         
-        # Ler o CSV
-        logger.info("Lendo arquivo input.csv")
-        df = pd.read_csv('input.csv')
-        logger.info(f"Total de registros carregados: {len(df)}")
-        logger.debug(f"Colunas do DataFrame: {df.columns.tolist()}")
+        if args.queue_worker:
+            run_queue_worker(api_keys, email_examples, logger, args)
+            return
         
-        # Dividir o DataFrame em chunks para processamento paralelo
-        chunk_size = max(1, len(df) // len(api_keys))  # Garante chunk_size mínimo de 1
-        chunks = [df[i:i + chunk_size] for i in range(0, len(df), chunk_size)]
-        logger.info(f"DataFrame dividido em {len(chunks)} chunks de aproximadamente {chunk_size} registros cada")
+        # O CSV é lido em lotes, sem carregar o arquivo inteiro na memória
+        logger.info(f"Lendo arquivo {args.input} em lotes")
+        input_columns = read_csv_header(args.input)
+        logger.debug(f"Colunas do arquivo de entrada: {input_columns}")
+        rows = iter_csv_rows(args.input, args.batch_size)
         
-        # Processar chunks em paralelo
-        all_results = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=len(api_keys)) as executor:
-            # Garante que temos chaves API suficientes para todos os chunks
-            futures = []
-            for i, chunk in enumerate(chunks):
-                api_key = api_keys[i % len(api_keys)]  # Usa módulo para garantir que temos uma chave válida
-                future = executor.submit(process_chunk, chunk, api_key, email_examples, logger)
-                futures.append((future, i)) # Armazena o índice do chunk para ordenação
-            
-            # Coletar resultados na ordem original dos chunks
-            # Cria um dicionário para armazenar os resultados dos futures, indexados pelo índice do chunk
-            ordered_results = {}
-            for future, chunk_index in futures:
-                try:
-                    ordered_results[chunk_index] = future.result()
-                except Exception as e:
-                    logger.error(f"Erro ao coletar resultados do chunk {chunk_index}: {str(e)}")
-                    # Em caso de erro no chunk, tenta adicionar os dados originais do chunk
-                    # Isso pode ser problemático se o erro ocorreu antes do processamento de linhas individuais
-                    # Uma abordagem melhor seria passar o chunk original para o future.result() em caso de falha
-                    # Por simplicidade, vamos apenas logar e continuar
-                    if chunk_index < len(chunks):
-                        logger.warning(f"Adicionando dados originais do chunk {chunk_index} devido a erro na coleta de resultados.")
-                        all_results.extend(chunks[chunk_index].to_dict('records'))
-                    else:
-                        logger.error(f"Índice de chunk {chunk_index} fora dos limites para chunks existentes.")
+        # Journal com o estado de cada linha; com --resume continua o journal anterior
+        resume_state = {}
+        if args.resume:
+            resume_state = RowJournal.load(args.resume)
+            done = sum(1 for entry in resume_state.values() if entry['done'])
+            logger.info(f"Retomando a partir de {args.resume}: {done} registros concluídos, "
+                        f"{len(resume_state) - done} parcialmente processados")
+        journal_path = args.resume or f'journal_gemini_{timestamp}.jsonl'
+        journal = RowJournal(journal_path)
+        logger.info(f"Journal da execução: {journal_path}")
+        
+        # Médicos repetidos (mesmo CRM+UF) são enriquecidos uma única vez
+        duplicates = None
+        if not args.no_dedup:
+            duplicates = scan_duplicates(iter_csv_rows(args.input, args.batch_size))
+            if duplicates.duplicates:
+                # Fica ao lado da saída, para não colidir entre execuções simultâneas (ex.: shards)
+                report_filename = os.path.join(output_dir(args), f'duplicatas_gemini_{timestamp}.csv')
+                write_duplicates_report(report_filename, duplicates)
+                logger.info(f"{len(duplicates.duplicates)} médicos repetidos no input; {duplicates.collapsed_rows} de "
+                            f"{duplicates.total_rows} linhas reaproveitarão o resultado de outra linha "
+                            f"(relatório em {report_filename})")
+        
+        # Modo offline: a iteração 1 roda como job da Batch API e as demais seguem pelo motor
+        if args.batch_api:
+            resume_state.update(run_offline_first_iteration(
+                api_keys, email_examples, logger, args, journal, timestamp, resume_state))
+        
+        # Os resultados são gravados à medida que ficam prontos, na ordem original
+        output_filename = args.output or f'output_gemini_{timestamp}.csv'
+        fieldnames = OUTPUT_COLUMNS + [c for c in input_columns if c not in OUTPUT_COLUMNS]
+        writer = StreamingCsvWriter(output_filename, fieldnames)
+        logger.info(f"Gravando resultados em {output_filename}")
+        
+        # Processar todas as linhas no motor assíncrono
+        try:
+            total = asyncio.run(enrich(rows, api_keys, email_examples, logger, args, writer.write, journal, resume_state,
+                                       duplicates))
+        finally:
+            journal.close()
+            writer.close()
 
-            
-            # Concatena os resultados na ordem correta
-            for i in range(len(chunks)):
-                if i in ordered_results:
-                    all_results.extend(ordered_results[i])
-                else:
-                    # Este caso já é tratado acima, mas mantido para clareza
-                    pass
-
-        # Criar DataFrame final e salvar
-        final_df = pd.DataFrame(all_results)
-        output_filename = f'output_gemini_{timestamp}.csv'
-        final_df.to_csv(output_filename, index=False, encoding='utf-8')
-        logger.info(f"Processamento concluído. Resultados salvos em {output_filename}")
+        logger.info(f"Processamento concluído. {total} registros salvos em {output_filename}")
         
     except Exception as e:
         logger.critical(f"Erro crítico no processo principal: {str(e)}", exc_info=True)
+        # Código de saída diferente de zero para quem executa o script (ex.: sharded_runner)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
-
-
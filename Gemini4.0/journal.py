@@ -0,0 +1,67 @@
+import json
+import os
+import time
+
+def is_blank(value):
+    """Indica se o valor está vazio (None, string vazia ou NaN do pandas)."""
+    if value is None:
+        return True
+    if isinstance(value, float) and value != value:
+        return True
+    return str(value).strip() == ''
+
+def row_key(row):
+    """Identificador estável da linha: o Hash, ou CRM/UF quando o Hash está vazio ou a coluna não existe."""
+    if not is_blank(row.get('Hash')):
+        return str(row['Hash']).strip()
+    return f"{str(row.get('CRM', '')).strip()}/{str(row.get('UF', '')).strip().upper()}"
+
+class RowJournal:
+    """Journal append-only (JSONL) com o estado de cada linha após cada iteração.
+
+    Cada linha do arquivo é um objeto com a chave da linha, a última iteração
+    concluída, os dados atuais e se o processamento da linha terminou. Linhas
+    pré-preenchidas pela base de médicos conhecidos levam também os valores
+    vencidos (`stale`) e os e-mails conhecidos (`known_emails`), que só são
+    usados no fim da linha. Na leitura vale o último registro de cada chave.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def load(path):
+        """Lê o journal e devolve o último estado de cada chave."""
+        entries = {}
+        if not os.path.exists(path):
+            return entries
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Última linha pode ter ficado incompleta se o processo caiu no meio da escrita
+                    continue
+                entries[entry['key']] = entry
+        return entries
+
+    def record(self, key, iteration, data, done=False, stale=None, known_emails=None):
+        """Registra o estado da linha após concluir a iteração `iteration`; retorna o registro gravado."""
+        entry = {
+            'key': key,
+            'iteration': iteration,
+            'done': done,
+            'ts': time.time(),
+            'data': data,
+        }
+        if stale:
+            entry['stale'] = stale
+        if known_emails is not None:
+            entry['known_emails'] = list(known_emails)
+        self.file.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        self.file.flush()
+        return entry
+
+    def close(self):
+        self.file.close()
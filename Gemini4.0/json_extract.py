@@ -0,0 +1,101 @@
+import json
+import re
+
+# Caracteres que alteram o estado do extrator, por tipo de JSON procurado
+SIGNIFICANT_CHARS = {
+    'object': re.compile(r'[{}"\\]'),
+    'array': re.compile(r'[\[\]"\\]'),
+}
+
+class JsonExtractor:
+    """Extrator incremental de JSON em uma única passada.
+
+    Recebe o texto da resposta em pedaços (`feed`), por exemplo os chunks de
+    `generate_content_stream`, e devolve o primeiro objeto (ou array) JSON
+    completo assim que o fechamento dele chega. O balanceamento de chaves
+    ignora chaves dentro de strings e respeita escapes; texto antes ou depois
+    do JSON (cercas ```json, explicações) é descartado. Um trecho balanceado
+    que não é JSON válido é ignorado e a busca continua a partir do fim dele.
+    """
+
+    def __init__(self, kind='object'):
+        self.open_char, self.close_char = ('{', '}') if kind == 'object' else ('[', ']')
+        self.pattern = SIGNIFICANT_CHARS[kind]
+        self.buffer = ''
+        self.position = 0
+        self.skip_until = 0
+        self.start = -1
+        self.depth = 0
+        self.in_string = False
+        self.result = None
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    def feed(self, chunk):
+        """Acrescenta um pedaço do texto; retorna o JSON assim que houver um completo (senão None)."""
+        if self.result is not None:
+            return self.result
+        if not chunk:
+            return None
+        if self.start == -1:
+            # Fora de um JSON só interessa o próximo caractere de abertura
+            index = chunk.find(self.open_char)
+            if index == -1:
+                return None
+            chunk = chunk[index:]
+            self.buffer = ''
+            self.position = 0
+            self.skip_until = 0
+        self.buffer += chunk
+        buffer = self.buffer
+        open_char, close_char = self.open_char, self.close_char
+
+        # Percorre apenas os caracteres que mudam o estado (aberturas, fechamentos, aspas e barras)
+        for match in self.pattern.finditer(buffer, self.position):
+            i = match.start()
+            if i < self.skip_until:
+                continue
+            char = buffer[i]
+            if self.start == -1:
+                if char == open_char:
+                    self.start = i
+                    self.depth = 1
+            elif self.in_string:
+                if char == '\\':
+                    self.skip_until = i + 2
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == open_char:
+                self.depth += 1
+            elif char == close_char:
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        self.result = json.loads(buffer[self.start:i + 1])
+                        return self.result
+                    except json.JSONDecodeError:
+                        self.start = -1
+
+        if self.start == -1:
+            self.buffer = ''
+            self.position = 0
+            self.skip_until = 0
+        else:
+            # Mantém apenas o trecho a partir da abertura do JSON em andamento
+            self.buffer = buffer[self.start:]
+            self.position = len(buffer) - self.start
+            self.skip_until = max(0, self.skip_until - self.start)
+            self.start = 0
+        return None
+
+def extract_json_object(text):
+    """Primeiro objeto JSON completo do texto, ou None."""
+    return JsonExtractor('object').feed(text)
+
+def extract_json_array(text):
+    """Primeiro array JSON completo do texto, ou None."""
+    return JsonExtractor('array').feed(text)
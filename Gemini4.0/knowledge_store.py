@@ -0,0 +1,117 @@
+import time
+
+from dedup import doctor_key
+from journal import is_blank
+from planner import GENERAL_FIELDS
+from sqlite_store import open_sqlite
+
+# Configuração padrão da base de médicos já enriquecidos
+DEFAULT_KNOWLEDGE_PATH = 'medicos_conhecidos.sqlite'
+DEFAULT_MAX_AGE_DAYS = 90
+
+# Campos guardados entre execuções
+KNOWLEDGE_FIELDS = ['Firstname', 'LastName'] + GENERAL_FIELDS + ['chance_email_a1', 'chance_email_a2']
+
+class KnownField:
+    """Valor conhecido de um campo, com a data e a iteração em que foi encontrado."""
+
+    def __init__(self, value, updated_at, source_iteration):
+        self.value = value
+        self.updated_at = updated_at
+        self.source_iteration = source_iteration
+
+class KnowledgeStore:
+    """Base persistente (SQLite) com o melhor registro conhecido de cada médico.
+
+    Cada campo é guardado com a data em que foi encontrado e a iteração de
+    origem, indexado por CRM+UF normalizados. `prefill` preenche os campos
+    vazios de uma linha com os valores dentro da janela de validade; os
+    valores vencidos não são usados no prompt (o campo volta a ser buscado) e
+    só servem de reserva se a busca não encontrar nada.
+    """
+
+    def __init__(self, path=DEFAULT_KNOWLEDGE_PATH, max_age_seconds=DEFAULT_MAX_AGE_DAYS * 86400):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.prefilled_rows = 0
+        self.prefilled_fields = 0
+        self.recorded_fields = 0
+        self.conn = open_sqlite(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS doctor_fields (
+                crm TEXT NOT NULL,
+                uf TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                source_iteration INTEGER NOT NULL,
+                PRIMARY KEY (crm, uf, field)
+            )
+        """)
+        # A chave primária começa por (crm, uf) e serve de índice para as consultas por médico
+
+    @staticmethod
+    def _split_key(data):
+        key = doctor_key(data)
+        if key is None:
+            return None
+        return tuple(key.split('/', 1))
+
+    def load(self, data):
+        """Campos conhecidos do médico da linha, como {campo: KnownField}."""
+        key = self._split_key(data)
+        if key is None:
+            return {}
+        rows = self.conn.execute(
+            "SELECT field, value, updated_at, source_iteration FROM doctor_fields WHERE crm = ? AND uf = ?", key
+        ).fetchall()
+        return {field: KnownField(value, updated_at, iteration) for field, value, updated_at, iteration in rows}
+
+    def prefill(self, data):
+        """Preenche os campos vazios com os valores ainda válidos.
+
+        Retorna (campos preenchidos, valores vencidos), onde os valores vencidos
+        são um dicionário campo -> valor para uso como reserva.
+        """
+        known = self.load(data)
+        now = time.time()
+        filled = []
+        stale = {}
+        for field, entry in known.items():
+            if field not in KNOWLEDGE_FIELDS or not is_blank(data.get(field)):
+                continue
+            if now - entry.updated_at <= self.max_age_seconds:
+                data[field] = entry.value
+                filled.append(field)
+            else:
+                stale[field] = entry.value
+        if filled:
+            self.prefilled_rows += 1
+            self.prefilled_fields += len(filled)
+        return filled, stale
+
+    def record(self, data, iteration, before):
+        """Guarda os campos que a iteração preencheu ou alterou."""
+        key = self._split_key(data)
+        if key is None:
+            return
+        now = time.time()
+        changed = [
+            (key[0], key[1], field, str(data[field]), now, iteration)
+            for field in KNOWLEDGE_FIELDS
+            if not is_blank(data.get(field)) and data.get(field) != before.get(field)
+        ]
+        if changed:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO doctor_fields (crm, uf, field, value, updated_at, source_iteration) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                changed,
+            )
+            self.recorded_fields += len(changed)
+
+    def summary(self):
+        return (f"{self.prefilled_rows} linhas pré-preenchidas ({self.prefilled_fields} campos), "
+                f"{self.recorded_fields} campos gravados")
+
+    def close(self):
+        self.conn.close()
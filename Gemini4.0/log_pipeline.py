@@ -0,0 +1,127 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import zlib
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Rotação padrão dos arquivos de log
+DEFAULT_LOG_MAX_MB = 100
+DEFAULT_LOG_BACKUPS = 5
+
+# Quais registros levam o payload (dados da linha ou resposta bruta do modelo)
+PAYLOAD_MODES = ('nenhum', 'amostra', 'todos')
+DEFAULT_PAYLOAD_MODE = 'amostra'
+DEFAULT_PAYLOAD_SAMPLE_RATE = 0.01
+
+# No modo amostra, respostas brutas anexadas a erros são cortadas neste tamanho
+MAX_ERROR_PAYLOAD_CHARS = 2000
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+class PayloadPolicy:
+    """Decide quais registros de log levam o payload.
+
+    - nenhum: nenhum payload é gravado.
+    - amostra: os payloads de uma fração `sample_rate` das linhas (escolhidas
+      pelo hash da chave, para que uma linha amostrada tenha todos os seus
+      payloads) e os anexados a erros, cortados em `MAX_ERROR_PAYLOAD_CHARS`.
+    - todos: todos os payloads, como no log antigo.
+    """
+
+    def __init__(self, mode=DEFAULT_PAYLOAD_MODE, sample_rate=DEFAULT_PAYLOAD_SAMPLE_RATE):
+        self.mode = mode
+        self.sample_rate = sample_rate
+
+    def _sampled(self, key):
+        if key is None:
+            return False
+        return zlib.crc32(str(key).encode('utf-8')) % 10000 < self.sample_rate * 10000
+
+    def extra(self, payload, key=None, error=False):
+        """`extra` do registro de log: {'payload': ...} ou {} quando o payload não deve ser gravado."""
+        if self.mode == 'nenhum':
+            return {}
+        if self.mode == 'amostra':
+            if not error and not self._sampled(key):
+                return {}
+            if isinstance(payload, str) and len(payload) > MAX_ERROR_PAYLOAD_CHARS:
+                payload = payload[:MAX_ERROR_PAYLOAD_CHARS] + '...'
+        # Cópia rasa: o registro é serializado depois, em outra thread, e os dados da linha continuam mudando
+        if isinstance(payload, dict):
+            payload = dict(payload)
+        return {'payload': payload}
+
+# Política usada por `payload_extra`; configurada por `start_async_logging`
+PAYLOADS = PayloadPolicy()
+
+def payload_extra(payload, key=None, error=False):
+    """Atalho para `PAYLOADS.extra`, usado nas chamadas de log com dados da linha ou respostas."""
+    return PAYLOADS.extra(payload, key, error)
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=str, separators=(',', ':'))
+
+class JsonLinesFormatter(logging.Formatter):
+    """Um objeto JSON compacto por registro, com o payload como campo próprio."""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'msg': record.getMessage(),
+        }
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            entry['payload'] = payload
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return _dumps(entry)
+
+class TextFormatter(logging.Formatter):
+    """Formato texto do log antigo, com o payload em JSON compacto no fim da linha."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            text += ' ' + _dumps(payload)
+        return text
+
+class StructuredQueueHandler(QueueHandler):
+    """QueueHandler que mantém o payload no registro em vez de formatar a mensagem na thread de quem loga."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def rotating_file_handler(path, log_format='json', max_mb=DEFAULT_LOG_MAX_MB, backups=DEFAULT_LOG_BACKUPS):
+    """Handler de arquivo com rotação por tamanho, em JSON lines ou texto."""
+    handler = RotatingFileHandler(path, maxBytes=int(max_mb * 1024 * 1024), backupCount=backups, encoding='utf-8')
+    handler.setFormatter(JsonLinesFormatter() if log_format == 'json' else TextFormatter())
+    return handler
+
+def start_async_logging(logger, handlers, payload_mode=DEFAULT_PAYLOAD_MODE,
+                        payload_sample_rate=DEFAULT_PAYLOAD_SAMPLE_RATE):
+    """Liga o logger aos handlers por uma fila; a escrita acontece na thread do QueueListener.
+
+    Quem loga só coloca o registro na fila. O listener é encerrado (gravando
+    o que estiver pendente) ao final do processo.
+    """
+    PAYLOADS.mode = payload_mode
+    PAYLOADS.sample_rate = payload_sample_rate
+    records = queue.SimpleQueue()
+    logger.addHandler(StructuredQueueHandler(records))
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
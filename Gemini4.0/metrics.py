@@ -0,0 +1,224 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites dos buckets dos histogramas de latência, em segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, math.inf)
+
+# Interface do endpoint /metrics; só a própria máquina acessa, a menos que outra seja informada
+DEFAULT_METRICS_HOST = '127.0.0.1'
+
+# Descrição de cada métrica exportada no /metrics
+METRIC_HELP = {
+    'gemini_request_seconds': "Duração das chamadas ao modelo, por chave",
+    'gemini_iteration_seconds': "Duração de cada iteração executada (com novas tentativas), por iteração",
+    'gemini_step_seconds': "Duração das etapas de uma tentativa: chamada (com espera de cota), extração do JSON e merge",
+    'gemini_requests_total': "Chamadas ao modelo concluídas, por chave",
+    'gemini_request_errors_total': "Chamadas ao modelo que falharam, por chave e classe de erro",
+    'gemini_rate_limited_total': "Respostas 429 / RESOURCE_EXHAUSTED, por chave",
+    'gemini_retries_total': "Novas tentativas de uma iteração, por classe de erro",
+    'gemini_parse_failures_total': "Respostas sem JSON válido",
+    'gemini_cache_hits_total': "Chamadas servidas pelo cache de respostas",
+    'gemini_tokens_total': "Tokens de entrada e de saída informados pela API",
+    'gemini_rows_total': "Linhas concluídas",
+    'gemini_rows_per_minute': "Linhas concluídas por minuto desde o início da execução",
+    'gemini_queue_depth': "Linhas lidas do input aguardando um worker do motor",
+    'gemini_rows_in_flight': "Linhas em processamento",
+    'gemini_stage_queue_depth': "Linhas aguardando vaga em cada estágio do --pipeline",
+}
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+def _bound_text(bound):
+    return '+Inf' if bound == math.inf else repr(bound)
+
+class Histogram:
+    """Histograma com buckets fixos, no formato do Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Quantil aproximado pelo limite superior do bucket (o máximo observado no último)."""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': round(self.sum / self.count, 4) if self.count else 0.0,
+            'p50': round(self.quantile(0.5), 4),
+            'p95': round(self.quantile(0.95), 4),
+            'max': round(self.max, 4),
+        }
+
+class Metrics:
+    """Métricas da execução: histogramas de latência, contadores e medidores.
+
+    É atualizada pelo loop assíncrono e lida pelo servidor HTTP em outra
+    thread, por isso todos os acessos passam por um lock. Os medidores são
+    funções avaliadas no momento da leitura (ex.: tamanho de uma fila).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, callback, **labels):
+        """Registra um medidor cujo valor é `callback()` no momento da leitura."""
+        with self.lock:
+            self.gauges[self._key(name, labels)] = callback
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Mede a duração do bloco no histograma `name`."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def counter(self, name):
+        """Soma do contador em todos os rótulos."""
+        with self.lock:
+            return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+    def rows_per_minute(self):
+        elapsed = time.monotonic() - self.started
+        return self.counter('gemini_rows_total') * 60 / elapsed if elapsed > 0 else 0.0
+
+    def _gauge_values(self):
+        values = {}
+        for key, callback in self.gauges.items():
+            try:
+                values[key] = callback()
+            except Exception:
+                # Um medidor de um componente já encerrado não derruba a leitura das demais métricas
+                continue
+        return values
+
+    def render(self):
+        """Métricas no formato texto do Prometheus."""
+        rows_per_minute = self.rows_per_minute()
+        lines = []
+        with self.lock:
+            gauges = self._gauge_values()
+            gauges[('gemini_rows_per_minute', ())] = rows_per_minute
+            sections = {}
+            for (name, labels), value in self.counters.items():
+                sections.setdefault((name, 'counter'), []).append(f"{name}{_label_text(labels)} {value}")
+            for (name, labels), value in gauges.items():
+                sections.setdefault((name, 'gauge'), []).append(f"{name}{_label_text(labels)} {value}")
+            for (name, labels), histogram in self.histograms.items():
+                samples = sections.setdefault((name, 'histogram'), [])
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    bucket_labels = labels + (('le', _bound_text(bound)),)
+                    samples.append(f"{name}_bucket{_label_text(bucket_labels)} {cumulative}")
+                samples.append(f"{name}_sum{_label_text(labels)} {histogram.sum}")
+                samples.append(f"{name}_count{_label_text(labels)} {histogram.count}")
+        for (name, kind), samples in sorted(sections.items()):
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Resumo da execução em um dicionário serializável em JSON."""
+        rows_per_minute = self.rows_per_minute()
+        with self.lock:
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                label = ','.join(f"{key}={value}" for key, value in labels) or 'total'
+                histograms.setdefault(name, {})[label] = histogram.snapshot()
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                label = ','.join(f"{key}={value}" for key, value in labels) or 'total'
+                counters.setdefault(name, {})[label] = value
+        return {
+            'duracao_segundos': round(time.monotonic() - self.started, 1),
+            'linhas_por_minuto': round(rows_per_minute, 2),
+            'histogramas': histograms,
+            'contadores': counters,
+        }
+
+    def write_summary(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+
+    def serve(self, port, host=DEFAULT_METRICS_HOST):
+        """Expõe /metrics (Prometheus) e /metrics.json em uma thread; retorna o servidor."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = metrics.render().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(metrics.summary(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # As consultas do Prometheus não vão para o log da execução
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
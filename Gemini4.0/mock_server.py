@@ -0,0 +1,404 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from json_extract import extract_json_object
+from prompt_compiler import TASK_LABELS
+
+# Respostas padrão por tipo de prompt, no mesmo formato que o modelo devolve
+CANNED_RESPONSES = {
+    'general': """```json
+{
+  "especialidade_medica": "Cardiologia",
+  "endereco_completo_a1": "Rua das Flores, 123, Sala 45, Centro, São Paulo, SP, 01000-000",
+  "logradouro_a1": "Rua das Flores",
+  "numero_a1": "123",
+  "complemento_a1": "Sala 45",
+  "bairro_a1": "Centro",
+  "cep_a1": "01000-000",
+  "cidade_a1": "São Paulo",
+  "estado_a1": "SP",
+  "phone_a1": "+55 (11) 1234-5678",
+  "phone_a2": "",
+  "cell_phone_a1": "+55 (11) 98765-4321",
+  "cell_phone_a2": "",
+  "email_a1": "contato@clinica.com.br",
+  "email_a2": ""
+}
+```""",
+    'phones': """```json
+{
+  "phone_a1": "+55 (11) 1234-5678",
+  "phone_a2": "",
+  "cell_phone_a1": "+55 (11) 98765-4321",
+  "cell_phone_a2": ""
+}
+```""",
+    'emails': """```json
+{
+  "email_a1": "contato@clinica.com.br",
+  "email_a2": ""
+}
+```""",
+    'chance': """```json
+{
+  "email1": "contato@clinica.com.br",
+  "chance_email_a1": "PROVAVEL",
+  "email2": "",
+  "chance_email_a2": "NADA PROVAVEL"
+}
+```""",
+}
+
+# Explicação que modelos costumam acrescentar depois do JSON (opção --trailing-text)
+TRAILING_TEXT = """
+
+**Observações sobre a busca:** as informações acima foram obtidas em sites de clínicas, diretórios médicos
+e no cadastro do conselho regional. Alguns dados podem estar desatualizados; recomenda-se confirmar o
+endereço e os telefones diretamente com o consultório antes de utilizá-los. Não foram encontrados outros
+contatos públicos para este profissional.
+"""
+
+# Marcador das instruções do modo em lote (batching.py)
+BATCH_MARKER = '**MODO EM LOTE:**'
+
+def batch_response(prompt_text, text):
+    """Resposta de um prompt em lote: um array com o objeto da resposta para cada "id" dos médicos enviados."""
+    item = extract_json_object(text) or {}
+    ids = []
+    for match in re.finditer(r'"id":\s*("(?:[^"\\]|\\.)*")', prompt_text):
+        doctor_id = json.loads(match.group(1))
+        if doctor_id not in ids:
+            ids.append(doctor_id)
+    array = [dict(item, id=doctor_id) for doctor_id in ids]
+    return "```json\n" + json.dumps(array, ensure_ascii=False, indent=2) + "\n```"
+
+def structured_response(schema):
+    """Resposta JSON para chamadas com `responseSchema`, preenchida com os valores das respostas padrão."""
+    values = {}
+    for text in CANNED_RESPONSES.values():
+        values.update(json.loads(text.strip('`').removeprefix('json')))
+    result = {}
+    for field, spec in schema.get('properties', {}).items():
+        value = values.get(field, '')
+        if spec.get('enum') and value not in spec['enum']:
+            value = spec['enum'][0]
+        result[field] = value
+    return json.dumps(result, ensure_ascii=False)
+
+def prompt_kind(prompt_text):
+    """Identifica o tipo de prompt (iteração) pelo texto da tarefa."""
+    # Com a system instruction compartilhada (--context-cache), a tarefa vem indicada na mensagem
+    for kind, label in TASK_LABELS.items():
+        if f"**Tarefa atual:** {label}\n" in prompt_text:
+            return 'general' if kind == 'confirm' else kind
+    if 'Encontrar números de telefone' in prompt_text:
+        return 'phones'
+    if 'Encontrar e-mails de contato' in prompt_text:
+        return 'emails'
+    if 'Analise a probabilidade' in prompt_text:
+        return 'chance'
+    return 'general'
+
+def request_prompt_text(request, system_instruction=None):
+    """Texto da system instruction e das mensagens de uma requisição no formato da API."""
+    if system_instruction is None:
+        system_instruction = request.get('systemInstruction') or {}
+    return ''.join(
+        part.get('text', '')
+        for content in [system_instruction] + request.get('contents', [])
+        for part in content.get('parts', [])
+    )
+
+def batch_responder(settings=None):
+    """`responder` do `LocalBatchClient` com as respostas deste servidor (usado por `--batch-api-local`)."""
+    settings = settings or MockSettings()
+
+    def respond(key, request):
+        return settings.pick_response(request_prompt_text(request))
+
+    return respond
+
+def load_recorded_responses(path):
+    """Lê respostas gravadas (JSONL com os campos "kind" opcional e "text")."""
+    recorded = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recorded.setdefault(entry.get('kind', 'general'), []).append(entry['text'])
+    return recorded
+
+class MockSettings:
+    """Comportamento do servidor simulado."""
+
+    def __init__(self, latency=0.5, jitter=0.25, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_delay=2.0, recorded=None, seed=None, stream_chunk_size=64, stream_chunk_delay=0.05,
+                 trailing_text='', cache_lifetime=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_delay = retry_delay
+        self.recorded = recorded or {}
+        self.stream_chunk_size = stream_chunk_size
+        self.stream_chunk_delay = stream_chunk_delay
+        self.trailing_text = trailing_text
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.cancelled_streams = 0
+        self.cached_contents = {}
+        self.created_caches = 0
+        # Idade a partir da qual um cache de contexto some do servidor, ignorando o TTL (None: nunca)
+        self.cache_lifetime = cache_lifetime
+        self.expired_caches = 0
+
+    def cached_content(self, name):
+        """Cache de contexto `name`, ou None se ele não existir ou já tiver passado do `cache_lifetime`."""
+        with self.lock:
+            entry = self.cached_contents.get(name)
+            if entry is not None and self.cache_lifetime is not None \
+                    and time.monotonic() - entry['created'] > self.cache_lifetime:
+                del self.cached_contents[name]
+                self.expired_caches += 1
+                entry = None
+            return entry
+
+    def pick_response(self, prompt_text):
+        kind = prompt_kind(prompt_text)
+        with self.lock:
+            options = self.recorded.get(kind)
+            if options:
+                return self.random.choice(options)
+        return CANNED_RESPONSES[kind]
+
+    def draw(self):
+        """Sorteia o desfecho da requisição: 'ok', 'error' ou 'rate_limit'."""
+        with self.lock:
+            self.requests += 1
+            value = self.random.random()
+            if value < self.rate_limit_rate:
+                self.rate_limited += 1
+                return 'rate_limit'
+            if value < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return 'error'
+            return 'ok'
+
+    def delay(self):
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+def make_handler(settings):
+    """Cria o handler HTTP que imita os endpoints `generateContent` e `streamGenerateContent` da API do Gemini."""
+
+    class MockGeminiHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if status == 429:
+                self.send_header('Retry-After', str(int(settings.retry_delay)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, payloads):
+            """Envia os payloads como eventos SSE em chunks; para se o cliente fechar a conexão."""
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for index, payload in enumerate(payloads):
+                    if index:
+                        time.sleep(settings.stream_chunk_delay)
+                    event = f"data: {json.dumps(payload, ensure_ascii=False)}\r\n\r\n".encode('utf-8')
+                    self.wfile.write(f"{len(event):X}\r\n".encode('ascii') + event + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                with settings.lock:
+                    settings.cancelled_streams += 1
+                self.close_connection = True
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def _cached_content(self, name, ttl):
+            entry = settings.cached_contents[name]
+            expire_time = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + float(ttl.rstrip('s'))))
+            return {'name': name, 'model': entry['model'], 'expireTime': expire_time,
+                    'usageMetadata': {'totalTokenCount': entry['tokens']}}
+
+        def _create_cached_content(self, request):
+            """Imita o `cachedContents.create`: guarda a system instruction para as chamadas que a referenciarem."""
+            with settings.lock:
+                settings.created_caches += 1
+                name = f"cachedContents/mock{settings.created_caches}"
+                text = ''.join(part.get('text', '') for part in (request.get('systemInstruction') or {}).get('parts', []))
+                settings.cached_contents[name] = {
+                    'model': request.get('model', ''),
+                    'systemInstruction': request.get('systemInstruction') or {},
+                    'tokens': len(text) // 4,
+                    'created': time.monotonic(),
+                }
+            self._send_json(200, self._cached_content(name, request.get('ttl', '3600s')))
+
+        def do_PATCH(self):
+            request = self._read_json()
+            name = self.path.split('/v1beta/', 1)[-1].split('?', 1)[0]
+            if settings.cached_content(name) is None:
+                self._send_json(404, {'error': {'code': 404, 'status': 'NOT_FOUND', 'message': name}})
+                return
+            self._send_json(200, self._cached_content(name, request.get('ttl', '3600s')))
+
+        def do_DELETE(self):
+            name = self.path.split('/v1beta/', 1)[-1].split('?', 1)[0]
+            with settings.lock:
+                settings.cached_contents.pop(name, None)
+            self._send_json(200, {})
+
+        def do_POST(self):
+            request = self._read_json()
+            if self.path.split('?', 1)[0].endswith('/cachedContents'):
+                self._create_cached_content(request)
+                return
+            stream = ':streamGenerateContent' in self.path
+            if ':generateContent' not in self.path and not stream:
+                self._send_json(404, {'error': {'code': 404, 'status': 'NOT_FOUND', 'message': self.path}})
+                return
+
+            time.sleep(settings.delay())
+            outcome = settings.draw()
+            if outcome == 'rate_limit':
+                self._send_json(429, {'error': {
+                    'code': 429,
+                    'status': 'RESOURCE_EXHAUSTED',
+                    'message': 'Resource has been exhausted (mock).',
+                    'details': [{
+                        '@type': 'type.googleapis.com/google.rpc.RetryInfo',
+                        'retryDelay': f"{settings.retry_delay}s",
+                    }],
+                }})
+                return
+            if outcome == 'error':
+                self._send_json(500, {'error': {'code': 500, 'status': 'INTERNAL', 'message': 'Internal error (mock).'}})
+                return
+
+            system_instruction = request.get('systemInstruction') or {}
+            cached_tokens = 0
+            if request.get('cachedContent'):
+                cached = settings.cached_content(request['cachedContent'])
+                if cached is None:
+                    self._send_json(404, {'error': {'code': 404, 'status': 'NOT_FOUND',
+                                                    'message': f"CachedContent not found: {request['cachedContent']}"}})
+                    return
+                system_instruction = cached['systemInstruction']
+                cached_tokens = cached['tokens']
+            prompt_text = request_prompt_text(request, system_instruction)
+            schema = request.get('generationConfig', {}).get('responseSchema')
+            if schema:
+                text = structured_response(schema)
+            elif BATCH_MARKER in prompt_text:
+                text = batch_response(prompt_text, settings.pick_response(prompt_text)) + settings.trailing_text
+            else:
+                text = settings.pick_response(prompt_text) + settings.trailing_text
+            prompt_tokens = len(prompt_text) // 4
+            output_tokens = len(text) // 4
+            usage = {
+                'promptTokenCount': prompt_tokens,
+                'candidatesTokenCount': output_tokens,
+                'totalTokenCount': prompt_tokens + output_tokens,
+            }
+            if cached_tokens:
+                usage['cachedContentTokenCount'] = cached_tokens
+            if stream:
+                size = max(1, settings.stream_chunk_size)
+                pieces = [text[i:i + size] for i in range(0, len(text), size)]
+                payloads = [
+                    {'candidates': [{'content': {'role': 'model', 'parts': [{'text': piece}]}, 'index': 0}]}
+                    for piece in pieces
+                ]
+                payloads[-1]['candidates'][0]['finishReason'] = 'STOP'
+                payloads[-1]['usageMetadata'] = usage
+                self._send_stream(payloads)
+                return
+            self._send_json(200, {
+                'candidates': [{
+                    'content': {'role': 'model', 'parts': [{'text': text}]},
+                    'finishReason': 'STOP',
+                    'index': 0,
+                }],
+                'usageMetadata': usage,
+            })
+
+    return MockGeminiHandler
+
+def start_mock_server(settings, host='127.0.0.1', port=0):
+    """Inicia o servidor simulado em uma thread; retorna o servidor e a URL base."""
+    server = ThreadingHTTPServer((host, port), make_handler(settings))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que simula a API do Gemini para testes de carga.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help="Latência média das respostas, em segundos")
+    parser.add_argument('--jitter', type=float, default=0.25, help="Variação máxima da latência, em segundos")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Proporção de respostas 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Proporção de respostas 429")
+    parser.add_argument('--retry-delay', type=float, default=2.0, help="Espera sugerida nas respostas 429, em segundos")
+    parser.add_argument('--responses', help="Arquivo JSONL com respostas gravadas")
+    parser.add_argument('--stream-chunk-size', type=int, default=64, help="Caracteres por evento no modo streaming")
+    parser.add_argument('--stream-chunk-delay', type=float, default=0.05, help="Intervalo entre eventos do stream, em segundos")
+    parser.add_argument('--trailing-text', action='store_true', help="Acrescenta um texto explicativo depois do JSON")
+    parser.add_argument('--cache-lifetime', type=float,
+                        help="Segundos depois dos quais um cache de contexto some do servidor, mesmo com TTL renovado")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    settings = MockSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_delay=args.retry_delay,
+        recorded=load_recorded_responses(args.responses) if args.responses else None,
+        seed=args.seed,
+        stream_chunk_size=args.stream_chunk_size,
+        stream_chunk_delay=args.stream_chunk_delay,
+        trailing_text=TRAILING_TEXT if args.trailing_text else '',
+        cache_lifetime=args.cache_lifetime,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(settings))
+    server.daemon_threads = True
+    print(f"Servidor simulado do Gemini em http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Requisições: {settings.requests}, erros: {settings.errors}, 429: {settings.rate_limited}, "
+              f"streams encerrados pelo cliente: {settings.cancelled_streams}, "
+              f"caches de contexto expirados: {settings.expired_caches}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+# Estágios do enriquecimento e as iterações de cada um
+STAGES = [
+    ('gerais', range(0, 6)),
+    ('telefones', range(6, 7)),
+    ('emails', range(7, 8)),
+    ('probabilidade', range(8, 9)),
+]
+
+# Vagas padrão de cada estágio
+DEFAULT_STAGE_WORKERS = 64
+
+def stage_of(iteration):
+    """Nome do estágio a que pertence a iteração."""
+    for name, iterations in STAGES:
+        if iteration in iterations:
+            return name
+    raise ValueError(f"Iteração fora dos estágios: {iteration}")
+
+def parse_stage_workers(value):
+    """Converte '64' ou '64,32,32,16' nas vagas de cada estágio, na ordem de `STAGES`."""
+    parts = [int(part) for part in str(value).split(',') if part.strip()]
+    if len(parts) == 1:
+        parts = parts * len(STAGES)
+    if len(parts) != len(STAGES) or min(parts) < 1:
+        raise ValueError(f"Informe uma quantidade de vagas ou uma para cada um dos {len(STAGES)} estágios")
+    return {name: workers for (name, _), workers in zip(STAGES, parts)}
+
+class Stage:
+    """Fila e vagas de um estágio, com as estatísticas de espera e ocupação."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.active = 0
+        self.max_waiting = 0
+        self.entered = 0
+        self.wait_seconds = 0.0
+        self.busy_seconds = 0.0
+
+class StageSlot:
+    """Vaga de uma linha no pipeline; a linha ocupa no máximo um estágio por vez."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.stage = None
+        self.entered_at = 0.0
+
+    async def enter(self, name):
+        """Passa a linha para o estágio, aguardando na fila dele se todas as vagas estiverem ocupadas."""
+        if self.stage is not None and self.stage.name == name:
+            return
+        self.release()
+        stage = self.pipeline.stages[name]
+        stage.waiting += 1
+        stage.max_waiting = max(stage.max_waiting, stage.waiting)
+        started = time.monotonic()
+        try:
+            await stage.slots.acquire()
+        finally:
+            stage.waiting -= 1
+        self.entered_at = time.monotonic()
+        stage.wait_seconds += self.entered_at - started
+        stage.entered += 1
+        stage.active += 1
+        self.stage = stage
+
+    def release(self):
+        """Libera a vaga do estágio atual, se houver."""
+        if self.stage is None:
+            return
+        self.stage.busy_seconds += time.monotonic() - self.entered_at
+        self.stage.active -= 1
+        self.stage.slots.release()
+        self.stage = None
+
+class StagePipeline:
+    """Divide o enriquecimento em estágios com vagas próprias.
+
+    As passadas gerais, a busca de telefones, a busca de e-mails e a avaliação
+    dos e-mails têm cada uma sua fila e seu número de vagas. Uma linha ocupa a
+    vaga de um estágio só enquanto executa as iterações dele e, ao terminar,
+    entra na fila do estágio seguinte, liberando a vaga para a próxima linha.
+    Assim as linhas em processamento ficam distribuídas entre os estágios e
+    um estágio lento não impede os demais de avançar. As iterações puladas
+    pelo planner não ocupam vaga.
+    """
+
+    def __init__(self, workers=None):
+        workers = workers or {}
+        self.stages = {
+            name: Stage(name, workers.get(name, DEFAULT_STAGE_WORKERS))
+            for name, _ in STAGES
+        }
+
+    @property
+    def total_workers(self):
+        return sum(stage.workers for stage in self.stages.values())
+
+    def slot(self):
+        return StageSlot(self)
+
+    def queue_depths(self):
+        """Linhas aguardando vaga em cada estágio."""
+        return {name: stage.waiting for name, stage in self.stages.items()}
+
+    def report(self):
+        """Uma linha de resumo por estágio."""
+        lines = []
+        for stage in self.stages.values():
+            average_wait = stage.wait_seconds / stage.entered if stage.entered else 0.0
+            average_busy = stage.busy_seconds / stage.entered if stage.entered else 0.0
+            lines.append(f"{stage.name}: {stage.entered} linhas, {stage.workers} vagas, "
+                         f"espera média {average_wait:.2f}s (fila máxima {stage.max_waiting}), "
+                         f"tempo médio no estágio {average_busy:.2f}s")
+        return lines
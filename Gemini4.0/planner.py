@@ -0,0 +1,56 @@
+from journal import is_blank
+
+# Proporção de campos preenchidos a partir da qual as passadas gerais param
+DEFAULT_FILL_THRESHOLD = 0.9
+
+# Campos buscados nas passadas gerais (iterações 1 a 6)
+GENERAL_FIELDS = [
+    'Medical specialty', 'Endereco Completo A1', 'Address A1', 'Numero A1', 'Complement A1',
+    'Bairro A1', 'postal code A1', 'City A1', 'State A1', 'Phone A1', 'Phone A2',
+    'Cell phone A1', 'Cell phone A2', 'E-mail A1', 'E-mail A2'
+]
+
+class IterationPlanner:
+    """Decide, antes de cada iteração, se ela ainda tem algo a encontrar.
+
+    - Passadas gerais (iterações 1 a 6): param quando a proporção de campos
+      preenchidos atinge `fill_threshold` ou quando a passada anterior não
+      alterou nada (o prompt seguinte seria idêntico).
+    - Busca de telefones (iteração 7): só roda se faltar `Phone A1` ou `Cell phone A1`.
+    - Busca de e-mails (iteração 8): só roda se faltar algum dos dois e-mails.
+    - Avaliação de e-mails (iteração 9): só roda se houver ao menos um e-mail
+      e se a avaliação ainda não estiver nos dados (ex.: vinda da base de
+      médicos conhecidos).
+    """
+
+    def __init__(self, fill_threshold=DEFAULT_FILL_THRESHOLD):
+        self.fill_threshold = fill_threshold
+
+    @staticmethod
+    def fill_ratio(data, fields=GENERAL_FIELDS):
+        """Proporção dos campos informados que estão preenchidos."""
+        filled = sum(1 for field in fields if not is_blank(data.get(field)))
+        return filled / len(fields)
+
+    def plan(self, iteration, data, last_general_changed=True):
+        """Retorna (executar, motivo) para a iteração."""
+        if iteration < 6:
+            ratio = self.fill_ratio(data)
+            if ratio >= self.fill_threshold:
+                return False, f"{ratio:.0%} dos campos já preenchidos"
+            if iteration > 0 and not last_general_changed:
+                return False, "a passada anterior não alterou os dados"
+            return True, None
+        if iteration == 6:
+            if not is_blank(data.get('Phone A1')) and not is_blank(data.get('Cell phone A1')):
+                return False, "telefone e celular já preenchidos"
+            return True, None
+        if iteration == 7:
+            if not is_blank(data.get('E-mail A1')) and not is_blank(data.get('E-mail A2')):
+                return False, "os dois e-mails já preenchidos"
+            return True, None
+        if is_blank(data.get('E-mail A1')) and is_blank(data.get('E-mail A2')):
+            return False, "nenhum e-mail para avaliar"
+        if not is_blank(data.get('chance_email_a1')) and not is_blank(data.get('chance_email_a2')):
+            return False, "probabilidade dos e-mails já avaliada"
+        return True, None
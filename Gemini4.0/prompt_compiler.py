@@ -0,0 +1,248 @@
+import json
+
+from journal import is_blank
+from rate_limiter import CHARS_PER_TOKEN
+
+# Colunas de controle que o modelo nunca precisa ver
+IRRELEVANT_FIELDS = {'Hash', 'OPT-IN', 'STATUS', 'LOTE', 'chance_email_a1', 'chance_email_a2'}
+
+# Na avaliação dos e-mails bastam a identificação, a localização e os próprios e-mails
+CHANCE_FIELDS = ['CRM', 'UF', 'Firstname', 'LastName', 'Medical specialty', 'City A1', 'State A1',
+                 'E-mail A1', 'E-mail A2']
+
+# Instruções fixas de cada tipo de iteração, enviadas como system instruction
+SYSTEM_INSTRUCTIONS = {
+    'general': """
+Você é um assistente especialista em encontrar e organizar informações de profissionais de saúde no Brasil.
+
+**Tarefa Principal:** Completar e padronizar os dados do médico enviados pelo usuário (campos ausentes ainda não foram encontrados).
+
+**Instruções:**
+1. Use a busca apenas para as informações ausentes ou claramente desatualizadas.
+2. Compile TODOS os dados (os recebidos e os encontrados) em um único JSON, seguindo as regras abaixo.
+
+**Regras de Padronização Obrigatórias:**
+- `first_name`, `last_name`: Nome e sobrenome.
+- `especialidade_medica`: Apenas o nome da especialidade (ex: "Cardiologia").
+- `endereco_completo_a1`: Todas as partes do endereço em uma única string.
+- `logradouro_a1` (rua/avenida), `numero_a1` (apenas o número), `complemento_a1` (sala, andar, bloco), `bairro_a1`.
+- `cep_a1`: Formato 00000-000. `cidade_a1`: Nome da cidade. `estado_a1`: Sigla da UF (ex: "SP").
+- `phone_a1`, `phone_a2`: Fixos no formato +55 (DDD) XXXX-XXXX.
+- `cell_phone_a1`, `cell_phone_a2`: Celulares no formato +55 (DDD) 9XXXX-XXXX.
+- Não inclua números incompletos ou genéricos (com "X" ou "*").
+- `email_a1`, `email_a2`: Em letras minúsculas, sem espaços.
+
+Retorne APENAS um objeto JSON válido com essas chaves, sem nenhum texto adicional.
+Se uma informação não for encontrada, retorne "" para a chave correspondente.
+""",
+    'phones': """
+Você é um especialista em encontrar informações de contato de profissionais de saúde.
+
+**Tarefa CRÍTICA:** Encontrar números de telefone ou celular do médico enviado pelo usuário. Esta é uma tarefa de ALTA PRIORIDADE.
+
+**Instruções:**
+1. Faça uma busca EXAUSTIVA por números de telefone ou celular deste médico.
+2. Verifique sites de clínicas, consultórios, planos de saúde, conselhos regionais.
+3. Procure em listagens de profissionais, diretórios médicos, redes sociais.
+4. NÃO ACEITE números genéricos ou incompletos.
+5. Padronize TODOS os números encontrados no formato:
+   - Celular: +55 (DDD) 9XXXX-XXXX
+   - Fixo: +55 (DDD) XXXX-XXXX
+
+**Formato de Retorno:**
+Retorne APENAS um objeto JSON válido, sem nenhum texto ou explicação adicional, com as chaves
+phone_a1, phone_a2, cell_phone_a1 e cell_phone_a2.
+
+**IMPORTANTE:**
+- Você DEVE encontrar pelo menos um número de contato.
+- Não retorne números genéricos ou incompletos.
+- Verifique a autenticidade dos números encontrados.
+- Se não encontrar números válidos, retorne strings vazias.
+""",
+    'emails': """
+Você é um especialista em encontrar e-mails profissionais de médicos.
+
+**Tarefa CRÍTICA:** Encontrar e-mails de contato do médico enviado pelo usuário. Esta é uma tarefa de ALTA PRIORIDADE.
+
+**Instruções:**
+1. Faça uma busca EXAUSTIVA por e-mails deste médico.
+2. Verifique sites de clínicas, consultórios, planos de saúde.
+3. Procure em listagens de profissionais, diretórios médicos.
+4. Verifique redes sociais profissionais (LinkedIn, etc).
+5. Padronize TODOS os e-mails encontrados: letras minúsculas, sem espaços e sem caracteres especiais desnecessários.
+
+**Formato de Retorno:**
+Retorne APENAS um objeto JSON válido, sem nenhum texto ou explicação adicional, com as chaves email_a1 e email_a2.
+
+**IMPORTANTE:**
+- Você DEVE encontrar pelo menos um e-mail válido.
+- Não retorne e-mails genéricos ou temporários.
+- Verifique a autenticidade dos e-mails encontrados.
+- Se não encontrar e-mails válidos, retorne strings vazias.
+""",
+    'confirm': """
+Você é um assistente especialista em encontrar e organizar informações de profissionais de saúde no Brasil.
+
+**Tarefa:** O endereço e os telefones fixos do médico enviado pelo usuário foram encontrados para outro médico do mesmo local de atendimento.
+Confirme com uma busca rápida se este médico também atende nesse local e complete apenas os dados que faltarem.
+Se ele não atender nesse local, pesquise o endereço e os telefones corretos dele.
+
+Retorne APENAS um objeto JSON válido, sem nenhum texto adicional, com as chaves first_name, last_name,
+especialidade_medica, endereco_completo_a1, logradouro_a1, numero_a1, complemento_a1, bairro_a1, cep_a1,
+cidade_a1, estado_a1, phone_a1, phone_a2, cell_phone_a1, cell_phone_a2, email_a1 e email_a2.
+Se uma informação não for encontrada, retorne "" para a chave correspondente.
+""",
+    'chance': """
+Você é um especialista em análise de e-mails profissionais.
+
+**Tarefa:** Analise a probabilidade dos e-mails encontrados pertencerem ao médico enviado pelo usuário, baseado nos dados disponíveis.
+
+**Instruções:**
+1. Analise cada e-mail separadamente (E-mail A1 e E-mail A2).
+2. Compare com os dados do médico (nome, especialidade, localização).
+3. Avalie a probabilidade de cada e-mail pertencer ao médico.
+
+**Formato de Retorno:**
+Retorne APENAS um objeto JSON válido, sem nenhum texto ou explicação adicional, com as chaves
+email1, chance_email_a1, email2 e chance_email_a2; as chances são "MUITO PROVAVEL", "PROVAVEL" ou "NADA PROVAVEL".
+
+**Critérios de Avaliação:**
+- MUITO PROVAVEL: E-mail segue padrões claros do nome/especialidade.
+- PROVAVEL: Há alguma relação, mas não totalmente clara.
+- NADA PROVAVEL: E-mail parece genérico ou não relacionado. Use também quando o e-mail estiver vazio.
+""",
+}
+
+# Títulos das seções da system instruction compartilhada (--context-cache), citados na mensagem do usuário
+TASK_LABELS = {
+    'general': 'DADOS GERAIS',
+    'phones': 'TELEFONES',
+    'emails': 'E-MAILS',
+    'confirm': 'CONFIRMAR LOCAL',
+    'chance': 'AVALIAR E-MAILS',
+}
+
+SHARED_HEADER = """
+Você recebe na mensagem do usuário a tarefa atual e os dados do médico.
+Siga apenas as instruções da seção da tarefa atual; as demais seções valem para outras mensagens.
+"""
+
+def shared_system_instruction(examples=None):
+    """System instruction única com as instruções de todos os tipos de iteração e os exemplos de e-mail.
+
+    Sozinhas, as instruções de cada tipo ficam abaixo do mínimo de tokens de
+    um cache de contexto explícito; juntas formam um único prefixo por chave
+    que atinge o mínimo e é reaproveitado por todas as iterações.
+    """
+    sections = [SHARED_HEADER.strip()]
+    for kind, label in TASK_LABELS.items():
+        sections.append(f"## Tarefa {label}\n{SYSTEM_INSTRUCTIONS[kind].strip()}")
+    if examples and examples.strip():
+        sections.append(f"## Exemplos de e-mails profissionais de médicos\n{examples.strip()}")
+    return '\n\n'.join(sections)
+
+def prompt_kind(iteration):
+    """Tipo de prompt usado em cada iteração."""
+    if iteration < 6:
+        return 'general'
+    if iteration == 6:
+        return 'phones'
+    if iteration == 7:
+        return 'emails'
+    return 'chance'
+
+def approx_tokens(text):
+    """Estimativa de tokens de um texto, na mesma proporção usada pelo limitador de cota."""
+    return len(text or '') // CHARS_PER_TOKEN
+
+def compact_data(data, iteration):
+    """JSON compacto só com os campos preenchidos que interessam à iteração."""
+    # O "id" do modo em lote acompanha o médico em todas as iterações
+    fields = CHANCE_FIELDS + ['id'] if prompt_kind(iteration) == 'chance' else data.keys()
+    relevant = {
+        field: data[field]
+        for field in fields
+        if field in data and field not in IRRELEVANT_FIELDS and not is_blank(data[field])
+    }
+    return json.dumps(relevant, ensure_ascii=False, separators=(',', ':'), default=str)
+
+class IterationTokens:
+    """Tokens de entrada acumulados de uma iteração."""
+
+    def __init__(self):
+        self.calls = 0
+        self.legacy = 0
+        self.static = 0
+        self.dynamic = 0
+        self.reported = 0
+        self.reported_calls = 0
+
+class PromptCompiler:
+    """Gera prompts enxutos: instruções fixas na system instruction e dados em JSON compacto.
+
+    `compile` devolve a system instruction do tipo de iteração e a mensagem do
+    usuário, que traz apenas os campos preenchidos e relevantes. Para cada
+    prompt compilado são contabilizados os tokens estimados do prompt antigo e
+    do novo (parte fixa e parte variável), além dos tokens reais informados
+    pela API, e `report` resume a comparação por iteração.
+
+    Com `shared`, todas as iterações usam a mesma system instruction
+    (`shared_system_instruction`, com os `examples` de e-mail) e a mensagem do
+    usuário indica a tarefa atual; é o modo usado pelo cache de contexto.
+    """
+
+    def __init__(self, shared=False, examples=None):
+        self.tokens = {}
+        self.shared_instruction = shared_system_instruction(examples) if shared else None
+
+    def system_instruction(self, iteration, kind=None):
+        if self.shared_instruction is not None:
+            return self.shared_instruction
+        return SYSTEM_INSTRUCTIONS[kind or prompt_kind(iteration)].strip()
+
+    def user_prompt(self, data, iteration, kind=None):
+        """Mensagem do usuário com os dados do médico (ou a lista de médicos, no modo em lote)."""
+        task = ''
+        if self.shared_instruction is not None:
+            task = f"**Tarefa atual:** {TASK_LABELS[kind or prompt_kind(iteration)]}\n"
+        if isinstance(data, list):
+            records = ','.join(compact_data(record, iteration) for record in data)
+            return f"{task}**Dados dos Médicos:**\n[{records}]"
+        return f"{task}**Dados do Médico:**\n{compact_data(data, iteration)}"
+
+    def compile(self, data, iteration, legacy_prompt=None, kind=None):
+        """Retorna (system instruction, mensagem do usuário) e contabiliza os tokens.
+
+        `kind` substitui o tipo de prompt da iteração (ex.: 'confirm').
+        """
+        system_instruction = self.system_instruction(iteration, kind)
+        prompt_text = self.user_prompt(data, iteration, kind)
+        stats = self.tokens.setdefault(iteration, IterationTokens())
+        stats.calls += 1
+        stats.legacy += approx_tokens(legacy_prompt)
+        stats.static += approx_tokens(system_instruction)
+        stats.dynamic += approx_tokens(prompt_text)
+        return system_instruction, prompt_text
+
+    def record_usage(self, iteration, response):
+        """Soma os tokens de entrada informados pela API para a iteração."""
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None)
+        if prompt_tokens is not None and iteration in self.tokens:
+            self.tokens[iteration].reported += prompt_tokens
+            self.tokens[iteration].reported_calls += 1
+
+    def report(self):
+        """Linhas com a média de tokens de entrada por chamada em cada iteração, antes e depois."""
+        lines = []
+        for iteration in sorted(self.tokens):
+            stats = self.tokens[iteration]
+            legacy = stats.legacy / stats.calls
+            static = stats.static / stats.calls
+            dynamic = stats.dynamic / stats.calls
+            line = (f"Iteração {iteration + 1}: {stats.calls} prompts, ~{legacy:.0f} tokens antes, "
+                    f"~{static + dynamic:.0f} depois ({static:.0f} fixos + {dynamic:.0f} variáveis)")
+            if stats.reported_calls:
+                line += f", {stats.reported / stats.reported_calls:.0f} informados pela API"
+            lines.append(line)
+        return lines
@@ -0,0 +1,153 @@
+import asyncio
+import re
+import time
+
+# Cotas padrão por chave (requisições e tokens por minuto)
+DEFAULT_RPM = 60
+DEFAULT_TPM = 250_000
+
+# Espera usada quando a API devolve 429 sem indicar quanto tempo aguardar
+DEFAULT_RETRY_AFTER = 30.0
+
+# Reserva de tokens de saída somada à estimativa de entrada de cada chamada
+OUTPUT_TOKEN_RESERVE = 1024
+
+# Média aproximada de caracteres por token nos prompts em português
+CHARS_PER_TOKEN = 4
+
+class TokenBucket:
+    """Balde de tokens com capacidade máxima e reposição contínua."""
+
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+            self.updated = now
+
+    def time_until(self, amount, now=None):
+        """Segundos até haver `amount` tokens disponíveis (0 se já houver)."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        # Um pedido maior que a capacidade nunca caberia; limita à capacidade
+        amount = min(amount, self.capacity)
+        missing = amount - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.refill_per_second
+
+    def consume(self, amount, now=None):
+        """Retira tokens do balde; valores negativos devolvem tokens."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+class KeyRateLimiter:
+    """Controla as requisições por minuto e tokens por minuto de uma chave."""
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def time_until_ready(self, estimated_tokens, now=None):
+        """Segundos até a chave ter cota para uma requisição, sem consumir nada."""
+        now = time.monotonic() if now is None else now
+        return max(
+            self.blocked_until - now,
+            self.requests.time_until(1, now),
+            self.tokens.time_until(estimated_tokens, now),
+            0.0,
+        )
+
+    async def acquire(self, estimated_tokens):
+        """Aguarda até a chave ter cota para uma requisição com `estimated_tokens` tokens."""
+        # O lock mantém a ordem de chegada entre as chamadas que esperam pela mesma chave
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = self.time_until_ready(estimated_tokens, now)
+                if wait <= 0:
+                    self.requests.consume(1, now)
+                    self.tokens.consume(estimated_tokens, now)
+                    return
+                await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Ajusta o balde de tokens com o consumo real informado pela API."""
+        if actual_tokens is not None:
+            self.tokens.consume(actual_tokens - estimated_tokens)
+
+    def block_for(self, seconds):
+        """Suspende a chave por `seconds` segundos (ex.: após um 429)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        # Esvazia o balde de requisições para não disparar uma rajada ao fim do bloqueio
+        self.requests.tokens = min(self.requests.tokens, 1.0)
+
+class RateLimiter:
+    """Conjunto de limitadores, um por chave da API."""
+
+    def __init__(self, num_keys, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.limiters = [KeyRateLimiter(rpm, tpm) for _ in range(num_keys)]
+
+    def for_key(self, key_index):
+        return self.limiters[key_index]
+
+def estimate_tokens(text):
+    """Estimativa simples de tokens de uma chamada (entrada + reserva de saída)."""
+    return len(text) // CHARS_PER_TOKEN + OUTPUT_TOKEN_RESERVE
+
+def _parse_duration(value):
+    """Converte durações como '37s', '1.5s' ou '12' em segundos."""
+    match = re.match(r'^\s*([\d.]+)\s*s?\s*$', str(value))
+    if match:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            return None
+    return None
+
+def is_rate_limit_error(exc):
+    """Indica se a exceção é um 429 / RESOURCE_EXHAUSTED."""
+    if getattr(exc, 'code', None) == 429:
+        return True
+    if getattr(exc, 'status', None) == 'RESOURCE_EXHAUSTED':
+        return True
+    return 'RESOURCE_EXHAUSTED' in str(exc)
+
+def retry_after_seconds(exc):
+    """Retorna quantos segundos aguardar após um 429, ou None se a exceção não for de cota."""
+    if not is_rate_limit_error(exc):
+        return None
+
+    # Cabeçalho HTTP Retry-After
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        retry_after = _parse_duration(headers.get('retry-after', ''))
+        if retry_after is not None:
+            return retry_after
+
+    # google.rpc.RetryInfo dentro dos detalhes do erro
+    details = getattr(exc, 'details', None)
+    if isinstance(details, dict):
+        details = details.get('error', details).get('details', [])
+    if isinstance(details, list):
+        for detail in details:
+            if isinstance(detail, dict) and 'retryDelay' in detail:
+                retry_after = _parse_duration(detail['retryDelay'])
+                if retry_after is not None:
+                    return retry_after
+
+    # Algumas mensagens trazem a dica apenas no texto
+    match = re.search(r'retry in ([\d.]+)\s*s', str(exc), re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+
+    return DEFAULT_RETRY_AFTER
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import time
+
+from sqlite_store import open_sqlite
+
+# Configuração padrão do cache de respostas
+DEFAULT_CACHE_PATH = 'gemini_cache.sqlite'
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_MB = 512
+
+# Quantidade de entradas removidas por vez durante a evicção
+EVICTION_BATCH = 100
+
+class CachedResponse:
+    """Resposta servida pelo cache, com a mesma interface usada de `GenerateContentResponse`."""
+
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+class ResponseCache:
+    """Cache persistente (SQLite) de respostas do Gemini, com TTL e evicção LRU por tamanho."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_DAYS * 86400,
+                 max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.conn = open_sqlite(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        self.purge_expired()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, prompt_text, config):
+        """Hash do modelo, do prompt e da configuração da chamada."""
+        if hasattr(config, 'model_dump'):
+            config = config.model_dump(mode='json', exclude_none=True)
+        payload = json.dumps(
+            {'model': model, 'prompt': prompt_text, 'config': config},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Retorna o texto guardado para a chave, ou None se não existir ou tiver expirado."""
+        row = self.conn.execute("SELECT value, size, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None:
+            self.misses += 1
+            return None
+        value, size, created_at = row
+        if now - created_at > self.ttl_seconds:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.misses += 1
+            return None
+        self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Guarda o texto da resposta e aplica a evicção por tamanho."""
+        size = len(value.encode('utf-8'))
+        now = time.time()
+        old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if old is not None:
+            self.total_bytes -= old[0]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, value, size, now, now),
+        )
+        self.total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        """Remove as entradas menos usadas até o cache caber no tamanho máximo."""
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT ?", (EVICTION_BATCH,)
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for key, size in rows:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    return
+
+    def purge_expired(self):
+        """Remove as entradas com TTL vencido."""
+        self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,121 @@
+import asyncio
+import random
+
+from rate_limiter import is_rate_limit_error
+
+# Classes de erro tratadas pela política de novas tentativas
+RATE_LIMIT = 'cota'
+NETWORK = 'rede'
+SERVER = 'servidor'
+AUTH = 'autenticacao'
+CLIENT = 'requisicao'
+SAFETY = 'bloqueio'
+PARSE = 'json'
+# Exceção que não veio da API nem do transporte: erro no próprio código
+INTERNAL = 'interno'
+
+# Classes que indicam problema na chave ou no serviço e contam para o circuit breaker da chave
+KEY_ERROR_CLASSES = {NETWORK, SERVER, AUTH}
+
+# Motivos de término que indicam resposta bloqueada pelos filtros de segurança
+BLOCKED_FINISH_REASONS = {'SAFETY', 'PROHIBITED_CONTENT', 'BLOCKLIST', 'SPII', 'RECITATION'}
+
+# Limite de tentativas de uma iteração somando todas as classes
+MAX_TOTAL_ATTEMPTS = 10
+
+class BackoffPolicy:
+    """Backoff exponencial com jitter completo e limite de tentativas."""
+
+    def __init__(self, max_attempts, base_delay, max_delay):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, rng=random):
+        """Espera antes da tentativa seguinte à `attempt` (1 = primeira falha)."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return rng.uniform(0, ceiling)
+
+DEFAULT_POLICIES = {
+    # A chave que recebeu o 429 já fica bloqueada no limitador; a nova tentativa vai para outra chave
+    RATE_LIMIT: BackoffPolicy(6, 1.0, 30.0),
+    NETWORK: BackoffPolicy(4, 1.0, 20.0),
+    SERVER: BackoffPolicy(4, 2.0, 60.0),
+    # Chave inválida ou sem permissão: vale tentar de novo, em outra chave
+    AUTH: BackoffPolicy(3, 0.5, 2.0),
+    # Requisição inválida (400/404): repetir daria o mesmo erro
+    CLIENT: BackoffPolicy(1, 0.0, 0.0),
+    # Com temperatura 0 o bloqueio se repete; não há nova tentativa
+    SAFETY: BackoffPolicy(1, 0.0, 0.0),
+    PARSE: BackoffPolicy(3, 0.5, 2.0),
+    # Um bug local se repete igual; não há nova tentativa e a chave não é penalizada
+    INTERNAL: BackoffPolicy(1, 0.0, 0.0),
+}
+
+def _error_code(exc):
+    code = getattr(exc, 'code', None)
+    if code is None:
+        code = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return code if isinstance(code, int) else None
+
+def classify_exception(exc):
+    """Classe de erro de uma exceção levantada na chamada ao modelo.
+
+    Exceções sem código HTTP que também não são de rede (TypeError, KeyError
+    etc.) vêm do nosso código, não do serviço, e ficam como `INTERNAL`.
+    """
+    if is_rate_limit_error(exc):
+        return RATE_LIMIT
+    code = _error_code(exc)
+    if code in (401, 403):
+        return AUTH
+    if code is not None and code >= 500:
+        return SERVER
+    if code is not None and code >= 400:
+        return CLIENT
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError, OSError)):
+        return NETWORK
+    # Erros de transporte do httpx (usado pelo google-genai) não herdam de OSError
+    if type(exc).__module__.startswith(('httpx', 'httpcore', 'aiohttp')):
+        return NETWORK
+    return INTERNAL
+
+def classify_response(response):
+    """Classe de erro de uma resposta sem texto utilizável, ou None se ela tiver texto."""
+    feedback = getattr(response, 'prompt_feedback', None)
+    if getattr(feedback, 'block_reason', None):
+        return SAFETY
+    for candidate in getattr(response, 'candidates', None) or []:
+        reason = getattr(candidate, 'finish_reason', None)
+        if getattr(reason, 'name', reason) in BLOCKED_FINISH_REASONS:
+            return SAFETY
+    if response is None or not getattr(response, 'text', None):
+        return PARSE
+    return None
+
+class RetryState:
+    """Tentativas de uma iteração, contadas por classe de erro.
+
+    `next_delay` registra uma falha e devolve a espera antes de tentar de
+    novo, ou None quando o orçamento da classe (ou o total) acabou.
+    """
+
+    def __init__(self, policies=None, max_total=MAX_TOTAL_ATTEMPTS, rng=random):
+        self.policies = policies or DEFAULT_POLICIES
+        self.max_total = max_total
+        self.rng = rng
+        self.failures = {}
+        self.total = 0
+
+    @property
+    def attempt(self):
+        """Número da tentativa em andamento (1 na primeira)."""
+        return self.total + 1
+
+    def next_delay(self, error_class):
+        self.total += 1
+        self.failures[error_class] = self.failures.get(error_class, 0) + 1
+        policy = self.policies.get(error_class, self.policies[SERVER])
+        if self.failures[error_class] >= policy.max_attempts or self.total >= self.max_total:
+            return None
+        return policy.delay(self.failures[error_class], self.rng)
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+# Peso de cada resultado na média móvel de saúde da chave
+HEALTH_ALPHA = 0.2
+MIN_HEALTH = 0.1
+
+# Erros seguidos a partir dos quais o circuit breaker da chave abre (cooldown)
+ERROR_THRESHOLD = 3
+BASE_COOLDOWN = 15.0
+MAX_COOLDOWN = 600.0
+
+class KeyState:
+    """Estado de uma chave no escalonador."""
+
+    def __init__(self, index, concurrency):
+        self.index = index
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.health = 1.0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def half_open(self):
+        """Breaker aberto cujo cooldown já terminou: a chave aceita uma única chamada de teste."""
+        return self.consecutive_errors >= ERROR_THRESHOLD
+
+class KeyScheduler:
+    """Escalonador global que envia cada chamada para a chave com capacidade livre.
+
+    Todas as linhas compartilham o mesmo conjunto de chaves: a cada chamada é
+    escolhida a chave que pode atender mais cedo (cota disponível, menos
+    chamadas em andamento e melhor saúde). Cada chave tem um circuit breaker:
+    depois de `ERROR_THRESHOLD` erros seguidos ela entra em cooldown (aberto),
+    tanto mais longo quanto pior for a saúde dela; no fim do cooldown recebe
+    uma única chamada de teste (meio-aberto), que fecha o breaker se der certo
+    ou reabre com cooldown maior se falhar.
+    """
+
+    def __init__(self, num_keys, concurrency_per_key, rate_limiter, logger):
+        self.keys = [KeyState(i, concurrency_per_key) for i in range(num_keys)]
+        self.rate_limiter = rate_limiter
+        self.logger = logger
+        self._condition = asyncio.Condition()
+
+    def _pick(self, estimated_tokens, now):
+        """Escolhe a melhor chave disponível ou None se nenhuma tiver vaga."""
+        best = None
+        best_score = None
+        for state in self.keys:
+            limit = 1 if state.half_open else state.concurrency
+            if state.in_flight >= limit or state.cooldown_until > now:
+                continue
+            wait = self.rate_limiter.for_key(state.index).time_until_ready(estimated_tokens, now)
+            load = (state.in_flight + 1) / (state.concurrency * state.health)
+            score = (wait, load)
+            if best_score is None or score < best_score:
+                best, best_score = state, score
+        return best
+
+    async def acquire(self, estimated_tokens):
+        """Aguarda uma chave com capacidade e reserva uma vaga nela; retorna o índice da chave."""
+        async with self._condition:
+            while True:
+                now = time.monotonic()
+                state = self._pick(estimated_tokens, now)
+                if state is not None:
+                    state.in_flight += 1
+                    return state.index
+
+                # Sem vaga: espera uma liberação ou o fim do cooldown mais próximo
+                cooldowns = [s.cooldown_until - now for s in self.keys if s.cooldown_until > now]
+                timeout = min(cooldowns) if cooldowns else None
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, key_index, error=None):
+        """Libera a vaga da chave e atualiza a saúde dela com o resultado da chamada."""
+        async with self._condition:
+            state = self.keys[key_index]
+            state.in_flight -= 1
+            if error is None:
+                if state.half_open:
+                    self.logger.info(f"Chave {key_index + 1} respondeu à chamada de teste; circuit breaker fechado")
+                state.consecutive_errors = 0
+                state.health = min(1.0, state.health * (1 - HEALTH_ALPHA) + HEALTH_ALPHA)
+            else:
+                state.consecutive_errors += 1
+                state.health = max(MIN_HEALTH, state.health * (1 - HEALTH_ALPHA))
+                if state.consecutive_errors >= ERROR_THRESHOLD:
+                    cooldown = BASE_COOLDOWN * 2 ** (state.consecutive_errors - ERROR_THRESHOLD) / state.health
+                    cooldown = min(MAX_COOLDOWN, cooldown)
+                    state.cooldown_until = time.monotonic() + cooldown
+                    self.logger.warning(f"Chave {key_index + 1} com {state.consecutive_errors} erros seguidos "
+                                        f"(saúde {state.health:.2f}); circuit breaker aberto por {cooldown:.1f}s")
+            self._condition.notify_all()
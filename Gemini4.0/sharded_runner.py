@@ -0,0 +1,268 @@
+import argparse
+import csv
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from csv_stream import DEFAULT_BATCH_SIZE, StreamingCsvWriter, iter_csv_rows, read_csv_header
+from dedup import doctor_key
+from journal import row_key
+
+# Script executado por cada shard
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gemini4.0.py')
+
+# Quantidade de chaves da API disponíveis (../apis/gemini.key a gemini8.key)
+NUM_KEYS = 8
+
+# Intervalo entre os relatórios de progresso dos shards, em segundos
+PROGRESS_INTERVAL = 30.0
+
+def setup_logging():
+    """Configura o logger do coordenador dos shards (só console; cada shard tem o próprio log)."""
+    logger = logging.getLogger("gemini4.0.shards")
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+def shard_of(row, shards):
+    """Shard da linha pelo hash do CRM+UF; as linhas do mesmo médico caem sempre no mesmo shard."""
+    key = doctor_key(row) or row_key(row)
+    digest = hashlib.md5(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+class ShardFiles:
+    """Arquivos de um shard dentro do diretório de trabalho."""
+
+    def __init__(self, workdir, shard):
+        self.dir = os.path.join(workdir, f'shard_{shard:03d}')
+        self.input = os.path.join(self.dir, 'input.csv')
+        self.output = os.path.join(self.dir, 'output.csv')
+        self.journal = os.path.join(self.dir, 'journal.jsonl')
+        self.log = os.path.join(self.dir, 'gemini4.0.log')
+        self.console = os.path.join(self.dir, 'console.txt')
+
+def split_input(input_path, workdir, shards, batch_size=DEFAULT_BATCH_SIZE):
+    """Divide o CSV de entrada em `shards` arquivos, mantendo a ordem original dentro de cada um.
+
+    A divisão é determinística: repetida (inclusive em outra máquina) sobre o
+    mesmo input, gera os mesmos shards. Retorna a quantidade de linhas de cada shard.
+    """
+    header = read_csv_header(input_path)
+    files = []
+    writers = []
+    for shard in range(shards):
+        paths = ShardFiles(workdir, shard)
+        os.makedirs(paths.dir, exist_ok=True)
+        f = open(paths.input, 'w', encoding='utf-8', newline='')
+        files.append(f)
+        writer = csv.DictWriter(f, fieldnames=header, restval='', extrasaction='ignore')
+        writer.writeheader()
+        writers.append(writer)
+    counts = [0] * shards
+    try:
+        for row in iter_csv_rows(input_path, batch_size):
+            shard = shard_of(row, shards)
+            writers[shard].writerow(row)
+            counts[shard] += 1
+    finally:
+        for f in files:
+            f.close()
+    return counts
+
+def assign_keys(shards_to_run, num_keys=NUM_KEYS):
+    """Distribui as chaves (numeradas a partir de 1) entre os shards executados nesta máquina."""
+    if len(shards_to_run) > num_keys:
+        raise ValueError(f"{len(shards_to_run)} shards para {num_keys} chaves; cada shard precisa de ao menos uma chave")
+    return {
+        shard: [key + 1 for key in range(num_keys) if key % len(shards_to_run) == position]
+        for position, shard in enumerate(shards_to_run)
+    }
+
+def count_lines(path):
+    """Linhas de dados já gravadas em um CSV (0 se ele ainda não existir)."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return max(0, sum(1 for _ in f) - 1)
+
+def shard_worker_args(worker_args, shard):
+    """Opções repassadas ao shard, com a porta do `--metrics-port` deslocada pelo número do shard.
+
+    Todos os shards rodam na mesma máquina; com a mesma porta, só o primeiro
+    conseguiria abrir o endpoint de métricas.
+    """
+    args = []
+    position = 0
+    while position < len(worker_args):
+        arg = worker_args[position]
+        if arg == '--metrics-port' and position + 1 < len(worker_args):
+            args += [arg, str(int(worker_args[position + 1]) + shard)]
+            position += 2
+            continue
+        if arg.startswith('--metrics-port='):
+            arg = f"--metrics-port={int(arg.split('=', 1)[1]) + shard}"
+        args.append(arg)
+        position += 1
+    return args
+
+def count_rows(path):
+    """Registros de um CSV completo, contados pelo leitor de CSV (campos podem ter quebras de linha)."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return sum(1 for _ in csv.DictReader(f))
+
+def check_output(paths, expected):
+    """Motivo pelo qual a saída do shard está incompleta, ou None se ela tiver as `expected` linhas."""
+    if not os.path.exists(paths.output):
+        return f"saída {paths.output} não foi gravada"
+    written = count_rows(paths.output)
+    if written != expected:
+        return f"saída {paths.output} tem {written} de {expected} linhas"
+    return None
+
+def run_shards(workdir, shards_to_run, counts, worker_args, logger):
+    """Executa um processo do gemini4.0.py por shard e aguarda todos; retorna os shards que falharam.
+
+    Um shard só é dado como concluído se terminar com código 0 e a saída dele
+    tiver uma linha para cada linha do input do shard. Cada shard usa o
+    próprio journal, então rodar de novo retoma de onde parou.
+    O cache de respostas e a base de médicos conhecidos são compartilhados
+    entre os shards (o SQLite serializa as escritas).
+    """
+    keys = assign_keys(shards_to_run)
+    processes = {}
+    for shard in shards_to_run:
+        paths = ShardFiles(workdir, shard)
+        command = [
+            sys.executable, WORKER_SCRIPT,
+            '--input', paths.input,
+            '--output', paths.output,
+            '--resume', paths.journal,
+            '--log-file', paths.log,
+            '--key-indices', ','.join(str(key) for key in keys[shard]),
+        ] + shard_worker_args(worker_args, shard)
+        console = open(paths.console, 'w', encoding='utf-8')
+        processes[shard] = (subprocess.Popen(command, stdout=console, stderr=subprocess.STDOUT), console)
+        logger.info(f"Shard {shard}: {counts[shard]} linhas, chaves {keys[shard]} (pid {processes[shard][0].pid})")
+
+    failed = []
+    started = time.monotonic()
+    last_report = started
+    while processes:
+        time.sleep(1.0)
+        for shard, (process, console) in list(processes.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            console.close()
+            del processes[shard]
+            paths = ShardFiles(workdir, shard)
+            problem = f"terminou com código {code}" if code != 0 else check_output(paths, counts[shard])
+            if problem:
+                failed.append(shard)
+                logger.error(f"Shard {shard} falhou: {problem}; veja {paths.console} e {paths.log}")
+            else:
+                logger.info(f"Shard {shard} concluído em {time.monotonic() - started:.0f}s")
+        if processes and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            progress = ', '.join(
+                f"{shard}: {count_lines(ShardFiles(workdir, shard).output)}/{counts[shard]}"
+                for shard in sorted(processes)
+            )
+            logger.info(f"Progresso dos shards em andamento - {progress}")
+    return sorted(failed)
+
+def merge_outputs(input_path, workdir, shards, output_path, batch_size=DEFAULT_BATCH_SIZE):
+    """Junta as saídas dos shards na ordem do CSV de entrada; retorna o total de linhas.
+
+    O input é percorrido de novo e, para cada linha, é lida a próxima linha da
+    saída do shard dela. Como cada shard grava na ordem do próprio input, o
+    resultado é o mesmo, qualquer que seja a ordem em que os shards terminaram.
+    """
+    files = [open(ShardFiles(workdir, shard).output, 'r', encoding='utf-8', newline='') for shard in range(shards)]
+    writer = None
+    total = 0
+    try:
+        readers = [csv.DictReader(f) for f in files]
+        writer = StreamingCsvWriter(output_path, readers[0].fieldnames)
+        for row in iter_csv_rows(input_path, batch_size):
+            shard = shard_of(row, shards)
+            result = next(readers[shard], None)
+            if result is None or row_key(result) != row_key(row):
+                raise RuntimeError(f"Saída do shard {shard} não corresponde ao input na linha {total + 1} "
+                                   f"(esperado {row_key(row)}); o shard está incompleto?")
+            writer.write(result)
+            total += 1
+    finally:
+        for f in files:
+            f.close()
+        if writer is not None:
+            writer.close()
+    return total
+
+def parse_shard_list(value):
+    """Converte '0,2,5' na lista de shards."""
+    return sorted({int(part) for part in value.split(',') if part.strip()})
+
+def parse_args(argv=None):
+    """Lê as opções do coordenador; as demais opções são repassadas a cada gemini4.0.py."""
+    parser = argparse.ArgumentParser(
+        description="Divide o input por hash do CRM e processa cada parte em um processo do gemini4.0.py.",
+        epilog="As opções não reconhecidas (ex.: --rpm, --pipeline) são repassadas a cada shard.",
+    )
+    parser.add_argument('--shards', type=int, required=True,
+                        help="Quantidade de partes em que o input é dividido")
+    parser.add_argument('--input', default='input.csv',
+                        help="Arquivo CSV de entrada")
+    parser.add_argument('--workdir',
+                        help="Diretório dos shards (padrão: shards_gemini_<N>); reutilizá-lo retoma a execução")
+    parser.add_argument('--run-shards', type=parse_shard_list,
+                        help="Shards executados nesta máquina, separados por vírgula (padrão: todos)")
+    parser.add_argument('--merge-only', action='store_true',
+                        help="Apenas junta as saídas já existentes dos shards")
+    parser.add_argument('--no-merge', action='store_true',
+                        help="Não junta as saídas (ex.: quando os outros shards rodam em outra máquina)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Quantidade de linhas lidas do CSV de entrada por vez")
+    args, worker_args = parser.parse_known_args(argv)
+    if args.shards < 1:
+        parser.error("--shards deve ser ao menos 1")
+    if args.run_shards and max(args.run_shards) >= args.shards:
+        parser.error(f"--run-shards deve usar shards de 0 a {args.shards - 1}")
+    args.workdir = args.workdir or f'shards_gemini_{args.shards}'
+    args.worker_args = worker_args + ['--batch-size', str(args.batch_size)]
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger = setup_logging()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    if not args.merge_only:
+        counts = split_input(args.input, args.workdir, args.shards, args.batch_size)
+        logger.info(f"{sum(counts)} linhas de {args.input} divididas em {args.shards} shards em {args.workdir}")
+        shards_to_run = args.run_shards or list(range(args.shards))
+        failed = run_shards(args.workdir, shards_to_run, counts, args.worker_args, logger)
+        if failed:
+            logger.critical(f"Shards com falha: {failed}; rode de novo com o mesmo --workdir para retomá-los")
+            return 1
+        if args.no_merge:
+            return 0
+
+    output_path = f'output_gemini_{timestamp}.csv'
+    try:
+        total = merge_outputs(args.input, args.workdir, args.shards, output_path, args.batch_size)
+    except (OSError, RuntimeError) as e:
+        logger.critical(f"Não foi possível juntar as saídas dos shards: {str(e)}")
+        return 1
+    logger.info(f"Saídas dos {args.shards} shards juntadas em {output_path} ({total} linhas)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
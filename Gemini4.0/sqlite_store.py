@@ -0,0 +1,17 @@
+import sqlite3
+
+# Tempo máximo de espera pelo lock de escrita do arquivo, em segundos
+BUSY_TIMEOUT = 60.0
+
+def open_sqlite(path):
+    """Abre um arquivo SQLite compartilhado por vários processos (shards, workers da fila).
+
+    A conexão fica em autocommit (as transações são abertas explicitamente),
+    em modo WAL para que leituras não bloqueiem a escrita, e espera até
+    `BUSY_TIMEOUT` segundos pelo lock de outro processo em vez de falhar com
+    "database is locked".
+    """
+    conn = sqlite3.connect(path, isolation_level=None, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
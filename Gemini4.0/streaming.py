@@ -0,0 +1,76 @@
+import time
+
+from json_extract import JsonExtractor
+
+class StreamedResponse:
+    """Resposta montada a partir de um stream, com a mesma interface usada de `GenerateContentResponse`.
+
+    `first_object_seconds` é o tempo desde o envio até o JSON completo chegar
+    (None se o stream terminou sem JSON) e `cancelled` indica que o stream foi
+    encerrado antes do fim, assim que o JSON ficou pronto.
+    """
+
+    def __init__(self, text, usage_metadata=None, first_object_seconds=None, total_seconds=None, cancelled=False):
+        self.text = text
+        self.usage_metadata = usage_metadata
+        self.first_object_seconds = first_object_seconds
+        self.total_seconds = total_seconds
+        self.cancelled = cancelled
+
+async def read_stream(chunks, kind='object', started=None):
+    """Lê os pedaços da resposta até surgir um JSON completo e então encerra o stream.
+
+    O texto após o JSON (explicações que o modelo costuma acrescentar) não é
+    esperado: o stream é fechado, o que encerra a conexão e a geração.
+    """
+    started = time.monotonic() if started is None else started
+    extractor = JsonExtractor(kind)
+    parts = []
+    usage = None
+    first_object_seconds = None
+    try:
+        async for chunk in chunks:
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            text = chunk.text or ''
+            if not text:
+                continue
+            parts.append(text)
+            if extractor.feed(text) is not None:
+                first_object_seconds = time.monotonic() - started
+                return StreamedResponse(''.join(parts), usage, first_object_seconds,
+                                        first_object_seconds, cancelled=True)
+    finally:
+        aclose = getattr(chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+    return StreamedResponse(''.join(parts), usage, first_object_seconds, time.monotonic() - started)
+
+class StreamStats:
+    """Contadores das respostas em stream: latência até o JSON e streams encerrados antes do fim."""
+
+    def __init__(self):
+        self.streams = 0
+        self.cancelled = 0
+        self.first_object_total = 0.0
+        self.first_object_count = 0
+        self.full_total = 0.0
+        self.full_count = 0
+
+    def record(self, response):
+        self.streams += 1
+        if response.cancelled:
+            self.cancelled += 1
+        if response.first_object_seconds is not None:
+            self.first_object_total += response.first_object_seconds
+            self.first_object_count += 1
+        if not response.cancelled and response.total_seconds is not None:
+            self.full_total += response.total_seconds
+            self.full_count += 1
+
+    def summary(self):
+        text = f"{self.streams} respostas, {self.cancelled} encerradas ao completar o JSON"
+        if self.first_object_count:
+            text += f"; latência média até o JSON {self.first_object_total / self.first_object_count:.2f}s"
+        if self.full_count:
+            text += f"; até o fim do stream (sem JSON ou sem encerramento) {self.full_total / self.full_count:.2f}s"
+        return text
@@ -0,0 +1,137 @@
+import json
+from google.genai import types
+
+from json_extract import extract_json_object
+from log_pipeline import payload_extra
+
+# Campos de cada tipo de resposta, com os nomes pedidos nos prompts
+GENERAL_RESPONSE_FIELDS = [
+    'first_name', 'last_name', 'especialidade_medica',
+    'endereco_completo_a1', 'logradouro_a1', 'numero_a1', 'complemento_a1', 'bairro_a1',
+    'cep_a1', 'cidade_a1', 'estado_a1',
+    'phone_a1', 'phone_a2', 'cell_phone_a1', 'cell_phone_a2',
+    'email_a1', 'email_a2',
+]
+PHONE_RESPONSE_FIELDS = ['phone_a1', 'phone_a2', 'cell_phone_a1', 'cell_phone_a2']
+EMAIL_RESPONSE_FIELDS = ['email_a1', 'email_a2']
+CHANCE_VALUES = ['MUITO PROVAVEL', 'PROVAVEL', 'NADA PROVAVEL']
+
+def _object_schema(fields, enums=None):
+    """Schema de um objeto com todos os campos obrigatórios e do tipo string."""
+    enums = enums or {}
+    properties = {
+        field: types.Schema(type=types.Type.STRING, enum=enums.get(field))
+        for field in fields
+    }
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties=properties,
+        required=list(fields),
+        property_ordering=list(fields),
+    )
+
+GENERAL_SCHEMA = _object_schema(GENERAL_RESPONSE_FIELDS)
+PHONE_SCHEMA = _object_schema(PHONE_RESPONSE_FIELDS)
+EMAIL_SCHEMA = _object_schema(EMAIL_RESPONSE_FIELDS)
+CHANCE_SCHEMA = _object_schema(
+    ['email1', 'chance_email_a1', 'email2', 'chance_email_a2'],
+    enums={'chance_email_a1': CHANCE_VALUES, 'chance_email_a2': CHANCE_VALUES},
+)
+
+# Iterações que não usam a busca e podem pedir o schema já na chamada principal
+SEARCHLESS_ITERATIONS = {8}
+
+REFORMAT_PROMPT = """
+Converta a resposta abaixo em um objeto JSON que siga exatamente o schema informado.
+Use apenas as informações presentes na resposta; não invente dados.
+Se um campo não aparecer na resposta, preencha com "".
+
+**Resposta:**
+{text}
+"""
+
+def schema_for_iteration(iteration):
+    """Schema da resposta esperada em cada iteração."""
+    if iteration < 6:
+        return GENERAL_SCHEMA
+    if iteration == 6:
+        return PHONE_SCHEMA
+    if iteration == 7:
+        return EMAIL_SCHEMA
+    return CHANCE_SCHEMA
+
+def build_structured_request(prompt_text, schema):
+    """Monta uma chamada sem ferramentas, com saída JSON restrita ao schema."""
+    contents = [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part.from_text(text=prompt_text),
+            ],
+        ),
+    ]
+    config = types.GenerateContentConfig(
+        temperature=0,
+        response_mime_type="application/json",
+        response_schema=schema,
+        # A reformatação não precisa de raciocínio; sem ele a chamada sai mais barata
+        thinking_config=types.ThinkingConfig(thinking_budget=0),
+    )
+    return contents, config
+
+class StructuredOutput:
+    """Modo de saída estruturada: cada iteração recebe um JSON garantido pelo schema.
+
+    A busca do Google não pode ser combinada com `response_schema`, então as
+    iterações com busca continuam em texto livre; quando esse texto não traz
+    um JSON válido, uma segunda chamada curta, sem busca e com o schema da
+    iteração, converte a resposta em vez de refazer a pesquisa. As iterações
+    sem busca (avaliação dos e-mails) pedem o schema já na chamada principal.
+    """
+
+    def __init__(self, engine, model, logger):
+        self.engine = engine
+        self.model = model
+        self.logger = logger
+        self.reformatted = 0
+        self.failed = 0
+
+    def direct_schema(self, iteration):
+        """Schema a usar na chamada principal, ou None se a iteração usa a busca."""
+        if iteration in SEARCHLESS_ITERATIONS:
+            return schema_for_iteration(iteration)
+        return None
+
+    async def reformat(self, iteration, response_text):
+        """Converte o texto livre de uma resposta no JSON da iteração; retorna None se falhar."""
+        prompt_text = REFORMAT_PROMPT.format(text=response_text)
+        contents, config = build_structured_request(prompt_text, schema_for_iteration(iteration))
+        cache_key = self.engine.cache_key(self.model, prompt_text, config)
+        try:
+            response = await self.engine.generate_content(
+                model=self.model,
+                contents=contents,
+                config=config,
+                prompt_text=prompt_text,
+                cache_key=cache_key,
+            )
+        except Exception as e:
+            self.failed += 1
+            self.logger.error(f"Erro na reformatação da iteração {iteration + 1}: {str(e)}")
+            return None
+        text = getattr(response, 'text', None) or ''
+        try:
+            new_data = json.loads(text)
+        except json.JSONDecodeError:
+            new_data = extract_json_object(text)
+        if not isinstance(new_data, dict):
+            self.failed += 1
+            self.logger.error(f"Reformatação da iteração {iteration + 1} sem JSON válido",
+                              extra=payload_extra(text, error=True))
+            return None
+        self.reformatted += 1
+        self.engine.remember(cache_key, text)
+        return new_data
+
+    def summary(self):
+        return f"{self.reformatted} respostas reformatadas, {self.failed} falhas na reformatação"
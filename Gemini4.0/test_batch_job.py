@@ -0,0 +1,114 @@
+import csv
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+from journal import RowJournal
+from knowledge_store import KnowledgeStore
+from planner import GENERAL_FIELDS
+
+# O script principal tem um ponto no nome e não pode ser importado com `import`
+_spec = importlib.util.spec_from_file_location(
+    'gemini40', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gemini4.0.py'))
+gemini = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gemini)
+
+# Formato mínimo do input documentado no README
+MINIMAL_COLUMNS = ['CRM', 'UF', 'Firstname', 'LastName', 'Medical specialty']
+
+def write_input(path, rows, columns=None):
+    columns = columns or [column for column in gemini.OUTPUT_COLUMNS if not column.startswith('chance_')]
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, restval='')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+class OfflineFirstIterationTest(unittest.TestCase):
+    """Iteração 1 pela Batch API com `--batch-api-local` (`LocalBatchClient` com as respostas do mock_server)."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.logger = logging.getLogger('gemini4.0.test')
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+        self.input = os.path.join(self.tmp.name, 'input.csv')
+        self.knowledge_path = os.path.join(self.tmp.name, 'conhecidos.sqlite')
+        write_input(self.input, [
+            {'Hash': 'a', 'CRM': '100', 'UF': 'SP', 'Firstname': 'Ana', 'LastName': 'Souza'},
+            {'Hash': 'b', 'CRM': '0100', 'UF': 'sp', 'Firstname': 'Ana', 'LastName': 'Souza'},
+            {'Hash': 'c', 'CRM': '200', 'UF': 'RJ', 'Firstname': 'Bruno', 'LastName': 'Lima'},
+            {'Hash': 'd', 'CRM': '300', 'UF': 'MG', 'Firstname': 'Carla', 'LastName': 'Reis'},
+        ])
+        # O médico da linha 'c' já é conhecido com todos os campos: não precisa da iteração 1
+        known = {'CRM': '200', 'UF': 'RJ'}
+        known.update({field: 'conhecido' for field in GENERAL_FIELDS})
+        store = KnowledgeStore(self.knowledge_path)
+        store.record(known, 0, {})
+        store.close()
+
+    def run_first_iteration(self, *extra):
+        args = gemini.parse_args([
+            '--input', self.input,
+            '--output', os.path.join(self.tmp.name, 'output.csv'),
+            '--knowledge-path', self.knowledge_path,
+            '--batch-poll-interval', '0',
+            '--batch-api-local',
+        ] + list(extra))
+        journal = RowJournal(os.path.join(self.tmp.name, 'journal.jsonl'))
+        try:
+            entries = gemini.run_offline_first_iteration(
+                [], '', self.logger, args, journal, 'T', {})
+        finally:
+            journal.close()
+        with open(os.path.join(self.tmp.name, 'batch_job_gemini_T.jsonl'), encoding='utf-8') as f:
+            self.batch_lines = [json.loads(line) for line in f]
+        requested = [line['key'] for line in self.batch_lines]
+        return entries, requested
+
+    def test_job_skips_duplicates_and_known_doctors(self):
+        entries, requested = self.run_first_iteration()
+        self.assertEqual(requested, ['a', 'd'])
+        self.assertEqual(sorted(entries), ['a', 'd'])
+        for entry in entries.values():
+            self.assertEqual(entry['iteration'], 0)
+            self.assertEqual(entry['data']['Address A1'], 'Rua das Flores')
+        journal = RowJournal.load(os.path.join(self.tmp.name, 'journal.jsonl'))
+        self.assertEqual(sorted(journal), ['a', 'd'])
+
+    def test_no_dedup_sends_every_row(self):
+        entries, requested = self.run_first_iteration('--no-dedup', '--no-knowledge')
+        self.assertEqual(requested, ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(entries), 4)
+
+    def test_stale_known_fields_are_journalled(self):
+        # Com validade zero, os campos conhecidos do médico 'c' estão vencidos: ele entra no job
+        entries, requested = self.run_first_iteration('--knowledge-max-age-days', '0')
+        self.assertEqual(requested, ['a', 'c', 'd'])
+        self.assertEqual(entries['c']['stale']['Phone A2'], 'conhecido')
+        journal = RowJournal.load(os.path.join(self.tmp.name, 'journal.jsonl'))
+        self.assertEqual(journal['c']['stale'], entries['c']['stale'])
+        self.assertNotIn('stale', journal['a'])
+
+    def test_context_cache_uses_the_shared_prompt(self):
+        self.run_first_iteration('--context-cache')
+        request = self.batch_lines[0]['request']
+        system_text = request['systemInstruction']['parts'][0]['text']
+        self.assertIn('Siga apenas as instruções da seção da tarefa atual', system_text)
+        self.assertTrue(request['contents'][0]['parts'][0]['text'].startswith('**Tarefa atual:**'))
+
+    def test_minimal_input_format(self):
+        write_input(self.input, [
+            {'CRM': '100', 'UF': 'SP', 'Firstname': 'Ana', 'LastName': 'Souza', 'Medical specialty': 'Cardiologia'},
+            {'CRM': '300', 'UF': 'MG', 'Firstname': 'Carla', 'LastName': 'Reis', 'Medical specialty': 'Pediatria'},
+        ], MINIMAL_COLUMNS)
+        entries, requested = self.run_first_iteration('--no-knowledge')
+        self.assertEqual(requested, ['100/SP', '300/MG'])
+        self.assertEqual(entries['100/SP']['data']['Address A1'], 'Rua das Flores')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+from dedup import ROW_OWN_FIELDS, doctor_key
+from sqlite_store import open_sqlite
+
+# Configuração padrão da fila de trabalho distribuída
+DEFAULT_VISIBILITY_TIMEOUT = 600.0
+DEFAULT_MAX_DELIVERIES = 3
+DEFAULT_LEASE_SIZE = 16
+DEFAULT_POLL_INTERVAL = 5.0
+
+# Estados das tarefas
+PENDING = 'pendente'
+LEASED = 'reservada'
+DONE = 'concluida'
+FAILED = 'falhou'
+DUPLICATE = 'duplicata'
+
+class WorkQueue:
+    """Fila de linhas em um arquivo SQLite, compartilhada entre coordenador e workers.
+
+    O coordenador enfileira as linhas do input (uma tarefa por linha, na
+    posição original) e os workers reservam tarefas por `visibility_timeout`
+    segundos, renovando a reserva enquanto processam. Se um worker cair, a
+    reserva expira e a tarefa volta a ser entregue a outro worker; depois de
+    `max_deliveries` entregas sem conclusão ela é marcada como falha e sai
+    com os dados originais. Linhas repetidas (mesmo CRM+UF) não viram tarefas:
+    apontam para a primeira ocorrência e recebem o resultado dela na saída.
+    """
+
+    def __init__(self, path, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, max_deliveries=DEFAULT_MAX_DELIVERIES):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self.conn = open_sqlite(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                doctor TEXT,
+                source_id INTEGER,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                lease_owner TEXT,
+                lease_expires REAL,
+                deliveries INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_doctor ON tasks (doctor)")
+
+    def enqueue(self, rows, dedup=True):
+        """Enfileira as linhas na ordem em que chegam; retorna quantas tarefas novas foram criadas.
+
+        Pode ser chamado de novo sobre o mesmo input: as posições já
+        enfileiradas são mantidas como estão, o que permite retomar a execução.
+        """
+        created = 0
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for position, row in enumerate(rows):
+                doctor = doctor_key(row) if dedup else None
+                source_id = None
+                if doctor is not None:
+                    found = self.conn.execute(
+                        "SELECT id FROM tasks WHERE doctor = ? AND source_id IS NULL AND id < ? ORDER BY id LIMIT 1",
+                        (doctor, position),
+                    ).fetchone()
+                    source_id = found[0] if found else None
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO tasks (id, doctor, source_id, payload, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (position, doctor, source_id, json.dumps(row, ensure_ascii=False),
+                     DUPLICATE if source_id is not None else PENDING, now),
+                )
+                created += cursor.rowcount
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return created
+
+    def _fail_exhausted(self, now):
+        """Marca como falha as reservas expiradas que já esgotaram as entregas; retorna quantas."""
+        return self.conn.execute(
+            "UPDATE tasks SET status = ?, lease_owner = NULL, updated_at = ? "
+            "WHERE status = ? AND lease_expires < ? AND deliveries >= ?",
+            (FAILED, now, LEASED, now, self.max_deliveries),
+        ).rowcount
+
+    def reap(self):
+        """Recolhe as reservas expiradas sem entregas restantes, mesmo sem nenhum worker ativo."""
+        return self._fail_exhausted(time.time())
+
+    def lease(self, owner, limit=DEFAULT_LEASE_SIZE):
+        """Reserva até `limit` tarefas pendentes ou com reserva expirada; retorna [(id, linha)]."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Reservas expiradas que já esgotaram as entregas não voltam para a fila
+            self._fail_exhausted(now)
+            rows = self.conn.execute(
+                "SELECT id, payload FROM tasks WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY id LIMIT ?",
+                (PENDING, LEASED, now, limit),
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE tasks SET status = ?, lease_owner = ?, lease_expires = ?, deliveries = deliveries + 1, "
+                "updated_at = ? WHERE id = ?",
+                [(LEASED, owner, now + self.visibility_timeout, now, task_id) for task_id, _ in rows],
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [(task_id, json.loads(payload)) for task_id, payload in rows]
+
+    def extend(self, owner, task_ids):
+        """Renova a reserva das tarefas que o worker ainda está processando."""
+        now = time.time()
+        self.conn.executemany(
+            "UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+            [(now + self.visibility_timeout, now, task_id, LEASED, owner) for task_id in task_ids],
+        )
+
+    def complete(self, task_id, result):
+        """Grava o resultado da tarefa; se ela já foi concluída por outro worker, o primeiro resultado vale."""
+        self.conn.execute(
+            "UPDATE tasks SET status = ?, result = ?, lease_owner = NULL, updated_at = ? WHERE id = ? AND status != ?",
+            (DONE, json.dumps(result, ensure_ascii=False, default=str), time.time(), task_id, DONE),
+        )
+
+    def counts(self):
+        """Quantidade de tarefas em cada estado."""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def unfinished(self):
+        """Tarefas ainda pendentes ou reservadas."""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)", (PENDING, LEASED)
+        ).fetchone()[0]
+
+    def results(self):
+        """Itera sobre o resultado de cada linha, na ordem do input.
+
+        Duplicatas recebem uma cópia do resultado da primeira ocorrência com as
+        próprias colunas de identificação; tarefas com falha saem com os dados originais.
+        """
+        cursor = self.conn.execute("""
+            SELECT t.payload, t.result, s.result
+            FROM tasks t LEFT JOIN tasks s ON t.source_id = s.id
+            ORDER BY t.id
+        """)
+        for payload, result, source_result in cursor:
+            row = json.loads(payload)
+            if result is not None:
+                yield json.loads(result)
+            elif source_result is not None:
+                shared = json.loads(source_result)
+                for field in ROW_OWN_FIELDS:
+                    if field in row:
+                        shared[field] = row[field]
+                yield shared
+            else:
+                yield row
+
+    def close(self):
+        self.conn.close()
+
+class QueueSource:
+    """Lado do worker: entrega ao motor as linhas reservadas na fila e grava os resultados.
+
+    `rows()` é um iterador assíncrono para o `EnrichmentEngine`, que só pede
+    a próxima linha quando tem um worker livre; cada linha é reservada nesse
+    momento, para que um worker não segure linhas que outro poderia estar
+    processando. Enquanto a fila tiver tarefas reservadas por outros workers,
+    ele continua consultando, para assumir as que expirarem. `complete` deve
+    ser usado como `on_result` do motor, que entrega os resultados na ordem
+    das linhas.
+    """
+
+    def __init__(self, queue, owner, logger, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.queue = queue
+        self.owner = owner
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.in_flight = deque()
+        self.completed = 0
+        self.heartbeat = None
+        self.exhausted = False
+
+    async def rows(self):
+        self.heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                tasks = self.queue.lease(self.owner, 1)
+                if not tasks:
+                    if self.queue.unfinished() == 0:
+                        return
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                for task_id, row in tasks:
+                    self.in_flight.append(task_id)
+                    yield row
+        finally:
+            # As reservas continuam sendo renovadas até a última linha em andamento terminar
+            self.exhausted = True
+            self._stop_heartbeat()
+
+    def _stop_heartbeat(self):
+        if self.exhausted and not self.in_flight and self.heartbeat is not None:
+            self.heartbeat.cancel()
+
+    async def _heartbeat(self):
+        """Renova as reservas em andamento a cada terço do `visibility_timeout`."""
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 3)
+            if self.in_flight:
+                self.queue.extend(self.owner, list(self.in_flight))
+
+    def complete(self, result):
+        self.queue.complete(self.in_flight.popleft(), result)
+        self.completed += 1
+        self._stop_heartbeat()